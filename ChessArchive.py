@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+game archive: games stored as 16 bit moves (a packed move without its flag bits, which the board gives back)
+behind a small header, in an append only file read through mmap, so a game costs 2 bytes a ply plus its tags
+three files: the records (path), their offsets (path + ".off", 8 bytes a game) and an optional position index
+(path + ".idx"), sorted (zobrist key, game, ply) entries that find every game reaching a position with one
+binary search
+a record is written before its offset, so a writer that dies half way leaves no broken game behind
+"""
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import ChessEngine
+import ChessPgn
+from ChessBitboard import SQ_TO_RC
+from ChessEngine import CASTLE_FLAG, EN_PASSANT_FLAG
+from ChessFen import START_FEN
+
+ARCHIVE_MAGIC = b"CGA1"
+INDEX_MAGIC = b"CGI1"
+RESULTS = ("*", "1-0", "0-1", "1/2-1/2")  # result byte of a record
+RECORD = struct.Struct("<HBH")  # plies, result, length of the tags that follow (then the moves)
+OFFSET = struct.Struct("<Q")
+INDEX_HEADER = struct.Struct("<4sII")  # magic, games indexed, plies indexed per game (0 for all)
+ENTRY = struct.Struct("<QIH")  # zobrist key, game, ply (the position after that many moves)
+_KEY = struct.Struct("<Q")
+RUN_ENTRIES = 2000000  # index entries sorted in memory at a time while building, the rest is merged from disk
+
+
+def encode_move(m):
+    '''
+    16 bit form of a packed move: start, end and promotion, the flag bits are left out
+    '''
+    return m & 0x7FFF
+
+
+def decode_move(board, move):
+    '''
+    Packed move from its 16 bit form, given the board it is played on (castling and en passant read off it)
+    '''
+    start_row, start_col = SQ_TO_RC[move & 63]
+    end_row, end_col = SQ_TO_RC[move >> 6 & 63]
+    piece = board[start_row][start_col]
+    if piece[1] == "K" and abs(end_col - start_col) == 2:
+        return move | CASTLE_FLAG << 15
+    if piece[1] == "P" and end_col != start_col and board[end_row][end_col] == "--":
+        return move | EN_PASSANT_FLAG << 15
+    return move
+
+
+def _pack_tags(headers):
+    clean = lambda text: str(text).replace("\t", " ").replace("\n", " ")
+    return "\n".join("%s\t%s" % (clean(tag), clean(value)) for tag, value in headers.items()).encode("utf-8")
+
+
+def _unpack_tags(data):
+    if not data:
+        return {}
+    return dict(line.split("\t", 1) for line in data.decode("utf-8").split("\n"))
+
+
+class ArchiveWriter:
+    '''
+    Appends games to an archive (created when missing), use as a context manager or call close()
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.data = open(path, "ab")
+        if self.data.tell() == 0:
+            self.data.write(ARCHIVE_MAGIC)
+        self.offsets = open(path + ".off", "ab")
+        self.games = self.offsets.tell() // OFFSET.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, moves, result="*", headers=None, fen=START_FEN):
+        '''
+        Appends a game of packed moves played from fen, returns its game number
+        the moves are trusted to be legal, headers is a dict of PGN style tags
+        '''
+        headers = dict(headers or {})
+        if fen != START_FEN:
+            headers["FEN"] = fen
+        headers.pop("Result", None)  # kept in the record itself
+        tags = _pack_tags(headers)
+        offset = self.data.seek(0, os.SEEK_END)
+        self.data.write(RECORD.pack(len(moves), RESULTS.index(result), len(tags)))
+        self.data.write(tags)
+        self.data.write(struct.pack("<%dH" % len(moves), *(encode_move(m) for m in moves)))
+        self.data.flush()
+        self.offsets.write(OFFSET.pack(offset))
+        self.offsets.flush()
+        self.games += 1
+        return self.games - 1
+
+    def close(self):
+        self.data.close()
+        self.offsets.close()
+
+
+class GameArchive:
+    '''
+    An archive opened read only through mmap, games are decoded only when asked for
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.files = []
+        self.data = self._map(path)
+        if self.data[:4] != ARCHIVE_MAGIC:
+            self.close()
+            raise ValueError("%s is not a game archive" % path)
+        self.offsets = self._map(path + ".off")
+        self.games = len(self.offsets) // OFFSET.size
+        self.index = None
+        self.indexed_games = 0  # games [0, indexed_games) are in the position index
+        self.index_entries = 0
+        if os.path.exists(path + ".idx"):
+            self.index = self._map(path + ".idx")
+            magic, self.indexed_games, self.index_plies = INDEX_HEADER.unpack_from(self.index)
+            if magic != INDEX_MAGIC:
+                self.close()
+                raise ValueError("%s.idx is not a position index" % path)
+            self.index_entries = (len(self.index) - INDEX_HEADER.size) // ENTRY.size
+
+    def _map(self, path):
+        file = open(path, "rb")
+        self.files.append(file)
+        # an empty file can't be mmapped, and has nothing in it anyway
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size else b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.games
+
+    def close(self):
+        for data in (getattr(self, name, None) for name in ("data", "offsets", "index")):
+            if isinstance(data, mmap.mmap):
+                data.close()
+        for file in self.files:
+            file.close()
+        self.files = []
+
+    def record(self, game):
+        '''
+        (headers, result, 16 bit moves) of a game
+        '''
+        if not 0 <= game < self.games:
+            raise IndexError("no game %d" % game)
+        offset = OFFSET.unpack_from(self.offsets, game * OFFSET.size)[0]
+        plies, result, tag_length = RECORD.unpack_from(self.data, offset)
+        start = offset + RECORD.size
+        headers = _unpack_tags(self.data[start:start + tag_length])
+        start += tag_length
+        return headers, RESULTS[result], struct.unpack_from("<%dH" % plies, self.data, start)
+
+    def headers(self, game):
+        '''
+        Tags of a game, with its Result
+        '''
+        headers, result, _ = self.record(game)
+        headers["Result"] = result
+        return headers
+
+    def replay(self, game, max_plies=None):
+        '''
+        Yields (ply, gs) from the start of a game to its end, gs is one GameState moved along with make_packed
+        '''
+        headers, _, moves = self.record(game)
+        gs = ChessEngine.GameState.from_fen(headers.get("FEN", START_FEN))
+        yield 0, gs
+        for ply, move in enumerate(moves[:max_plies], 1):
+            gs.make_packed(decode_move(gs.board, move))
+            yield ply, gs
+
+    def moves(self, game):
+        '''
+        The packed moves of a game (flags restored)
+        '''
+        return self.state(game).moves_played()
+
+    def state(self, game, ply=None):
+        '''
+        GameState of a game after ply moves (after all of them by default)
+        '''
+        for _, gs in self.replay(game, ply):
+            pass
+        return gs
+
+    def pgn(self, game):
+        '''
+        PGN text of a game
+        '''
+        headers, result, moves = self.record(game)
+        gs = ChessEngine.GameState.from_fen(headers.pop("FEN", START_FEN))
+        for move in moves:
+            gs.make_move(ChessEngine.Move.from_packed(decode_move(gs.board, move), gs.board))
+        return ChessPgn.game_to_pgn(gs, headers, result)
+
+    def _lower_bound(self, key):
+        index = self.index
+        low, high = 0, self.index_entries
+        while low < high:
+            middle = (low + high) >> 1
+            if _KEY.unpack_from(index, INDEX_HEADER.size + middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, position, limit=None):
+        '''
+        [(game, ply)] of every indexed game reaching a position (a GameState or its zobrist key), in game order
+        games appended since the index was last built aren't found until build_index runs again
+        '''
+        if self.index is None:
+            raise ValueError("%s has no position index, run build_index" % self.path)
+        key = position if isinstance(position, int) else position.zobrist_key
+        found = []
+        offset = INDEX_HEADER.size + self._lower_bound(key) * ENTRY.size
+        end = INDEX_HEADER.size + self.index_entries * ENTRY.size
+        while offset < end and (limit is None or len(found) < limit):
+            entry_key, game, ply = ENTRY.unpack_from(self.index, offset)
+            if entry_key != key:
+                break
+            found.append((game, ply))
+            offset += ENTRY.size
+        return found
+
+    def count(self, position):
+        '''
+        Indexed occurrences of a position, two binary searches however many there are
+        '''
+        if self.index is None:
+            raise ValueError("%s has no position index, run build_index" % self.path)
+        key = position if isinstance(position, int) else position.zobrist_key
+        return (self._lower_bound(key + 1) if key < (1 << 64) - 1 else self.index_entries) - self._lower_bound(key)
+
+
+def _read_entries(path, skip=0):
+    '''
+    Index entries of a sorted file as combined ints (key << 48 | game << 16 | ply), read a block at a time
+    '''
+    with open(path, "rb") as file:
+        file.seek(skip)
+        while True:
+            block = file.read(ENTRY.size * 65536)
+            if not block:
+                return
+            for key, game, ply in ENTRY.iter_unpack(block):
+                yield key << 48 | game << 16 | ply
+
+
+def _write_run(entries, directory):
+    entries.sort()
+    run = tempfile.NamedTemporaryFile("wb", dir=directory, suffix=".run", delete=False)
+    with run:
+        for i in range(0, len(entries), 65536):
+            run.write(b"".join(ENTRY.pack(entry >> 48, entry >> 16 & 0xFFFFFFFF, entry & 0xFFFF)
+                               for entry in entries[i:i + 65536]))
+    return run.name
+
+
+def build_index(path, max_plies=0, log=None):
+    '''
+    Brings the position index of an archive up to date: games added since the last build are replayed, their
+    positions sorted in runs of RUN_ENTRIES and merged with the existing index, so memory stays bounded
+    max_plies limits the plies indexed per game (0 for all), an existing index keeps the limit it was built with
+    returns the number of entries in the index
+    '''
+    with GameArchive(path) as archive:
+        start_game = archive.indexed_games
+        if archive.index is not None:
+            max_plies = archive.index_plies
+        runs = []
+        if archive.index is not None and archive.index_entries:
+            runs.append(None)  # the old index, merged in as it is
+        entries = []
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            for game in range(start_game, archive.games):
+                for ply, gs in archive.replay(game, max_plies or None):
+                    entries.append(gs.zobrist_key << 48 | game << 16 | ply)
+                if len(entries) >= RUN_ENTRIES:
+                    runs.append(_write_run(entries, directory))
+                    entries = []
+                if log and (game + 1) % 100000 == 0:
+                    log("%d games replayed" % (game + 1))
+            entries.sort()
+            sources = [_read_entries(run) if run else _read_entries(path + ".idx", INDEX_HEADER.size) for run in runs]
+            sources.append(iter(entries))
+            written = 0
+            with open(path + ".idx.tmp", "wb") as file:
+                file.write(INDEX_HEADER.pack(INDEX_MAGIC, archive.games, max_plies))
+                block = []
+                for entry in heapq.merge(*sources):
+                    block.append(ENTRY.pack(entry >> 48, entry >> 16 & 0xFFFFFFFF, entry & 0xFFFF))
+                    if len(block) == 65536:
+                        file.write(b"".join(block))
+                        block = []
+                file.write(b"".join(block))
+                written = (file.tell() - INDEX_HEADER.size) // ENTRY.size
+        finally:
+            for run in runs:
+                if run:
+                    os.remove(run)
+        games = archive.games
+    os.replace(path + ".idx.tmp", path + ".idx")
+    if log:
+        log("%d games, %d positions indexed in %s.idx" % (games, written, path))
+    return written
+
+
+def import_pgn(sources, path, index=True, log=None):
+    '''
+    Appends the games of PGN files to an archive (moves checked as they are parsed, a broken game is kept up to
+    the last good move), then updates the position index unless index is False, returns the games added
+    '''
+    added = 0
+    start = time.perf_counter()
+    with ArchiveWriter(path) as writer:
+        for source in sources:
+            for game in ChessPgn.read_games(source, replay_moves=False):
+                fen = game.headers.get("FEN", START_FEN)
+                try:
+                    gs = ChessEngine.GameState.from_fen(fen)
+                except ValueError:
+                    continue
+                moves = []
+                for san in game.sans:
+                    try:
+                        m = gs.parse_san(san)
+                    except ValueError:
+                        break
+                    gs.make_packed(m)
+                    moves.append(m)
+                headers = {tag: value for tag, value in game.headers.items() if tag not in ("SetUp", "FEN")}
+                writer.add(moves, game.result if game.result in RESULTS else "*", headers, fen)
+                added += 1
+                if log and added % 10000 == 0:
+                    log("%d games imported, %.0f games/s" % (added, added / (time.perf_counter() - start)))
+    if log:
+        log("%d games imported into %s" % (added, path))
+    if index:
+        build_index(path, log=log)
+    return added
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="compact game archives with a position index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="append PGN files to an archive and update its index")
+    load.add_argument("archive")
+    load.add_argument("pgn", nargs="+", help="PGN files")
+    load.add_argument("--no-index", action="store_true", help="leave the position index as it is")
+    index = commands.add_parser("index", help="bring the position index up to date")
+    index.add_argument("archive")
+    index.add_argument("--plies", type=int, default=0, help="plies indexed per game, 0 for all (new index only)")
+    find = commands.add_parser("find", help="list the games reaching a position")
+    find.add_argument("archive")
+    find.add_argument("fen", nargs="?", default=START_FEN)
+    find.add_argument("--limit", type=int, default=20, help="games to list (default 20)")
+    show = commands.add_parser("show", help="print games as PGN")
+    show.add_argument("archive")
+    show.add_argument("games", type=int, nargs="+", help="game numbers, from 0")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        import_pgn(args.pgn, args.archive, not args.no_index, print)
+    elif args.command == "index":
+        build_index(args.archive, args.plies, print)
+    elif args.command == "find":
+        with GameArchive(args.archive) as archive:
+            start = time.perf_counter()
+            gs = ChessEngine.GameState.from_fen(args.fen)
+            total = archive.count(gs)
+            found = archive.find(gs, args.limit)
+            elapsed = time.perf_counter() - start
+            for game, ply in found:
+                headers = archive.headers(game)
+                print("%8d  ply %3d  %s - %s  %s" % (game, ply, headers.get("White", "?"), headers.get("Black", "?"),
+                                                     headers["Result"]))
+            print("%d occurrences in %d indexed games (%.2f ms)" % (total, archive.indexed_games, elapsed * 1000))
+    else:
+        with GameArchive(args.archive) as archive:
+            for game in args.games:
+                print(archive.pgn(game))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
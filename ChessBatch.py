@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+batch analysis: legal moves, perft counts or search results for many positions, spread over a process pool
+positions go to the workers as (fen, moves) tuples of short strings and come back as plain values,
+so no GameState, Move or search object is ever pickled
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import os
+import sys
+
+import ChessEngine
+import ChessPerft
+import ChessSearch
+from ChessFen import START_FEN, parse_epd
+
+
+def encode(position):
+    '''
+    Compact form of a position for shipping to a worker: (fen, moves)
+    position is a FEN string, a sequence of moves in coordinate notation ("e2e4", "e7e8q") played from the start,
+    or a (fen, moves) pair
+    '''
+    if isinstance(position, str):
+        return position, ()
+    if len(position) == 2 and isinstance(position[0], str) and "/" in position[0]:
+        return position[0], tuple(position[1])
+    return START_FEN, tuple(position)
+
+
+def play(gs, notation):
+    '''
+    Makes the legal move written in coordinate notation, raises ValueError if there is none
+    '''
+    for move in gs.get_valid_moves():
+        if move.get_chess_notation() == notation:
+            gs.make_move(move)
+            return move
+    raise ValueError("illegal move %r" % notation)
+
+
+def decode(item):
+    '''
+    Rebuilds the GameState of an encoded position
+    '''
+    fen, moves = item
+    gs = ChessEngine.GameState.from_fen(fen)
+    for notation in moves:
+        play(gs, notation)
+    return gs
+
+
+def legal_moves(gs, options):
+    return [move.get_chess_notation() for move in gs.get_valid_moves()]
+
+
+def perft_count(gs, options):
+    return ChessPerft.perft(gs, options.get("depth", 3))
+
+
+def search(gs, options):
+    result = ChessSearch.Search(tt_mb=options.get("tt_mb", 4)).search(
+        gs, options.get("depth", ChessSearch.MAX_PLY), options.get("movetime"), options.get("max_nodes"))
+    return {"best_move": result.best_move.get_chess_notation() if result.best_move is not None else None,
+            "score": result.score, "pv": [move.get_chess_notation() for move in result.pv],
+            "depth": result.depth, "nodes": result.nodes}
+
+
+# task name -> function(gs, options) returning a picklable result
+TASKS = {"moves": legal_moves, "perft": perft_count, "search": search}
+
+
+def run_chunk(task, options, chunk):
+    '''
+    Worker side: analyses a chunk of (index, encoded position) pairs, returns a list of (index, result)
+    a position that can't be set up gives its ValueError as the result instead of failing the whole chunk
+    '''
+    function = TASKS[task]
+    results = []
+    for index, item in chunk:
+        try:
+            results.append((index, function(decode(item), options)))
+        except ValueError as error:
+            results.append((index, error))
+    return results
+
+
+class BatchAnalyzer:
+    '''
+    Runs one task over an iterable of positions on a pool of worker processes
+    workers=0 runs everything in this process (handy for debugging and tiny batches)
+    '''
+    def __init__(self, workers=None, chunk_size=16):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.chunk_size = chunk_size  # positions per job, bigger chunks mean less pickling per position
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        '''
+        Shuts the worker processes down
+        '''
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def chunks(self, positions):
+        '''
+        Encodes positions lazily into lists of (index, encoded position), chunk_size at a time
+        '''
+        numbered = enumerate(positions)
+        while True:
+            chunk = [(index, encode(position)) for index, position in itertools.islice(numbered, self.chunk_size)]
+            if not chunk:
+                return
+            yield chunk
+
+    def run(self, positions, task="moves", ordered=True, **options):
+        '''
+        Yields (index, result) for every position, in input order if ordered else as soon as each chunk finishes
+        options go to the task: depth for "perft", depth/movetime/max_nodes/tt_mb for "search"
+        positions are read lazily and only a few chunks per worker are in flight, so the input can be huge
+        '''
+        if task not in TASKS:
+            raise ValueError("unknown task %r, expected one of %s" % (task, ", ".join(TASKS)))
+        if self.workers == 0:
+            for chunk in self.chunks(positions):
+                yield from run_chunk(task, options, chunk)
+            return
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        chunks = self.chunks(positions)
+        pending = collections.deque()  # futures in submission order
+        for chunk in itertools.islice(chunks, 2 * self.workers):  # keep every worker busy with one job queued
+            pending.append(self.pool.submit(run_chunk, task, options, chunk))
+        while pending:
+            if ordered:
+                done = pending.popleft()
+            else:
+                done = next(concurrent.futures.as_completed(pending))
+                pending.remove(done)
+            for chunk in itertools.islice(chunks, 1):  # refill before handing results out
+                pending.append(self.pool.submit(run_chunk, task, options, chunk))
+            yield from done.result()
+
+    def analyse(self, positions, task="moves", **options):
+        '''
+        Results for every position as a list in input order
+        '''
+        return [result for _, result in self.run(positions, task, True, **options)]
+
+
+def analyse(positions, task="moves", workers=None, chunk_size=16, **options):
+    '''
+    One off batch with its own pool, returns the results in input order
+    '''
+    with BatchAnalyzer(workers, chunk_size) as analyzer:
+        return analyzer.analyse(positions, task, **options)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="analyse a file of positions, one FEN/EPD or move list per line")
+    parser.add_argument("file", help="positions file, - for stdin")
+    parser.add_argument("--task", choices=sorted(TASKS), default="moves")
+    parser.add_argument("--depth", type=int, default=3, help="perft or search depth (default 3)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default one per core)")
+    parser.add_argument("--chunk-size", type=int, default=16, help="positions per job (default 16)")
+    parser.add_argument("--unordered", action="store_true", help="print results as soon as they are ready")
+    args = parser.parse_args(argv)
+
+    lines = sys.stdin if args.file == "-" else open(args.file)
+    # a line with a "/" is a FEN or EPD, anything else is a space separated move list from the start position
+    positions = (parse_epd(line)[0] if "/" in line else line.split() for line in lines if line.strip())
+    with BatchAnalyzer(args.workers, args.chunk_size) as analyzer:
+        for index, result in analyzer.run(positions, args.task, not args.unordered, depth=args.depth):
+            print("%d\t%s" % (index, result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+bitboard helpers and precomputed attack tables, built once at import
+squares are numbered row * 8 + col, so a8 is 0 and h1 is 63 (same orientation as GameState.board)
+"""
+
+FULL = (1 << 64) - 1  # every square set
+
+# (row step, col step) for each sliding direction, orthogonals first then diagonals
+DIRECTIONS = ((-1, 0), (1, 0), (0, 1), (0, -1), (-1, -1), (-1, 1), (1, 1), (1, -1))
+ORTHOGONAL = (0, 1, 2, 3)  # indexes into DIRECTIONS
+DIAGONAL = (4, 5, 6, 7)
+# a direction is "positive" when walking it increases the square number, so its nearest blocker is the lowest bit
+POSITIVE = tuple(dr * 8 + dc > 0 for dr, dc in DIRECTIONS)
+
+SQ_TO_RC = tuple(divmod(sq, 8) for sq in range(64))  # square number -> (row, col)
+
+
+def bit(r, c):
+    '''
+    Bitboard with only square [r][c] set
+    '''
+    return 1 << (r * 8 + c)
+
+
+def lsb(bb):
+    '''
+    Square number of the lowest set bit (bb must not be 0)
+    '''
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb):
+    '''
+    Square number of the highest set bit (bb must not be 0)
+    '''
+    return bb.bit_length() - 1
+
+
+def squares(bb):
+    '''
+    Yields the square number of every set bit, lowest first
+    '''
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+
+def _step_table(steps):
+    '''
+    For every square, mask of the squares reachable with one of the given (row, col) steps
+    '''
+    table = []
+    for sq in range(64):
+        r, c = SQ_TO_RC[sq]
+        mask = 0
+        for dr, dc in steps:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                mask |= bit(r + dr, c + dc)
+        table.append(mask)
+    return tuple(table)
+
+
+def _ray_table():
+    '''
+    RAYS[d][sq] is every square from sq (exclusive) to the edge of the board in direction d
+    '''
+    rays = []
+    for dr, dc in DIRECTIONS:
+        table = []
+        for sq in range(64):
+            r, c = SQ_TO_RC[sq]
+            mask = 0
+            r, c = r + dr, c + dc
+            while 0 <= r < 8 and 0 <= c < 8:
+                mask |= bit(r, c)
+                r, c = r + dr, c + dc
+            table.append(mask)
+        rays.append(tuple(table))
+    return tuple(rays)
+
+
+KNIGHT_ATTACKS = _step_table(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _step_table(DIRECTIONS)
+# squares a pawn of the given color standing on sq attacks (white pawns move up the board, towards row 0)
+PAWN_ATTACKS = {"w": _step_table(((-1, -1), (-1, 1))), "b": _step_table(((1, -1), (1, 1)))}
+RAYS = _ray_table()
+
+
+def _between_table():
+    '''
+    BETWEEN[a * 64 + b] is the squares strictly between a and b when they share a rank, file or diagonal, else 0
+    '''
+    table = [0] * 4096
+    for a in range(64):
+        for d in range(8):
+            ray = RAYS[d][a]
+            for b in squares(ray):
+                table[a * 64 + b] = ray ^ RAYS[d][b] ^ (1 << b)
+    return tuple(table)
+
+
+BETWEEN = _between_table()
+
+RANK_MASKS = tuple(0xFF << (8 * r) for r in range(8))  # RANK_MASKS[row]
+FILE_MASKS = tuple(0x0101010101010101 << c for c in range(8))  # FILE_MASKS[col]
+NOT_FILE_A = FULL ^ FILE_MASKS[0]
+NOT_FILE_H = FULL ^ FILE_MASKS[7]
+
+
+def pawn_attacks(pawns, color):
+    '''
+    Every square attacked by a set of pawns of the given color, all at once
+    '''
+    if color == "w":  # white pawns capture towards row 0
+        return ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+    return ((pawns & NOT_FILE_A) << 7 | (pawns & NOT_FILE_H) << 9) & FULL
+
+
+def ray_attacks(d, sq, occupied):
+    '''
+    Squares a slider on sq attacks in direction d, up to and including the first blocker
+    '''
+    ray = RAYS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        first = lsb(blockers) if POSITIVE[d] else msb(blockers)
+        return ray ^ RAYS[d][first]
+    return ray
+
+
+def _line_table(d1, d2):
+    '''
+    For the line through every square made of directions d1 and d2 (opposites), returns the mask of squares on
+    the line whose occupancy matters (the edge squares never block anything) and a dict mapping every possible
+    occupancy of those squares to the squares a slider attacks along the line
+    '''
+    inner_masks = []
+    tables = []
+    for sq in range(64):
+        inner = 0
+        for d in (d1, d2):
+            ray = RAYS[d][sq]
+            if ray:
+                edge = msb(ray) if POSITIVE[d] else lsb(ray)
+                inner |= ray ^ (1 << edge)
+        table = {}
+        subset = 0
+        while True:  # walk every subset of the inner mask (carry-rippler trick)
+            table[subset] = ray_attacks(d1, sq, subset) | ray_attacks(d2, sq, subset)
+            subset = (subset - inner) & inner
+            if subset == 0:
+                break
+        inner_masks.append(inner)
+        tables.append(table)
+    return tuple(inner_masks), tuple(tables)
+
+
+# one lookup per line replaces walking the rays square by square
+FILE_INNER, FILE_ATTACKS = _line_table(0, 1)
+RANK_INNER, RANK_ATTACKS = _line_table(2, 3)
+ANTI_DIAGONAL_INNER, ANTI_DIAGONAL_ATTACKS = _line_table(4, 6)
+DIAGONAL_INNER, DIAGONAL_ATTACKS = _line_table(5, 7)
+
+
+def rook_attacks(sq, occupied):
+    '''
+    Squares a rook on sq attacks given the occupancy mask
+    '''
+    return RANK_ATTACKS[sq][occupied & RANK_INNER[sq]] | FILE_ATTACKS[sq][occupied & FILE_INNER[sq]]
+
+
+def bishop_attacks(sq, occupied):
+    '''
+    Squares a bishop on sq attacks given the occupancy mask
+    '''
+    return DIAGONAL_ATTACKS[sq][occupied & DIAGONAL_INNER[sq]] | \
+        ANTI_DIAGONAL_ATTACKS[sq][occupied & ANTI_DIAGONAL_INNER[sq]]
@@ -2,12 +2,56 @@
 current GameState info, valid moves, MoveLog
 """
 #   ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
-import copy
 import ctypes
+from array import array
+
+from ChessBitboard import FULL, BETWEEN, SQ_TO_RC, KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, FILE_MASKS, \
+    RANK_MASKS, squares, rook_attacks, bishop_attacks, pawn_attacks
+from ChessEval import PSQT, compute_psqt
+from ChessFen import parse_fen, format_fen, parse_square, square_name
+from ChessTablebase import default_tablebases
+from ChessTrace import Tracer
+from ChessZobrist import PIECE_KEYS, SIDE_KEY, CASTLE_KEYS, castle_index, compute_key, en_passant_key
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")  # every piece code
+
+# packed moves: start square | end square << 6 | promotion << 12 | flag << 15 (17 bits, the first 15 identify it)
+PROMOTION_PIECES = ("", "Q", "R", "B", "N")  # promotion code -> piece type
+PROMOTION_MASK = 7 << 12
+EN_PASSANT_FLAG = 1
+CASTLE_FLAG = 2
+
+# castling rights as 4 bits, the same order as ChessZobrist.castle_index
+WHITE_SHORT, WHITE_LONG, BLACK_SHORT, BLACK_LONG = 1, 2, 4, 8
+# castling bits kept when a piece moves from or to a square: a king or rook leaving home, or a rook captured there
+CASTLING_KEEP = tuple(15 ^ {60: WHITE_SHORT | WHITE_LONG, 63: WHITE_SHORT, 56: WHITE_LONG,
+                            4: BLACK_SHORT | BLACK_LONG, 7: BLACK_SHORT, 0: BLACK_LONG}.get(sq, 0) for sq in range(64))
+
+# undo stack entry, one 64 bit word per ply holding what make_packed can't work out backwards:
+# packed move (17 bits) | captured piece (4) | castling before the move (4) | en passant square + 1 before (7) |
+# halfmove clock before (32), the key before the move goes in a second array at the same index
+SQUARE_CODES = ("--",) + PIECES  # captured piece number -> board code
+SQUARE_CODE_INDEX = {code: i for i, code in enumerate(SQUARE_CODES)}
+_CAPTURED_SHIFT = 17
+_CASTLING_SHIFT = 21
+_EN_PASSANT_SHIFT = 25
+_HALFMOVE_SHIFT = 32
+UNDO_CAPACITY = 256  # plies preallocated, the stack doubles when a game gets longer
+
+# rough piece values for ordering captures in staged_moves, most valuable victim first then least valuable attacker
+CAPTURE_VALUES = {"P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10, "-": 1}  # "-" is the empty en passant square
+
+
+def pack_move(start, end, promotion=0, flag=0):
+    '''
+    Packs a move into an int, start/end are square numbers, promotion an index into PROMOTION_PIECES
+    '''
+    return start | end << 6 | promotion << 12 | flag << 15
+
 
 class GameState:
     '''
-    Holds memory of the state of the game in a list
+    Holds memory of the state of the game in a list, mirrored into bitboards for move generation
     '''
     def __init__(self):
         # 8x8 2d list, each element 2 chars, first char repr color, second char repr piece type
@@ -30,377 +74,602 @@ class GameState:
         self.white_king_pos = (7, 4)  # cords of white king
         self.black_king_pos = (0, 4)  # cords of black king
         self.in_check = False  # flag var for checks
-        self.pins = []  # list of pins
+        self.pins = {}  # pinned square -> mask of squares the pinned piece can still move to
         self.checks = []  # list of checks
+        self.check_mask = FULL  # squares a non-king move must land on (block or capture when in check)
+        self.target_mask = FULL  # squares the moves being generated should land on (see add_stage_moves)
+        self.enemy_attacks = 0  # squares the side not to move attacks, our king taken off (see generate_valid_moves)
         self.checkmate = False  # checkmate boolean
         self.stalemate = False  # stalemate boolean
         self.en_passant_possible = ()  # cords of possible en passant square
-        self.current_castle_rights = CastleRights(True, True, True, True)  # castling rights
-        self.castle_log = [CastleRights(self.current_castle_rights.ws, self.current_castle_rights.bs,
-                                        self.current_castle_rights.wl, self.current_castle_rights.bl)]
-        # log of castle rights
+        self.castling = 15  # castling rights still open, WHITE_SHORT | WHITE_LONG | BLACK_SHORT | BLACK_LONG bits
+        self.halfmove_clock = 0  # plies since the last capture or pawn move (fifty move rule)
+        self.fullmove_number = 1  # starts at 1, goes up after every black move
+        self.ply = 0  # moves on the undo stack
+        self.undo_states = array("Q", bytes(8 * UNDO_CAPACITY))  # one packed entry per move made, see UNDO_CAPACITY
+        self.undo_keys = array("Q", bytes(8 * UNDO_CAPACITY))  # zobrist key before each move made
+        self.bitboards = {}  # piece code -> 64 bit mask of the squares it stands on
+        self.occupancy = {}  # color -> 64 bit mask of that side's pieces
+        self.psqt = 0  # packed material + piece-square score and game phase (see ChessEval), kept up by set_square
+        self.load_bitboards()
+        self.zobrist_key = 0  # hash of the current position, updated by make_move/undo_move
+        self.position_counts = {}  # key -> times that position occurs in the game so far
+        self.load_zobrist()
+
+    @classmethod
+    def from_fen(cls, fen):
+        '''
+        New GameState set up from a FEN string (the move clocks are optional)
+        '''
+        board, white_to_move, castling, en_passant, halfmove_clock, fullmove_number = parse_fen(fen)
+        gs = cls()
+        gs.board = board
+        gs.white_to_move = white_to_move
+        gs.load_bitboards()
+        gs.current_castle_rights = CastleRights(*castling)
+        gs.en_passant_possible = en_passant
+        gs.halfmove_clock = halfmove_clock
+        gs.fullmove_number = fullmove_number
+        gs.load_zobrist()
+        return gs
+
+    def to_fen(self):
+        '''
+        FEN string of the current position
+        '''
+        rights = self.current_castle_rights
+        return format_fen(self.board, self.white_to_move, (rights.ws, rights.bs, rights.wl, rights.bl),
+                          self.en_passant_possible, self.halfmove_clock, self.fullmove_number)
+
+    @property
+    def current_castle_rights(self):
+        '''
+        Castling rights as a CastleRights (a copy, assign a new one to change them)
+        '''
+        castling = self.castling
+        return CastleRights(bool(castling & WHITE_SHORT), bool(castling & BLACK_SHORT), bool(castling & WHITE_LONG),
+                            bool(castling & BLACK_LONG))
+
+    @current_castle_rights.setter
+    def current_castle_rights(self, rights):
+        self.castling = castle_index(rights)
+
+    def load_bitboards(self):
+        '''
+        Rebuilds the bitboards (and the evaluation's piece-square score) from self.board, call after editing the board
+        directly
+        '''
+        self.psqt = compute_psqt(self.board)
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.bitboards[piece] |= 1 << (r * 8 + c)
+                    self.occupancy[piece[0]] |= 1 << (r * 8 + c)
+                    if piece == "wK":
+                        self.white_king_pos = (r, c)
+                    elif piece == "bK":
+                        self.black_king_pos = (r, c)
+
+    def enable_tracing(self, tracer=None):
+        '''
+        Starts recording call counts, timings and sizes of the move generation methods, returns the Tracer
+        '''
+        self.disable_tracing()
+        return (tracer or Tracer()).attach(self)
+
+    def disable_tracing(self):
+        '''
+        Stops tracing, the plain methods are back so there's no overhead left
+        '''
+        Tracer.detach(self)
+
+    def load_zobrist(self):
+        '''
+        Recomputes the position key and starts a new history from it, call after setting up a position by hand
+        '''
+        self.zobrist_key = compute_key(self)
+        self.position_counts = {self.zobrist_key: 1}
 
+    def repetition_count(self):
+        '''
+        How many times the current position has occurred in this game (1 the first time)
+        '''
+        return self.position_counts[self.zobrist_key]
+
+    def probe_tablebase(self, tablebases=None):
+        '''
+        (wdl, plies to mate) for the side to move from the endgame tables, wdl is 1 win, 0 draw, -1 loss
+        None when no table covers the position, tablebases defaults to ChessTablebase.default_tablebases()
+        '''
+        return (tablebases or default_tablebases()).probe_wdl(self)
+
+    def set_square(self, r, c, piece):
+        '''
+        Puts piece (or "--") on square [r][c], keeping the board, the bitboards, the key and the piece-square score
+        in sync
+        '''
+        sq = r * 8 + c
+        sq_bit = 1 << sq
+        old = self.board[r][c]
+        if old != "--":
+            self.bitboards[old] ^= sq_bit
+            self.occupancy[old[0]] ^= sq_bit
+            self.zobrist_key ^= PIECE_KEYS[old][sq]
+            self.psqt -= PSQT[old][sq]
+        if piece != "--":
+            self.bitboards[piece] ^= sq_bit
+            self.occupancy[piece[0]] ^= sq_bit
+            self.zobrist_key ^= PIECE_KEYS[piece][sq]
+            self.psqt += PSQT[piece][sq]
+        self.board[r][c] = piece
 
     def make_move(self, move):
         '''
-        takes a move as a parameter and executes it (doesn't work with en passant, castling or pawn promotion)
+        takes a move as a parameter and executes it (including en passant, castling and pawn promotion)
         '''
-        self.board[move.start_row][move.start_col] = "--"  # makes starting square of piece moved blank
-        self.board[move.end_row][move.end_col] = move.piece_moved  # places moving piece on the ending square
         self.move_log.append(move)  # logs move
-        if move.piece_moved == "wK":  # update white king loc if moved
-            self.white_king_pos = (move.end_row, move.end_col)
-        if move.piece_moved == "bK":  # update black king loc if moved
-            self.black_king_pos = (move.end_row, move.end_col)
-        self.white_to_move = not self.white_to_move  # switches turn
-        if move.is_pawn_promotion:  # pawn promotion
-            promoted_piece = input("Promote to Q, R, B, or N:")
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
-            # todo improve pawn promotion
-        if move.is_en_passant:  # en passant
-            self.board[move.start_row][move.end_col] = "--"  # captures pawn
-        if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:  # if a two square advance is made
-            self.en_passant_possible = ((move.start_row + move.end_row) // 2, move.start_col)  # updates en passantpsble
-        else:
-            self.en_passant_possible = ()
-        if move.is_castle:
-            if move.end_col - move.start_col == 2:  # short castle
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][move.end_col + 1]  # move rook
-                self.board[move.end_row][move.end_col + 1] = "--"  # erase old rook
-            else:  # long castle
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2]  # move rook
-                self.board[move.end_row][move.end_col - 2] = "--"  # erase old rook
-        self.update_castle_rights(move)
-        self.castle_log.append(CastleRights(self.current_castle_rights.ws, self.current_castle_rights.bs,
-                                            self.current_castle_rights.wl, self.current_castle_rights.bl))
+        self.make_packed(move.packed)
 
     def undo_move(self):
         '''
         Undoes the last move made
         '''
         if len(self.move_log) != 0:
-            move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved  # moves moved piece back to starting square
-            self.board[move.end_row][move.end_col] = move.piece_captured  # re-places original piece/blank square on
-            # ending square
-            if move.piece_moved == "wK":  # update white king loc if move undone
-                self.white_king_pos = (move.start_row, move.start_col)
-            if move.piece_moved == "bK":  # update black king loc if move undone
-                self.black_king_pos = (move.start_row, move.start_col)
-            if move.is_en_passant:
-                self.board[move.end_row][move.end_col] = "--"
-                self.board[move.start_row][move.end_col] = move.piece_captured
-                self.en_passant_possible = (move.end_row, move.end_col)
-            if move.piece_moved[1] == "P" and abs(move.start_row - move.end_row) == 2:
-                self.en_passant_possible = ()
-            self.white_to_move = not self.white_to_move  # switches turn
-            self.castle_log.pop()  # get rid of the new castle rights from undone move
-            temp_castle_rights = copy.deepcopy(
-                self.castle_log[-1])  # set current castle rights to (now) last one in list
-            self.current_castle_rights = temp_castle_rights
-            if move.is_castle:
-                if move.end_col - move.start_col == 2:  # short castle
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
-                    self.board[move.end_row][move.end_col - 1] = "--"
+            self.move_log.pop()
+            self.undo_packed()
+
+    def make_packed(self, m):
+        '''
+        Executes a packed move (see pack_move) without creating a Move, undo it with undo_packed
+        '''
+        start = m & 63
+        end = m >> 6 & 63
+        flag = m >> 15
+        start_row, start_col = SQ_TO_RC[start]
+        end_row, end_col = SQ_TO_RC[end]
+        board = self.board
+        piece_moved = board[start_row][start_col]
+        piece_captured = board[end_row][end_col]
+        old_key = self.zobrist_key
+        old_castling = self.castling
+        old_en_passant = self.en_passant_possible
+        if old_en_passant:  # taken out while the pawns are where they were when it went in
+            self.zobrist_key ^= en_passant_key(self)
+        self.set_square(start_row, start_col, "--")  # makes starting square of piece moved blank
+        if m & PROMOTION_MASK:  # pawn promotion, the promoted piece lands instead of the pawn
+            self.set_square(end_row, end_col, piece_moved[0] + PROMOTION_PIECES[m >> 12 & 7])
+        else:
+            self.set_square(end_row, end_col, piece_moved)  # places moving piece on the ending square
+        if flag == EN_PASSANT_FLAG:  # en passant
+            piece_captured = board[start_row][end_col]
+            self.set_square(start_row, end_col, "--")  # captures pawn
+        elif flag == CASTLE_FLAG:
+            if end_col - start_col == 2:  # short castle
+                self.set_square(end_row, end_col - 1, board[end_row][end_col + 1])  # move rook
+                self.set_square(end_row, end_col + 1, "--")  # erase old rook
+            else:  # long castle
+                self.set_square(end_row, end_col + 1, board[end_row][end_col - 2])  # move rook
+                self.set_square(end_row, end_col - 2, "--")  # erase old rook
+        if piece_moved == "wK":  # update white king loc if moved
+            self.white_king_pos = (end_row, end_col)
+        elif piece_moved == "bK":  # update black king loc if moved
+            self.black_king_pos = (end_row, end_col)
+        self.white_to_move = not self.white_to_move  # switches turn
+        # everything a move can't give back goes on the undo stack
+        ply = self.ply
+        if ply == len(self.undo_states):
+            self.undo_states.frombytes(bytes(8 * ply))  # full, double it
+            self.undo_keys.frombytes(bytes(8 * ply))
+        self.undo_states[ply] = m | SQUARE_CODE_INDEX[piece_captured] << _CAPTURED_SHIFT | \
+            old_castling << _CASTLING_SHIFT | \
+            (old_en_passant[0] * 8 + old_en_passant[1] + 1 if old_en_passant else 0) << _EN_PASSANT_SHIFT | \
+            self.halfmove_clock << _HALFMOVE_SHIFT
+        self.undo_keys[ply] = old_key
+        self.ply = ply + 1
+        if piece_moved[1] == "P" or piece_captured != "--":  # pawn moves and captures reset the fifty move count
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.white_to_move:  # black just moved
+            self.fullmove_number += 1
+        if piece_moved[1] == "P" and abs(start_row - end_row) == 2:  # if a two square advance is made
+            self.en_passant_possible = SQ_TO_RC[(start + end) >> 1]  # updates en passant possible
+        else:
+            self.en_passant_possible = ()
+        key = self.zobrist_key ^ SIDE_KEY  # pieces are already hashed by set_square, now side, castling, en passant
+        if old_castling:
+            self.update_castle_rights(piece_moved, start, piece_captured, end)
+            if self.castling != old_castling:
+                key ^= CASTLE_KEYS[old_castling] ^ CASTLE_KEYS[self.castling]
+        if self.en_passant_possible:
+            key ^= en_passant_key(self)
+        self.zobrist_key = key
+        counts = self.position_counts
+        counts[key] = counts.get(key, 0) + 1
+
+    def undo_packed(self):
+        '''
+        Undoes the last move made with make_packed (or make_move)
+        '''
+        self.ply -= 1
+        state = self.undo_states[self.ply]
+        undone_key = self.zobrist_key  # drop the position we're leaving from the counts
+        count = self.position_counts[undone_key]
+        if count == 1:
+            del self.position_counts[undone_key]
+        else:
+            self.position_counts[undone_key] = count - 1
+        m = state & 0x1FFFF
+        piece_captured = SQUARE_CODES[state >> _CAPTURED_SHIFT & 15]
+        start_row, start_col = SQ_TO_RC[m & 63]
+        end_row, end_col = SQ_TO_RC[m >> 6 & 63]
+        flag = m >> 15
+        board = self.board
+        piece_moved = board[end_row][end_col]
+        if m & PROMOTION_MASK:  # a promoted piece goes back as a pawn
+            piece_moved = piece_moved[0] + "P"
+        self.set_square(start_row, start_col, piece_moved)  # moves moved piece back to start square
+        if flag == EN_PASSANT_FLAG:
+            self.set_square(end_row, end_col, "--")
+            self.set_square(start_row, end_col, piece_captured)
+        else:
+            self.set_square(end_row, end_col, piece_captured)  # re-places original piece/blank square on ending square
+            if flag == CASTLE_FLAG:
+                if end_col - start_col == 2:  # short castle
+                    self.set_square(end_row, end_col + 1, board[end_row][end_col - 1])
+                    self.set_square(end_row, end_col - 1, "--")
                 else:  # long castle
-                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = "--"
+                    self.set_square(end_row, end_col - 2, board[end_row][end_col + 1])
+                    self.set_square(end_row, end_col + 1, "--")
+        if piece_moved == "wK":  # update white king loc if move undone
+            self.white_king_pos = (start_row, start_col)
+        elif piece_moved == "bK":  # update black king loc if move undone
+            self.black_king_pos = (start_row, start_col)
+        self.white_to_move = not self.white_to_move  # switches turn
+        if not self.white_to_move:  # taking back a black move
+            self.fullmove_number -= 1
+        en_passant = state >> _EN_PASSANT_SHIFT & 127
+        self.en_passant_possible = SQ_TO_RC[en_passant - 1] if en_passant else ()
+        self.castling = state >> _CASTLING_SHIFT & 15
+        self.halfmove_clock = state >> _HALFMOVE_SHIFT
+        self.zobrist_key = self.undo_keys[self.ply]  # key before the move is on the undo stack, no need to rehash
 
     # todo make a redo function maybe????
 
-    def update_castle_rights(self, move):
+    def moves_played(self):
+        '''
+        Packed moves on the undo stack, first move first
+        '''
+        return [state & 0x1FFFF for state in self.undo_states[:self.ply]]
+
+    def compact(self):
+        '''
+        Gives back the undo stack's unused room (it grows again when needed), for holding many games at once
+        games kept this way should be played with make_packed, move_log's Move objects are the big part otherwise
+        '''
+        keep = max(self.ply, 1)
+        del self.undo_states[keep:]
+        del self.undo_keys[keep:]
+
+    def update_castle_rights(self, piece_moved, start, piece_captured, end):
         '''
-        Update castling rights given move made
+        Update castling rights given the piece moved from square start and the piece captured on square end
         '''
-        if move.piece_moved == "wK":  # white king moved
-            self.current_castle_rights.ws = False
-            self.current_castle_rights.wl = False
-        elif move.piece_moved == "bK":  # black king moved
-            self.current_castle_rights.bs = False
-            self.current_castle_rights.bl = False
-        elif move.piece_moved == "wR":  # one of white's rooks moved
-            if move.start_col == 0:  # left rook
-                self.current_castle_rights.wl = False
-            if move.start_col == 7:  # right rook
-                self.current_castle_rights.ws = False
-        elif move.piece_moved == "bR":  # one of black's rooks moved
-            if move.start_col == 0:  # left rook
-                self.current_castle_rights.bl = False
-            if move.start_col == 7:  # right rook
-                self.current_castle_rights.bs = False
+        # a king or rook leaving its home square, or anything landing on a rook's home square, closes that side
+        self.castling &= CASTLING_KEEP[start] & CASTLING_KEEP[end]
 
+    def attackers_to(self, sq, color, occupied=None):
+        '''
+        Mask of color's pieces attacking square number sq (occupied defaults to the current board)
+        '''
+        b = self.bitboards
+        if occupied is None:
+            occupied = self.occupancy["w"] | self.occupancy["b"]
+        enemy = "b" if color == "w" else "w"
+        return (PAWN_ATTACKS[enemy][sq] & b[color + "P"]) | (KNIGHT_ATTACKS[sq] & b[color + "N"]) | \
+               (KING_ATTACKS[sq] & b[color + "K"]) | \
+               (rook_attacks(sq, occupied) & (b[color + "R"] | b[color + "Q"])) | \
+               (bishop_attacks(sq, occupied) & (b[color + "B"] | b[color + "Q"]))
+
+    def attacked_squares(self, color, occupied=None):
+        '''
+        Mask of every square color attacks (occupied defaults to the current board)
+        '''
+        b = self.bitboards
+        if occupied is None:
+            occupied = self.occupancy["w"] | self.occupancy["b"]
+        attacks = pawn_attacks(b[color + "P"], color)
+        for sq in squares(b[color + "N"]):
+            attacks |= KNIGHT_ATTACKS[sq]
+        for sq in squares(b[color + "K"]):
+            attacks |= KING_ATTACKS[sq]
+        queens = b[color + "Q"]
+        for sq in squares(b[color + "R"] | queens):
+            attacks |= rook_attacks(sq, occupied)
+        for sq in squares(b[color + "B"] | queens):
+            attacks |= bishop_attacks(sq, occupied)
+        return attacks
 
     def square_attacked(self, r, c):
         '''
         Check if opponent pressures (is able to attack) square [r][c]
         '''
-        self.white_to_move = not self.white_to_move
-        enemy_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move
-        for move in enemy_moves:
-            if move.end_row == r and move.end_col == c:
-                return True
-        return False
-
+        return self.attackers_to(r * 8 + c, "b" if self.white_to_move else "w") != 0
 
     def get_valid_moves(self):
         '''
         All moves considering checks
         '''
-        moves = []  # list of valid moves
-        # print(moves)
-        self.in_check, self.pins, self.checks = self.check_for_pins_and_checks()  # see function mentioned
-        if self.white_to_move:
-            moves.append(self.get_castle_moves(self.white_king_pos[0], self.white_king_pos[1], moves))
-        else:
-            moves.append(self.get_castle_moves(self.black_king_pos[0], self.black_king_pos[1], moves))
-        if self.white_to_move:  # if it's white's turn the following is the king position
-            king_row = self.white_king_pos[0]
-            king_col = self.white_king_pos[1]
-        else:  # if it's black's turn this is the king position
-            king_row = self.black_king_pos[0]
-            king_col = self.black_king_pos[1]
-        if self.in_check:  # is king in check
-            print("check")
-            if len(self.checks) == 1:  # if only in check once
-                print("one check")
-                potential_moves = self.get_all_possible_moves()  # get potential moves
-                print(potential_moves)
-                check = self.checks[0]  # getting check data
-                check_row = check[0]  # where in the row we are checked from
-                check_col = check[1]  # where in the column we are checked from
-                piece_checking = self.board[check_row][check_col]  # where is the piece that is checking us
-                valid_squares = []  # list of valid squares to move to
-                if piece_checking[1] == "N":  # if it's a knight
-                    print("knight")
-                    valid_squares = [(check_row, check_col)]  # you have to capture the piece
-                else:  # for the other pieces
-                    print("not knight")
-                    for i in range(1, 8):  # block the check
-                        valid_square = (king_row + check[2] * i, king_col + check[3] * i)
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_col:  # or capture the piece
-                            break
-                for i in range(len(potential_moves) - 1, -1, -1):  # go through potential move list (backwards)
-                    if potential_moves[i].piece_moved[1] != "K":  # if the king isn't moved
-                        if not (potential_moves[i].end_row, potential_moves[i].end_col) in valid_squares:  # or if
-                            # the check
-                            # isn't blocked
-                            # or checking piece isn't captured
-                            potential_moves.remove(potential_moves[i])  # remove those moves from list
-                moves.append(potential_moves)
-            else:  # if in check twice
-                self.get_king_moves(king_row, king_col, moves)  # you have to move the king
-        else:  # if not in check
-            print("not in check")
-            moves += self.get_all_possible_moves()  # all moves are valid
-        if self.in_check:  # in check
-            print("no moves left")
-            if len(moves) == 0: # no valid moves
-                self.checkmate = True
-            else:
-                self.stalemate = True
+        board = self.board
+        return [Move.from_packed(m, board) for m in self.generate_valid_moves([])]
+
+    def generate_valid_moves(self, moves):
+        '''
+        Fills moves (a list to reuse, cleared first) with every legal move packed as an int and returns it
+        '''
+        moves.clear()
+        self.prepare_moves()
+        self.add_stage_moves(moves)
+        if len(moves) == 0:  # no valid moves
+            self.checkmate = self.in_check
+            self.stalemate = not self.in_check
         else:
             self.checkmate = False
             self.stalemate = False
-        print(moves)
         return moves
 
+    def prepare_moves(self):
+        '''
+        Works out checks, pins and the enemy attack map for the side to move, the piece move functions read them
+        '''
+        self.in_check, self.pins, self.checks = self.check_for_pins_and_checks()  # see function mentioned
+        king_row, king_col = self.white_king_pos if self.white_to_move else self.black_king_pos
+        # one enemy attack map per position answers every king move and castling square query
+        # the king is taken off the board so squares behind it along a checking line count as attacked
+        self.enemy_attacks = self.attacked_squares("b" if self.white_to_move else "w",
+                                                   (self.occupancy["w"] | self.occupancy["b"]) ^
+                                                   (1 << (king_row * 8 + king_col)))
+
+    def add_stage_moves(self, moves, targets=FULL):
+        '''
+        Adds the legal moves that land on a square in targets (en passant counts as landing on the captured pawn)
+        prepare_moves must have been called for the current position, returns moves
+        '''
+        self.target_mask = targets
+        king_row, king_col = self.white_king_pos if self.white_to_move else self.black_king_pos
+        if len(self.checks) > 1:  # if in check twice
+            self.get_king_moves(king_row, king_col, moves)  # you have to move the king
+        else:
+            # in check once you have to block the check or capture the piece (king moves check themselves)
+            self.check_mask = (self.checks[0][2] if self.in_check else FULL) & targets
+            self.get_all_possible_moves(moves)
+            self.get_castle_moves(king_row, king_col, moves)
+        return moves
 
+    def has_legal_move(self):
+        '''
+        True if the side to move has any legal move, stops at the first one found (no move list is built)
+        leaves the position prepared (see prepare_moves) so add_stage_moves can follow
+        '''
+        self.prepare_moves()
+        self.target_mask = FULL
+        self.check_mask = self.checks[0][2] if self.in_check else FULL
+        king_row, king_col = self.white_king_pos if self.white_to_move else self.black_king_pos
+        moves = []
+        self.get_king_moves(king_row, king_col, moves)  # castling needs a safe king step, so it never adds anything
+        if moves:
+            return True
+        if len(self.checks) > 1:  # only the king can answer a double check
+            return False
+        color = "w" if self.white_to_move else "b"
+        for piece in "NPBRQ":
+            move_function = self.move_functions[piece]
+            for sq in squares(self.bitboards[color + piece]):
+                r, c = SQ_TO_RC[sq]
+                move_function(r, c, moves)
+                if moves:
+                    return True
+        return False
 
-    def get_all_possible_moves(self):
+    def legal_moves_from(self, sq):
         '''
-        All moves without considering checks
+        Legal packed moves of the piece of the side to move on square number sq, after prepare_moves
         '''
+        r, c = SQ_TO_RC[sq]
+        piece = self.board[r][c]
         moves = []
-        for r in range(len(self.board)):  # no of rows
-            for c in range(len(self.board[r])):  # no of columns in given row
-                player = self.board[r][c][0]
-                if (player == 'w' and self.white_to_move) or (player == 'b' and not self.white_to_move):
-                    piece = self.board[r][c][1]
-                    # noinspection PyArgumentList
-                    self.move_functions[piece](r, c, moves)  # calls piece move function based on piece type
-        print(moves)
+        if piece == "--" or (piece[0] == "w") != self.white_to_move:
+            return moves
+        self.target_mask = FULL
+        self.check_mask = self.checks[0][2] if self.in_check else FULL
+        if piece[1] == "K":
+            self.get_king_moves(r, c, moves)
+            if len(self.checks) <= 1:
+                self.get_castle_moves(r, c, moves)
+        elif len(self.checks) <= 1:
+            self.move_functions[piece[1]](r, c, moves)
         return moves
 
+    def staged_moves(self, hash_move=0, killers=(), quiet_key=None):
+        '''
+        Legal packed moves generated lazily in stages, best candidates first: the hash move (the low 15 bits of a
+        packed move, checked for legality), captures by most valuable victim / least valuable attacker, quiet
+        promotions, killers, then the remaining quiet moves (highest quiet_key(m) first when quiet_key is given)
+        a stage is only generated once the caller asks past the previous one, so a cutoff skips the rest
+        in_check is set as soon as this returns, moves may be made and undone between items
+        '''
+        self.prepare_moves()
+        return self._stages(hash_move, killers, quiet_key)
+
+    def _stages(self, hash_move, killers, quiet_key):
+        # moves made between yields prepare their own positions, so put ours back before generating each stage
+        prepared = (self.in_check, self.pins, self.checks, self.enemy_attacks)
+        found = -1
+        if hash_move:
+            for m in self.legal_moves_from(hash_move & 63):
+                if m & 0x7FFF == hash_move:
+                    found = m
+                    yield m
+                    break
+        self.in_check, self.pins, self.checks, self.enemy_attacks = prepared
+        board = self.board
+        enemies = self.occupancy["b" if self.white_to_move else "w"]
+        captures = self.add_stage_moves([], enemies)
+
+        def capture_score(m):
+            end = m >> 6 & 63
+            start = m & 63
+            return 16 * CAPTURE_VALUES[board[end >> 3][end & 7][1]] - CAPTURE_VALUES[board[start >> 3][start & 7][1]]
+
+        captures.sort(key=capture_score, reverse=True)
+        for m in captures:
+            if m != found:
+                yield m
+        self.in_check, self.pins, self.checks, self.enemy_attacks = prepared
+        quiets = self.add_stage_moves([], FULL ^ (enemies | self.occupancy["w" if self.white_to_move else "b"]))
+        rest = []
+        for m in quiets:
+            if m & PROMOTION_MASK:
+                if m != found:
+                    yield m
+            else:
+                rest.append(m)
+        for killer in killers:
+            if killer and killer != found and killer in rest:
+                rest.remove(killer)
+                yield killer
+        if quiet_key is not None:
+            rest.sort(key=quiet_key, reverse=True)
+        for m in rest:
+            if m != found:
+                yield m
+
+    def get_all_possible_moves(self, moves):
+        '''
+        Adds the packed moves of every piece, limited by self.pins and self.check_mask (see generate_valid_moves)
+        '''
+        color = "w" if self.white_to_move else "b"
+        for piece, move_function in self.move_functions.items():
+            pieces = self.bitboards[color + piece]
+            while pieces:  # every square holding this piece type, lowest bit first
+                low = pieces & -pieces
+                r, c = SQ_TO_RC[low.bit_length() - 1]
+                # noinspection PyArgumentList
+                move_function(r, c, moves)  # calls piece move function based on piece type
+                pieces ^= low
+        return moves
 
-    def get_pawn_moves(self, r, c, moves):  # todo simplify pawn move function
+    def get_pawn_moves(self, r, c, moves):
         '''
         Get all potential pawn moves for pawn at square [r][c] and add these to the list of possible moves
         '''
-        piece_pinned = False  # flag variable to see if pinned
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):  # go through list of pins (backwards)
-            if self.pins[i][0] == r and self.pins[i][1] == c:  # is this piece on a "pinned square"
-                piece_pinned = True  # it's pinned
-                pin_direction = (self.pins[i][2], self.pins[i][3])  # get pin direction
-                self.pins.remove(self.pins[i])  # remove from list of pins
-                break
-
-        if self.white_to_move:  # white pawn moves
-            if self.board[r - 1][c] == "--":  # one square pawn advance
-                if not piece_pinned or pin_direction == (-1, 0):  # is piece pinned?
-                    moves.append(Move((r, c), (r - 1, c), self.board))
-                    if r == 6 and self.board[r - 2][c] == "--":  # a-h2 to a-h4, or a two square pawn advance
-                        moves.append(Move((r, c), (r - 2, c), self.board))
-            if c - 1 >= 0:  # pawn captures to the left
-                if self.board[r - 1][c - 1][0] == 'b':  # there is an enemy piece to capture
-                    if not piece_pinned or pin_direction == (-1, -1):  # is piece pinned?
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board))
-                elif (r - 1, c - 1) == self.en_passant_possible:  # there is an en passant possible
-                    if not piece_pinned or pin_direction == (-1, -1):  # is piece pinned?
-                        moves.append(Move((r, c), (r - 1, c - 1), self.board, is_en_passant=True))
-            if c + 1 <= 7:  # pawn captures to the right
-                if self.board[r - 1][c + 1][0] == 'b':  # there is an enemy piece to capture
-                    if not piece_pinned or pin_direction == (-1, 1):  # is piece pinned?
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board))
-                elif (r - 1, c + 1) == self.en_passant_possible:  # there is an en passant possible
-                    if not piece_pinned or pin_direction == (-1, 1):  # is piece pinned?
-                        moves.append(Move((r, c), (r - 1, c + 1), self.board, is_en_passant=True))
-
-
-        if not self.white_to_move:  # black pawn moves
-            if self.board[r + 1][c] == "--":  # one square pawn advance
-                if not piece_pinned or pin_direction == (1, 0):  # is piece pinned?
-                    moves.append(Move((r, c), (r + 1, c), self.board))
-                    if r == 1 and self.board[r + 2][c] == "--":  # a-h7 to a-h5, or a two square pawn advance
-                        moves.append(Move((r, c), (r + 2, c), self.board))
-            if c + 1 <= 7:  # pawn captures to the right
-                if self.board[r + 1][c + 1][0] == 'w':  # there is an enemy piece to capture
-                    if not piece_pinned or pin_direction == (1, 1):  # is piece pinned?
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
-                elif (r + 1, c + 1) == self.en_passant_possible:  # there is an en passant possible
-                    if not piece_pinned or pin_direction == (1, 1):  # is piece pinned?
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board, is_en_passant=True))
-            if c - 1 >= 0:  # pawn captures to the left
-                if self.board[r + 1][c - 1][0] == 'w':  # there is an enemy piece to capture
-                    if not piece_pinned or pin_direction == (1, -1):  # is piece pinned?
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
-                elif (r + 1, c - 1) == self.en_passant_possible:  # there is an en passant possible
-                    if not piece_pinned or pin_direction == (1, -1):  # is piece pinned?
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board, is_en_passant=True))
+        sq = r * 8 + c
+        if self.white_to_move:
+            ally_color, enemy_color, step, start_row, last_row = "w", "b", -8, 6, 1
+        else:
+            ally_color, enemy_color, step, start_row, last_row = "b", "w", 8, 1, 6
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        allowed = self.check_mask & self.pins.get(sq, FULL)  # squares this pawn may land on (check_mask has the stage)
+        targets = PAWN_ATTACKS[ally_color][sq] & self.occupancy[enemy_color]  # captures
+        one = sq + step
+        if not occupied >> one & 1:  # one square pawn advance
+            targets |= 1 << one
+            if r == start_row and not occupied >> (one + step) & 1:  # two square pawn advance
+                targets |= 1 << (one + step)
+        if r == last_row:  # every push or capture promotes, one move per piece to promote to
+            targets &= allowed
+            while targets:
+                low = targets & -targets
+                base = sq | (low.bit_length() - 1) << 6
+                moves.extend((base | 1 << 12, base | 2 << 12, base | 3 << 12, base | 4 << 12))
+                targets ^= low
+        else:
+            self.add_moves(r, c, targets & allowed, moves)
+        if self.en_passant_possible:
+            ep_row, ep_col = self.en_passant_possible
+            ep_sq = ep_row * 8 + ep_col
+            if PAWN_ATTACKS[ally_color][sq] >> ep_sq & 1 and self.target_mask >> (r * 8 + ep_col) & 1 and \
+                    self.en_passant_legal(sq, ep_sq, r * 8 + ep_col):
+                moves.append(sq | ep_sq << 6 | EN_PASSANT_FLAG << 15)
+
+    def en_passant_legal(self, start, end, captured):
+        '''
+        True if the en passant capture start -> end (removing the pawn on captured) leaves our king safe
+        '''
+        # pins and check masks can't describe en passant (two pieces leave the same rank) so test the result directly
+        if self.white_to_move:
+            ally_color, enemy_color, king_pos = "w", "b", self.white_king_pos
+        else:
+            ally_color, enemy_color, king_pos = "b", "w", self.black_king_pos
+        king_sq = king_pos[0] * 8 + king_pos[1]
+        occupied = (self.occupancy["w"] | self.occupancy["b"]) ^ (1 << start) ^ (1 << end) ^ (1 << captured)
+        b = self.bitboards
+        return not (rook_attacks(king_sq, occupied) & (b[enemy_color + "R"] | b[enemy_color + "Q"]) or
+                    bishop_attacks(king_sq, occupied) & (b[enemy_color + "B"] | b[enemy_color + "Q"]) or
+                    KNIGHT_ATTACKS[king_sq] & b[enemy_color + "N"] or
+                    PAWN_ATTACKS[ally_color][king_sq] & b[enemy_color + "P"] & ~(1 << captured))
+
+    def add_moves(self, r, c, targets, moves):
+        '''
+        Adds a move from square [r][c] to every square set in the targets mask
+        '''
+        sq = r * 8 + c
+        while targets:
+            low = targets & -targets
+            moves.append(sq | (low.bit_length() - 1) << 6)
+            targets ^= low
 
+    def get_slider_moves(self, r, c, moves, attacks):
+        '''
+        Adds the moves of a sliding piece at square [r][c] given its attack mask
+        '''
+        sq = r * 8 + c
+        own = self.occupancy["w" if self.white_to_move else "b"]
+        self.add_moves(r, c, attacks & ~own & self.check_mask & self.pins.get(sq, FULL), moves)
 
     def get_bishop_moves(self, r, c, moves):
         '''
         Get all potential bishop moves for bishop at square [r][c] and add these to the list of possible moves
         '''
-        piece_pinned = False  # flag variable to see if pinned
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):  # go through list of pins (backwards)
-            if self.pins[i][0] == r and self.pins[i][1] == c:  # is this piece on a "pinned square"
-                piece_pinned = True  # it's pinned
-                pin_direction = (self.pins[i][2], self.pins[i][3])  # get pin direction
-                if self.board[r][c][1] != "Q":
-                    self.pins.remove(self.pins[i])  # remove from list of pins
-                break
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # ways it can move
-        enemy_color = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1, 8):  # squares it can move to according to the ways it can move
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:  # not off board
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # is our end sq empty?
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # is there an enemy piece to capture?
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
-
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        self.get_slider_moves(r, c, moves, bishop_attacks(r * 8 + c, occupied))
 
     def get_knight_moves(self, r, c, moves):
         '''
         Get all potential knight moves for knight at square [r][c] and add these to the list of possible moves
         '''
-        piece_pinned = False  # flag variable to see if pinned
-        for i in range(len(self.pins) - 1, -1, -1):  # go through list of pins (backwards)
-            if self.pins[i][0] == r and self.pins[i][1] == c:  # is this piece on a "pinned square"
-                piece_pinned = True  # it's pinned
-                self.pins.remove(self.pins[i])  # remove from list of pins
-                break
-        knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        enemy_color = "b" if self.white_to_move else "w"
-        for m in knight_moves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == enemy_color or end_piece[0] == "-":
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-
+        sq = r * 8 + c
+        if sq in self.pins:  # a pinned knight can never move
+            return
+        own = self.occupancy["w" if self.white_to_move else "b"]
+        self.add_moves(r, c, KNIGHT_ATTACKS[sq] & ~own & self.check_mask, moves)
 
     def get_rook_moves(self, r, c, moves):
         '''
         Get all potential rook moves for rook at square [r][c] and add these to the list of possible moves
         '''
-        piece_pinned = False  # flag variable to see if pinned
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):  # go through list of pins (backwards)
-            if self.pins[i][0] == r and self.pins[i][1] == c:  # is this piece on a "pinned square"
-                piece_pinned = True  # it's pinned
-                pin_direction = (self.pins[i][2], self.pins[i][3])  # get pin direction
-                if self.board[r][c][1] != "Q":
-                    self.pins.remove(self.pins[i])  # remove from list of pins
-                break
-        directions = ((-1, 0), (1, 0), (0, 1), (0, -1))
-        enemy_color = "b" if self.white_to_move else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else:
-                            break
-                else:
-                    break
-
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        self.get_slider_moves(r, c, moves, rook_attacks(r * 8 + c, occupied))
 
     def get_queen_moves(self, r, c, moves):
         '''
         Get all potential queen moves for queen at square [r][c] and add these to the list of possible moves
         '''
-        self.get_rook_moves(r, c, moves)
-        self.get_bishop_moves(r, c, moves)
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        sq = r * 8 + c
+        self.get_slider_moves(r, c, moves, rook_attacks(sq, occupied) | bishop_attacks(sq, occupied))
 
-                                                    ## FIX CHECKS KING IS ALL FUCKED UP BRO WYD RETARD BOY
     def get_king_moves(self, r, c, moves):
         '''
         Get all potential king moves for king at square [r][c] and add these to the list of possible moves
         '''
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        enemy_color = "b" if self.white_to_move else "w"
-        for i in range(1):
-            end_row = r + row_moves[i]
-            end_col = c + col_moves[i]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color or end_piece[0] == "-":
-                    if enemy_color == "b":
-                        self.white_king_pos = (end_row, end_col)
-                    else:
-                        self.black_king_pos = (end_row, end_col)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    if enemy_color == "b":
-                        self.white_king_pos = (r, c)
-                    else:
-                        self.black_king_pos = (r, c)
+        sq = r * 8 + c
+        ally_color = "w" if self.white_to_move else "b"
+        for end in squares(KING_ATTACKS[sq] & ~self.occupancy[ally_color] & ~self.enemy_attacks & self.target_mask):
+            moves.append(sq | end << 6)
 
     def get_castle_moves(self, r, c, moves):
         '''
@@ -409,93 +678,221 @@ class GameState:
         if self.in_check:
             return  # can't castle while in check
         else:
-            if (self.white_to_move and self.current_castle_rights.ws) or (
-                    not self.white_to_move and self.current_castle_rights.bs):
+            short, long = (WHITE_SHORT, WHITE_LONG) if self.white_to_move else (BLACK_SHORT, BLACK_LONG)
+            if self.castling & short:
                 self.get_short_castle(r, c, moves)
-            if (self.white_to_move and self.current_castle_rights.wl) or (
-                    not self.white_to_move and self.current_castle_rights.bl):
+            if self.castling & long:
                 self.get_long_castle(r, c, moves)
             return moves
 
     def get_short_castle(self, r, c, moves):
         if self.board[r][c + 1] == "--" and self.board[r][c + 2] == "--":
-            if not self.square_attacked(r, c + 1) and not self.square_attacked(r, c + 2):
-                moves.append(Move((r, c), (r, c + 2), self.board, is_castle=True))
+            sq = r * 8 + c
+            # neither square the king crosses or lands on is attacked (and the current stage wants the landing square)
+            if not self.enemy_attacks & (6 << sq) and self.target_mask >> (sq + 2) & 1:
+                moves.append(pack_move(r * 8 + c, r * 8 + c + 2, 0, CASTLE_FLAG))
 
     def get_long_castle(self, r, c, moves):
         if self.board[r][c - 1] == "--" and self.board[r][c - 2] == "--" and self.board[r][c - 3] == "--":
-            if not self.square_attacked(r, c - 1) and not self.square_attacked(r, c - 2):
-                moves.append(Move((r, c), (r, c - 2), self.board, is_castle=True))
-
+            sq = r * 8 + c
+            if not self.enemy_attacks & (3 << (sq - 2)) and self.target_mask >> (sq - 2) & 1:
+                moves.append(pack_move(r * 8 + c, r * 8 + c - 2, 0, CASTLE_FLAG))
+
+    def origins(self, piece, end):
+        '''
+        Mask of the squares holding a piece of this code (like "wN") that could move to square number end,
+        ignoring pins and checks (pawns: only the captures, pushes are handled by parse_san)
+        '''
+        bb = self.bitboards[piece]
+        kind = piece[1]
+        if kind == "N":
+            return KNIGHT_ATTACKS[end] & bb
+        if kind == "K":
+            return KING_ATTACKS[end] & bb
+        if kind == "P":
+            return PAWN_ATTACKS["b" if piece[0] == "w" else "w"][end] & bb
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        if kind == "B":
+            return bishop_attacks(end, occupied) & bb
+        if kind == "R":
+            return rook_attacks(end, occupied) & bb
+        return (rook_attacks(end, occupied) | bishop_attacks(end, occupied)) & bb
+
+    def pseudo_move_legal(self, m, pins, checks):
+        '''
+        True if a non castling packed move that follows the piece movement rules leaves our king safe
+        pins and checks are what check_for_pins_and_checks returned for the current position
+        '''
+        start = m & 63
+        end = m >> 6 & 63
+        ally_color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        if self.occupancy[ally_color] >> end & 1:
+            return False
+        if self.bitboards[ally_color + "K"] >> start & 1:
+            occupied = (self.occupancy["w"] | self.occupancy["b"]) ^ (1 << start)
+            return not self.attackers_to(end, enemy_color, occupied)
+        if len(checks) > 1:
+            return False
+        if m >> 15 == EN_PASSANT_FLAG:
+            return self.en_passant_legal(start, end, (start & ~7) | (end & 7))
+        return bool(((checks[0][2] if checks else FULL) & pins.get(start, FULL)) >> end & 1)
+
+    def move_to_san(self, m):
+        '''
+        Standard algebraic notation of a legal packed move in the current position ("Nbd7", "exd6", "e8=Q+", "O-O#")
+        '''
+        start = m & 63
+        end = m >> 6 & 63
+        flag = m >> 15
+        start_row, start_col = SQ_TO_RC[start]
+        end_row, end_col = SQ_TO_RC[end]
+        piece = self.board[start_row][start_col]
+        if flag == CASTLE_FLAG:
+            san = "O-O" if end > start else "O-O-O"
+        elif piece[1] == "P":
+            if start_col != end_col:  # captures, en passant included
+                san = Move.cols_to_files[start_col] + "x" + square_name(end_row, end_col)
+            else:
+                san = square_name(end_row, end_col)
+            if m & PROMOTION_MASK:
+                san += "=" + PROMOTION_PIECES[m >> 12 & 7]
+        else:
+            san = piece[1]
+            others = self.origins(piece, end) & ~(1 << start)
+            if others:  # another piece of the same kind might go there too, name ours apart from the legal ones
+                in_check, pins, checks = self.check_for_pins_and_checks()
+                others = [sq for sq in squares(others) if self.pseudo_move_legal(sq | end << 6, pins, checks)]
+                if others:
+                    if all(sq & 7 != start_col for sq in others):
+                        san += Move.cols_to_files[start_col]
+                    elif all(sq >> 3 != start_row for sq in others):
+                        san += Move.rows_to_ranks[start_row]
+                    else:
+                        san += square_name(start_row, start_col)
+            if self.board[end_row][end_col] != "--":
+                san += "x"
+            san += square_name(end_row, end_col)
+        self.make_packed(m)
+        king_sq = (self.white_king_pos[0] * 8 + self.white_king_pos[1] if self.white_to_move else
+                   self.black_king_pos[0] * 8 + self.black_king_pos[1])
+        if self.attackers_to(king_sq, "b" if self.white_to_move else "w"):
+            san += "+" if self.has_legal_move() else "#"
+        self.undo_packed()
+        return san
+
+    def parse_san(self, san):
+        '''
+        Packed legal move for a SAN string in the current position, raises ValueError if it's illegal or ambiguous
+        check/mate markers and annotations (+ # ! ?) are ignored, "0-0" and pawn promotions without "=" are accepted
+        '''
+        text = san.rstrip("+#!?")
+        ally_color = "w" if self.white_to_move else "b"
+        king_pos = self.white_king_pos if self.white_to_move else self.black_king_pos
+        king_sq = king_pos[0] * 8 + king_pos[1]
+        if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+            m = pack_move(king_sq, king_sq + 2 if len(text) == 3 else king_sq - 2, 0, CASTLE_FLAG)
+            self.prepare_moves()
+            if m in self.legal_moves_from(king_sq):
+                return m
+            raise ValueError("illegal castling %r" % san)
+        promotion = 0
+        if len(text) > 2 and text[-1] in "QRBN" and text[0] not in "NBRQK":  # e8=Q or e8Q
+            promotion = PROMOTION_PIECES.index(text[-1])
+            text = text[:-2] if text[-2] == "=" else text[:-1]
+        kind = text[0] if text[:1] in ("N", "B", "R", "Q", "K") else "P"
+        body = text[1:] if kind != "P" else text
+        try:
+            end_row, end_col = parse_square(body[-2:])
+        except ValueError:
+            raise ValueError("bad SAN %r" % san) from None
+        end = end_row * 8 + end_col
+        hint = body[:-2].replace("x", "")  # disambiguation: a file, a rank or a whole square
+        piece = ally_color + kind
+        if kind == "P":
+            if "x" in body:
+                candidates = self.origins(piece, end)
+            else:  # pushes: one square, or two from the starting row
+                step = 8 if self.white_to_move else -8
+                start_row = 6 if self.white_to_move else 1
+                occupied = self.occupancy["w"] | self.occupancy["b"]
+                candidates = 0
+                if not occupied >> end & 1 and 0 <= end + step < 64:
+                    if self.bitboards[piece] >> (end + step) & 1:
+                        candidates = 1 << (end + step)
+                    elif (end + 2 * step) >> 3 == start_row and not occupied >> (end + step) & 1:
+                        candidates = self.bitboards[piece] & (1 << (end + 2 * step))
+        else:
+            candidates = self.origins(piece, end)
+        for char in hint:
+            if char in Move.files_to_cols:
+                candidates &= FILE_MASKS[Move.files_to_cols[char]]
+            elif char in Move.ranks_to_rows:
+                candidates &= RANK_MASKS[Move.ranks_to_rows[char]]
+            else:
+                raise ValueError("bad SAN %r" % san)
+        last_row = 0 if self.white_to_move else 7
+        if kind == "P" and (end_row == last_row) != bool(promotion):
+            raise ValueError("bad promotion in %r" % san)
+        en_passant = self.en_passant_possible
+        flag = 0
+        if kind == "P" and "x" in body and self.board[end_row][end_col] == "--":
+            if en_passant != (end_row, end_col):
+                raise ValueError("illegal move %r" % san)
+            flag = EN_PASSANT_FLAG
+        found = []
+        if candidates:
+            in_check, pins, checks = self.check_for_pins_and_checks()
+            for start in squares(candidates):
+                m = pack_move(start, end, promotion, flag)
+                if self.pseudo_move_legal(m, pins, checks):
+                    found.append(m)
+        if len(found) != 1:
+            raise ValueError("%s move %r" % ("ambiguous" if found else "illegal", san))
+        return found[0]
 
     def check_for_pins_and_checks(self):
         '''
-        Returns a list of pins and a list of potential checks if the player is in check
+        Returns if the player is in check, a dict of pins and a list of checks
+        pins map the pinned square to the squares it can still move to (up to and including the pinner),
+        checks are (row, col, mask) with mask the squares that block that check or capture the checker
         '''
-        pins = []  # position of allied pinned piece and direction from where it's pinned
-        checks = []  # squares where enemy is (potentially) checking player
-        in_check = False
+        pins = {}
+        checks = []
         if self.white_to_move:
             enemy_color = "b"
             ally_color = "w"
-            start_row = self.white_king_pos[0]
-            start_col = self.white_king_pos[1]
+            king_sq = self.white_king_pos[0] * 8 + self.white_king_pos[1]
         else:
             enemy_color = "w"
             ally_color = "b"
-            start_row = self.black_king_pos[0]
-            start_col = self.black_king_pos[1]
-        # check outward from king for pins and checks, keep track of (potential) pins
-        directions = ((-1, 0), (1, 0), (0, 1), (0, -1), (-1, -1), (-1, 1), (1, 1), (1, -1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possible_pin = ()
-            for i in range(1, 8):
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K":
-                        if possible_pin == ():
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else:
-                            break
-                    elif end_piece[0] == enemy_color:
-                        piece_type = end_piece[1]
-                        if (0 <= j <= 3 and piece_type == "R") or \
-                                (4 <= j <= 7 and piece_type == "B") or \
-                                (i == 1 and piece_type == "P" and ((enemy_color == "w" and 6 <= j <= 7) or (
-                                        enemy_color == "b" and 4 <= j <= 5))) or \
-                                (piece_type == "Q") or (i == 1 and piece_type == "K"):
-                            if possible_pin == ():
-                                print("Check")
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else:
-                                pins.append(possible_pin)
-                                break
-                        else:
-                            break
-                else:
-                    break
-        knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knight_moves:
-            end_row = start_row + m[0]
-            end_col = start_col + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == "N":
-                    in_check = True
-                    # noinspection PyUnboundLocalVariable
-                    checks.append((end_row, end_col, d[0], d[1]))
-        return in_check, pins, checks
+            king_sq = self.black_king_pos[0] * 8 + self.black_king_pos[1]
+        b = self.bitboards
+        own = self.occupancy[ally_color]
+        enemies = self.occupancy[enemy_color]
+        # enemy sliders that would hit the king if none of our pieces were in the way
+        sliders = (rook_attacks(king_sq, enemies) & (b[enemy_color + "R"] | b[enemy_color + "Q"])) | \
+                  (bishop_attacks(king_sq, enemies) & (b[enemy_color + "B"] | b[enemy_color + "Q"]))
+        king_row = king_sq * 64
+        for sq in squares(sliders):
+            between = BETWEEN[king_row + sq]
+            blockers = between & own
+            if not blockers:  # clear line to the king: block anywhere in between or capture the slider
+                checks.append(SQ_TO_RC[sq] + (between | 1 << sq,))
+            elif not blockers & (blockers - 1):  # exactly one of our pieces in the way, it's pinned to that line
+                pins[blockers.bit_length() - 1] = between | 1 << sq
+        jumpers = (KNIGHT_ATTACKS[king_sq] & b[enemy_color + "N"]) | \
+                  (PAWN_ATTACKS[ally_color][king_sq] & b[enemy_color + "P"])
+        for sq in squares(jumpers):  # knight and pawn checks can only be answered by capturing
+            checks.append(SQ_TO_RC[sq] + (1 << sq,))
+        return len(checks) > 0, pins, checks
 
 
 class CastleRights:
     '''
     Mapping
     '''
+    __slots__ = ("ws", "bs", "wl", "bl")
+
     def __init__(self, ws, bs, wl, bl):
         self.ws = ws
         self.bs = bs
@@ -514,7 +911,12 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_sq, end_sq, board, is_en_passant=False, is_castle=False):
+    promotion_choices = ("Q", "R", "B", "N")
+
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "start_sq", "end_sq", "piece_moved", "piece_captured",
+                 "is_pawn_promotion", "is_en_passant", "promotion_choice", "move_id", "is_castle", "packed")
+
+    def __init__(self, start_sq, end_sq, board, is_en_passant=False, is_castle=False, promotion_choice="Q"):
         '''
         Variable conversion
         '''
@@ -529,14 +931,28 @@ class Move:
         self.is_pawn_promotion = (self.piece_moved == "wP" and self.end_row == 0) or \
                                  (self.piece_moved == "bP" and self.end_row == 7)
         self.is_en_passant = is_en_passant
+        self.promotion_choice = promotion_choice if self.is_pawn_promotion else None  # piece type promoted to
         self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        if self.is_pawn_promotion:  # keep the four promotions of one pawn move apart
+            self.move_id += 10000 * (self.promotion_choices.index(promotion_choice) + 1)
         if self.is_en_passant:
             self.piece_captured = board[self.start_row][self.end_col]
         self.is_castle = is_castle
+        self.packed = pack_move(self.start_row * 8 + self.start_col, self.end_row * 8 + self.end_col,
+                                PROMOTION_PIECES.index(self.promotion_choice) if self.is_pawn_promotion else 0,
+                                EN_PASSANT_FLAG if is_en_passant else CASTLE_FLAG if is_castle else 0)
+
+    @classmethod
+    def from_packed(cls, m, board):
+        '''
+        Builds the Move for a packed move, board must be the position the move is made from
+        '''
+        flag = m >> 15
+        return cls(SQ_TO_RC[m & 63], SQ_TO_RC[m >> 6 & 63], board, flag == EN_PASSANT_FLAG, flag == CASTLE_FLAG,
+                   PROMOTION_PIECES[m >> 12 & 7] or "Q")
+
     def __repr__(self):
-        #return str(self.start_sq) + str(self.end_sq)
-        # todo make real chess notation
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        return self.get_chess_notation()
 
     def __eq__(self, other):
         '''
@@ -548,10 +964,12 @@ class Move:
 
     def get_chess_notation(self):
         '''
-        Return "chess notation"
+        Long algebraic (UCI) notation like "e2e4" or "e7e8q", GameState.move_to_san gives SAN ("e4", "e8=Q+")
         '''
-        # todo make real chess notation
-        return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        notation = self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += self.promotion_choice.lower()
+        return notation
 
     def get_rank_file(self, r, c):
         '''
@@ -0,0 +1,319 @@
+"""
+evaluation: tapered (middlegame/endgame) material and piece-square tables kept up to date by GameState.set_square,
+plus pluggable extra terms, pawn structure terms go through a pawn hash so they are only worked out once per
+pawn formation
+scores are in centipawns, positive is good for white until evaluate turns them round for the side to move
+"""
+
+from ChessBitboard import FULL, FILE_MASKS, KNIGHT_ATTACKS, KING_ATTACKS, squares, rook_attacks, bishop_attacks, \
+    pawn_attacks
+
+# middlegame and endgame scores and the game phase share one int, each in its own 20 bit lane,
+# so GameState.set_square updates all three with a single addition
+_LANE = 20
+_HALF = 1 << (_LANE - 1)
+_LANE_MASK = (1 << _LANE) - 1
+
+
+def pack_score(mg, eg, phase=0):
+    '''
+    Packs a middlegame score, an endgame score and a phase weight into one int (they add up lane by lane)
+    '''
+    return mg + (eg << _LANE) + (phase << (2 * _LANE))
+
+
+def unpack_score(packed):
+    '''
+    Returns (mg, eg, phase) from pack_score (or from a sum of them)
+    '''
+    mg = ((packed + _HALF) & _LANE_MASK) - _HALF
+    packed = (packed - mg) >> _LANE
+    eg = ((packed + _HALF) & _LANE_MASK) - _HALF
+    return mg, eg, (packed - eg) >> _LANE
+
+
+MAX_PHASE = 24  # phase of the starting material, anything above counts as a pure middlegame
+PHASE_WEIGHTS = {"P": 0, "N": 1, "B": 1, "R": 2, "Q": 4, "K": 0}
+MATERIAL_MG = {"P": 82, "N": 337, "B": 365, "R": 477, "Q": 1025, "K": 0}
+MATERIAL_EG = {"P": 94, "N": 281, "B": 297, "R": 512, "Q": 936, "K": 0}
+
+# piece-square bonuses from white's side, laid out like GameState.board (a8 first, h1 last)
+_PAWN_MG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0)
+_PAWN_EG = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0)
+_KNIGHT = (
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50)
+_BISHOP = (
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20)
+_ROOK = (
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0)
+_QUEEN = (
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20)
+_KING_MG = (
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20)
+_KING_EG = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50)
+_TABLES = {"P": (_PAWN_MG, _PAWN_EG), "N": (_KNIGHT, _KNIGHT), "B": (_BISHOP, _BISHOP), "R": (_ROOK, _ROOK),
+           "Q": (_QUEEN, _QUEEN), "K": (_KING_MG, _KING_EG)}
+
+
+def _psqt():
+    '''
+    PSQT[piece][sq]: packed material + square bonus + phase weight of a piece on a square, negative for black
+    '''
+    table = {}
+    for kind, (mg_table, eg_table) in _TABLES.items():
+        white = []
+        black = []
+        for sq in range(64):
+            white.append(pack_score(MATERIAL_MG[kind] + mg_table[sq], MATERIAL_EG[kind] + eg_table[sq],
+                                    PHASE_WEIGHTS[kind]))
+            mirrored = sq ^ 56  # same file, rank flipped
+            black.append(pack_score(-MATERIAL_MG[kind] - mg_table[mirrored], -MATERIAL_EG[kind] - eg_table[mirrored],
+                                    PHASE_WEIGHTS[kind]))
+        table["w" + kind] = tuple(white)
+        table["b" + kind] = tuple(black)
+    return table
+
+
+PSQT = _psqt()
+
+
+def compute_psqt(board):
+    '''
+    Sum of PSQT over a board from scratch (GameState keeps its own copy up to date incrementally)
+    '''
+    total = 0
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != "--":
+                total += PSQT[piece][r * 8 + c]
+    return total
+
+
+def _passed_masks(color):
+    '''
+    For every square, the squares in front of it on its own and the neighbouring files (where enemy pawns stop it)
+    '''
+    masks = []
+    for sq in range(64):
+        r, c = sq >> 3, sq & 7
+        files = 0
+        for col in (c - 1, c, c + 1):
+            if 0 <= col < 8:
+                files |= FILE_MASKS[col]
+        ahead = ((1 << (8 * r)) - 1) if color == "w" else FULL ^ ((1 << (8 * (r + 1))) - 1)
+        masks.append(files & ahead)
+    return tuple(masks)
+
+
+PASSED_MASKS = {"w": _passed_masks("w"), "b": _passed_masks("b")}
+ADJACENT_FILES = tuple((FILE_MASKS[c - 1] if c > 0 else 0) | (FILE_MASKS[c + 1] if c < 7 else 0) for c in range(8))
+PASSED_BONUS_MG = (0, 60, 40, 25, 15, 10, 5, 0)  # by rows still to go before promoting
+PASSED_BONUS_EG = (0, 120, 80, 50, 30, 15, 10, 0)
+
+
+def pawn_structure(white_pawns, black_pawns):
+    '''
+    Pawn term: doubled and isolated pawns cost, passed pawns score more the closer they are to promoting
+    '''
+    mg = eg = 0
+    for color, pawns, enemies, sign in (("w", white_pawns, black_pawns, 1), ("b", black_pawns, white_pawns, -1)):
+        passed = PASSED_MASKS[color]
+        for c in range(8):
+            on_file = (pawns & FILE_MASKS[c]).bit_count()
+            if on_file > 1:
+                mg -= sign * 10 * (on_file - 1)
+                eg -= sign * 20 * (on_file - 1)
+            if on_file and not pawns & ADJACENT_FILES[c]:
+                mg -= sign * 10 * on_file
+                eg -= sign * 15 * on_file
+        for sq in squares(pawns):
+            if not enemies & passed[sq]:
+                to_go = sq >> 3 if color == "w" else 7 - (sq >> 3)
+                mg += sign * PASSED_BONUS_MG[to_go]
+                eg += sign * PASSED_BONUS_EG[to_go]
+    return mg, eg
+
+
+MOBILITY_WEIGHTS = {"N": (4, 4), "B": (5, 5), "R": (2, 4), "Q": (1, 2)}  # (mg, eg) per square reached
+
+
+def mobility(gs):
+    '''
+    Term: squares each knight, bishop, rook and queen can reach that aren't held by its own side or attacked by pawns
+    '''
+    b = gs.bitboards
+    occupied = gs.occupancy["w"] | gs.occupancy["b"]
+    mg = eg = 0
+    for color, enemy, sign in (("w", "b", 1), ("b", "w", -1)):
+        free = ~(gs.occupancy[color] | pawn_attacks(b[enemy + "P"], enemy))
+        for kind, (mg_weight, eg_weight) in MOBILITY_WEIGHTS.items():
+            for sq in squares(b[color + kind]):
+                if kind == "N":
+                    attacks = KNIGHT_ATTACKS[sq]
+                elif kind == "B":
+                    attacks = bishop_attacks(sq, occupied)
+                elif kind == "R":
+                    attacks = rook_attacks(sq, occupied)
+                else:
+                    attacks = rook_attacks(sq, occupied) | bishop_attacks(sq, occupied)
+                count = (attacks & free).bit_count()
+                mg += sign * mg_weight * count
+                eg += sign * eg_weight * count
+    return mg, eg
+
+
+def king_safety(gs):
+    '''
+    Term: middlegame bonus for own pawns right around the king
+    '''
+    b = gs.bitboards
+    mg = 0
+    for color, sign in (("w", 1), ("b", -1)):
+        king = b[color + "K"]
+        if king:
+            mg += sign * 12 * (KING_ATTACKS[king.bit_length() - 1] & b[color + "P"]).bit_count()
+    return mg, 0
+
+
+class PawnCache:
+    '''
+    Bounded cache of pawn term results keyed by the two pawn bitboards (so it can never return a wrong entry)
+    '''
+    def __init__(self, size=16384):
+        self.size = size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = 0
+
+
+class Evaluator:
+    '''
+    Evaluates GameStates: the incrementally kept material and piece-square score, then every term
+    terms are functions(gs) -> (mg, eg), pawn terms functions(white_pawns, black_pawns) -> (mg, eg) whose sum is
+    cached per pawn formation, all from white's side
+    '''
+    def __init__(self, terms=(), pawn_terms=(pawn_structure,), pawn_cache_size=16384):
+        self.terms = list(terms)
+        self.pawn_terms = list(pawn_terms)
+        self.pawn_cache = PawnCache(pawn_cache_size)
+
+    def add_term(self, term):
+        self.terms.append(term)
+
+    def add_pawn_term(self, term):
+        self.pawn_terms.append(term)
+        self.pawn_cache.clear()  # cached sums don't include the new term
+
+    def pawn_score(self, white_pawns, black_pawns):
+        '''
+        Sum of the pawn terms for a pawn formation, from the cache when it has been seen before
+        '''
+        cache = self.pawn_cache
+        key = (white_pawns, black_pawns)
+        score = cache.entries.get(key)
+        if score is not None:
+            cache.hits += 1
+            return score
+        cache.misses += 1
+        mg = eg = 0
+        for term in self.pawn_terms:
+            term_mg, term_eg = term(white_pawns, black_pawns)
+            mg += term_mg
+            eg += term_eg
+        score = (mg, eg)
+        if len(cache.entries) >= cache.size:
+            cache.entries.clear()  # cheaper than tracking which entry is oldest
+        cache.entries[key] = score
+        return score
+
+    def evaluate(self, gs):
+        '''
+        Score of gs in centipawns from the point of view of the side to move
+        '''
+        mg, eg, phase = unpack_score(gs.psqt)
+        if self.pawn_terms:
+            pawn_mg, pawn_eg = self.pawn_score(gs.bitboards["wP"], gs.bitboards["bP"])
+            mg += pawn_mg
+            eg += pawn_eg
+        for term in self.terms:
+            term_mg, term_eg = term(gs)
+            mg += term_mg
+            eg += term_eg
+        if phase > MAX_PHASE:  # early promotions can push the phase past the starting material
+            phase = MAX_PHASE
+        score = mg * phase + eg * (MAX_PHASE - phase)
+        return (score if gs.white_to_move else -score) // MAX_PHASE  # turn round first so both sides round alike
+
+
+DEFAULT_EVALUATOR = Evaluator()
+
+
+def evaluate(gs):
+    '''
+    Score of gs for the side to move with the default terms (material, piece-square tables, pawn structure)
+    '''
+    return DEFAULT_EVALUATOR.evaluate(gs)
@@ -0,0 +1,180 @@
+"""
+FEN and EPD: reading and writing positions as text
+everything here works on plain strings, lists and tuples, GameState.from_fen/to_fen build on it
+"""
+
+import re
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+_FILES = "abcdefgh"
+_EPD_OPERATION = re.compile(r'\s*([A-Za-z]\w*)((?:\s+(?:"[^"]*"|[^\s;"]+))*)\s*;')
+_EPD_OPERAND = re.compile(r'"([^"]*)"|([^\s;"]+)')
+
+
+def parse_square(name):
+    '''
+    (row, col) of a square name like "e3"
+    '''
+    if len(name) != 2 or name[0] not in _FILES or name[1] not in "12345678":
+        raise ValueError("bad square %r" % name)
+    return 8 - int(name[1]), _FILES.index(name[0])
+
+
+def square_name(r, c):
+    '''
+    Name of square [r][c], "e3" style
+    '''
+    return _FILES[c] + str(8 - r)
+
+
+def parse_fen(fen):
+    '''
+    Splits a FEN string into (board, white_to_move, castling, en_passant, halfmove_clock, fullmove_number)
+    board is an 8x8 list like GameState.board, castling a (ws, bs, wl, bl) tuple of bools, en_passant (row, col) or ()
+    the clocks are optional and default to 0 and 1, raises ValueError for anything malformed or impossible
+    (not one king a side, an en passant square no pawn can have skipped), castling rights that can't be used
+    any more are dropped
+    '''
+    fields = fen.split()
+    if len(fields) not in (4, 6):
+        raise ValueError("FEN needs 4 or 6 fields: %r" % fen)
+    ranks = fields[0].split("/")
+    if len(ranks) != 8:
+        raise ValueError("FEN board needs 8 ranks: %r" % fields[0])
+    board = []
+    for rank in ranks:
+        row = []
+        for char in rank:
+            if char in "12345678":
+                row.extend(["--"] * int(char))
+            elif char in "PNBRQKpnbrqk":
+                row.append(("w" if char.isupper() else "b") + char.upper())
+            else:
+                raise ValueError("bad FEN piece %r" % char)
+        if len(row) != 8:
+            raise ValueError("FEN rank needs 8 squares: %r" % rank)
+        board.append(row)
+    for king in ("wK", "bK"):
+        count = sum(row.count(king) for row in board)
+        if count != 1:
+            raise ValueError("FEN needs one %s king, not %d: %r" % ("white" if king == "wK" else "black", count,
+                                                                  fields[0]))
+    if fields[1] not in ("w", "b"):
+        raise ValueError("bad FEN side to move %r" % fields[1])
+    white_to_move = fields[1] == "w"
+    rights = fields[2]
+    if rights != "-" and (not rights or set(rights) - set("KQkq")):
+        raise ValueError("bad FEN castling rights %r" % rights)
+    # a right whose king or rook isn't on its home square can never be used, so it's dropped
+    castling = ("K" in rights and board[7][4] == "wK" and board[7][7] == "wR",
+                "k" in rights and board[0][4] == "bK" and board[0][7] == "bR",
+                "Q" in rights and board[7][4] == "wK" and board[7][0] == "wR",
+                "q" in rights and board[0][4] == "bK" and board[0][0] == "bR")
+    en_passant = ()
+    if fields[3] != "-":
+        r, c = en_passant = parse_square(fields[3])
+        # the square the other side's pawn just skipped: empty, on the third rank from that side, pawn in front
+        if r != (2 if white_to_move else 5) or board[r][c] != "--" or \
+                board[r + 1 if white_to_move else r - 1][c] != ("bP" if white_to_move else "wP"):
+            raise ValueError("impossible FEN en passant square %r" % fields[3])
+    halfmove_clock, fullmove_number = (int(fields[4]), int(fields[5])) if len(fields) == 6 else (0, 1)
+    return board, white_to_move, castling, en_passant, halfmove_clock, fullmove_number
+
+
+def board_fen(board):
+    '''
+    The piece placement field of a FEN for an 8x8 board
+    '''
+    ranks = []
+    for row in board:
+        rank = ""
+        empty = 0
+        for piece in row:
+            if piece == "--":
+                empty += 1
+                continue
+            if empty:
+                rank += str(empty)
+                empty = 0
+            rank += piece[1] if piece[0] == "w" else piece[1].lower()
+        ranks.append(rank + str(empty) if empty else rank)
+    return "/".join(ranks)
+
+
+def format_fen(board, white_to_move, castling, en_passant, halfmove_clock=0, fullmove_number=1):
+    '''
+    Builds a FEN string, the arguments are what parse_fen returns
+    '''
+    rights = "".join(char for char, allowed in zip("KkQq", castling) if allowed)
+    rights = "".join(sorted(rights, key="KQkq".index)) or "-"
+    return "%s %s %s %s %d %d" % (board_fen(board), "w" if white_to_move else "b", rights,
+                                  square_name(*en_passant) if en_passant else "-", halfmove_clock, fullmove_number)
+
+
+def parse_epd(line):
+    '''
+    Splits an EPD line into (fen, operations), operations maps each opcode to its list of operands
+    the FEN gets its clocks from the hmvc/fmvn operations when present, a plain 6 field FEN line is accepted too
+    '''
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("EPD needs at least 4 fields: %r" % line)
+    rest = fields[4] if len(fields) == 5 else ""
+    clocks = rest.split()
+    if len(clocks) == 2 and clocks[0].isdigit() and clocks[1].isdigit():  # a FEN, not an EPD
+        return " ".join(fields[:4]) + " " + rest.strip(), {}
+    operations = {}
+    position = 0
+    while position < len(rest):
+        match = _EPD_OPERATION.match(rest, position)
+        if match is None:
+            if rest[position:].strip():
+                raise ValueError("bad EPD operation: %r" % rest[position:])
+            break
+        operations[match.group(1)] = [quoted or plain for quoted, plain in _EPD_OPERAND.findall(match.group(2))]
+        position = match.end()
+    halfmove_clock = operations.get("hmvc", ["0"])[0]
+    fullmove_number = operations.get("fmvn", ["1"])[0]
+    return "%s %s %s" % (" ".join(fields[:4]), halfmove_clock, fullmove_number), operations
+
+
+def format_epd(fen, operations=None):
+    '''
+    Builds an EPD line from a FEN (its clocks are dropped) and a dict of opcode -> operand list (or single operand)
+    '''
+    line = " ".join(fen.split()[:4])
+    for opcode, operands in (operations or {}).items():
+        if isinstance(operands, str):
+            operands = [operands]
+        line += " " + " ".join([opcode] + ['"%s"' % operand if " " in operand or not operand else operand
+                                           for operand in operands]) + ";"
+    return line
+
+
+def read_epd(source):
+    '''
+    Yields (fen, operations) for every position in an EPD or FEN file, one line at a time
+    source is a path or an open text file, blank lines and lines starting with # are skipped
+    nothing but the current line is held in memory, turn a position into a GameState only when it's needed
+    '''
+    if isinstance(source, str):
+        with open(source) as file:
+            yield from read_epd(file)
+        return
+    for number, line in enumerate(source, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield parse_epd(line)
+        except ValueError as error:
+            raise ValueError("line %d: %s" % (number, error)) from None
+
+
+def write_epd(file, records):
+    '''
+    Writes (fen, operations) pairs to an open text file, one EPD line each
+    '''
+    for fen, operations in records:
+        file.write(format_epd(fen, operations) + "\n")
@@ -5,12 +5,24 @@ main driver file, handles user input and gui display
 
 import pygame as p
 import ChessEngine
+import ChessWorker
+from ChessBitboard import SQ_TO_RC
+from ChessEngine import PROMOTION_PIECES
+from ChessUci import uci_move, uci_score
 
 WIDTH = HEIGHT = 512  # board size
 DIMENSION = 8  # amount of rows and columns
 SQ_SIZE = HEIGHT // DIMENSION  # tile size
 MAX_FPS = 15  # animation speed?
+LIGHT_COLOR = "lightslategray"
+DARK_COLOR = "darkslategray"
+HIGHLIGHT_COLOR = (255, 215, 0, 90)  # selected square overlay, translucent
 IMAGES = {}  # dictionary of images
+PLAYER_ONE = True  # True if a human plays white, False if the engine does
+PLAYER_TWO = True  # same for black
+ENGINE_MOVETIME = 2.0  # seconds the engine thinks per move
+ANALYSE = True  # the engine analyses while a human thinks, shown in the window title
+PROMOTION_COLOR = "ivory"  # background of the in-window promotion chooser
 
 '''
 initializes glob dict of images. only call once
@@ -27,6 +39,8 @@ def load_images():
 
 '''
 main driver code (user input & graphics)
+move generation and the engine run in a worker process, this loop only draws and passes messages,
+so the frame rate holds whatever the engine is doing
 '''
 
 
@@ -36,23 +50,46 @@ def main():
     clock = p.time.Clock()  # initializes clock
     screen.fill(p.Color("pink"))  # background color
     gs = ChessEngine.GameState()  # generates current gamestate
-    valid_moves = gs.get_valid_moves()  # generates valid moves
-    move_made = False  # flag var for when a move is made
+    worker = ChessWorker.EngineWorker()  # legal moves, engine moves and analysis, off the render loop
+    move_lookup = new_position(worker, gs)  # None until the worker sends this position's legal moves
 
     load_images()  # generates images
+    board_surface = render_board()  # squares drawn once, copied from here afterwards
+    highlight = p.Surface((SQ_SIZE, SQ_SIZE), p.SRCALPHA)
+    highlight.fill(HIGHLIGHT_COLOR)
+    shown = None  # board and selection as last drawn, None forces a full redraw
     running = True
     sq_selected = ()  # keeps track of last click location user
     player_clicks = []  # keeps track of player clicks (two tuples: [(4, 7), (3, 5)])
+    promotion = None  # (promotion square, its moves) while the user picks a piece in the window
     while running:  # main while loop (where the magic happens)
-        for e in p.event.get():
+        human_turn = (gs.white_to_move and PLAYER_ONE) or (not gs.white_to_move and PLAYER_TWO)
+        move_made = False  # flag var for when a move is made
+        events = p.event.get()
+        # the human's move, its legal moves in and no analysis coming: nothing to do until the user acts, so sleep
+        if not events and human_turn and move_lookup is not None and not ANALYSE:
+            events = [p.event.wait()]
+        for e in events:
             if e.type == p.QUIT:  # stops program when window is closed
                 running = False
+            elif e.type == p.VIDEOEXPOSE:  # window was covered or restored, redraw all of it
+                shown = None
 
             # handles mouse events
-            elif e.type == p.MOUSEBUTTONDOWN:
+            elif e.type == p.MOUSEBUTTONDOWN and human_turn and not move_made:
                 location = p.mouse.get_pos()  # location of mouse
                 col = location[0] // SQ_SIZE  # y_pos mouse
                 row = location[1] // SQ_SIZE  # x_pos mouse
+                if promotion is not None:  # a click on the chooser picks a piece, anywhere else cancels
+                    choice = promotion_choice_at(promotion[0], (row, col))
+                    candidates = [m for m in promotion[1] if PROMOTION_PIECES[m >> 12 & 7] == choice]
+                    if candidates:
+                        move_made = play(gs, candidates[0])
+                    promotion = None
+                    sq_selected = ()
+                    player_clicks = []
+                    shown = None
+                    continue
                 if sq_selected == (row, col):  # if we clicked something, where?
                     sq_selected = ()
                     player_clicks = []
@@ -60,52 +97,180 @@ def main():
                     sq_selected = (row, col)
                     player_clicks.append(sq_selected)
                 if len(player_clicks) == 2:  # after 2nd click (move piece)
-                    move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.board)  # keeps track of current move
-                    print(move.get_chess_notation())  # prints move to console
-                    for i in range(len(valid_moves)):
-                        if move == valid_moves[i]:  # checks if move valid
-                            gs.make_move(valid_moves[i])  # this actually makes the move
-                            move_made = True
-                            sq_selected = ()  # emptying to get rea-
-                            player_clicks = []  # -dy for a new move
-                    if not move_made:
+                    candidates = (move_lookup or {}).get((player_clicks[0], player_clicks[1]), ())
+                    if len(candidates) > 1:  # a promotion, the user picks the piece in the window
+                        promotion = (player_clicks[1], candidates)
+                        shown = None
+                    elif candidates:  # checks if move valid
+                        move_made = play(gs, candidates[0])
+                        sq_selected = ()  # emptying to get rea-
+                        player_clicks = []  # -dy for a new move
+                    else:
                         player_clicks = [sq_selected]
             # handles keyboard events
             elif e.type == p.KEYDOWN:
-                if e.key == p.K_LEFT:  # undo when left key is pressed
+                if e.key == p.K_ESCAPE and promotion is not None:  # closes the chooser without moving
+                    promotion = None
+                    shown = None
+                elif e.key == p.K_LEFT and gs.move_log:  # undo when left key is pressed
                     gs.undo_move()
+                    promotion = None
+                    shown = None
                     move_made = True
 
+        for reply in worker.poll():  # whatever the worker finished since the last frame, never waits
+            if move_made:
+                break
+            kind = reply[0]
+            if kind == "moves":
+                move_lookup = build_move_lookup(reply[2])
+                if not reply[2]:
+                    p.display.set_caption("checkmate" if reply[3] else "stalemate")
+                elif not human_turn:  # engine's turn
+                    worker.go(ENGINE_MOVETIME)
+            elif kind == "bestmove" and reply[2] is not None and not human_turn:
+                move_made = play(gs, reply[2])
+            elif kind == "info":  # analysis so far, from white's point of view, in the title bar
+                _, _, depth, score, pv = reply
+                p.display.set_caption("depth %d  %s  %s" % (depth, uci_score(score if gs.white_to_move else -score),
+                                                            " ".join(uci_move(m) for m in pv[:8])))
+
         if move_made:  # if we made a move
-            valid_moves = gs.get_valid_moves()  # generate new valid moves
-            move_made = False
+            move_lookup = new_position(worker, gs)
 
-        draw_game_state(screen, gs)
+        shown = draw_game_state(screen, gs, board_surface, highlight, sq_selected, shown)
+        if promotion is not None:
+            draw_promotion(screen, promotion[0], "w" if gs.white_to_move else "b")
         clock.tick(MAX_FPS)
-        p.display.flip()
+    worker.close()
+    p.quit()
+
+
+'''
+sends the game to the worker, which answers with the legal moves (and analyses on a human's turn)
+returns the move lookup to use until they arrive: none, so clicks can't play a move yet
+'''
+
+
+def new_position(worker, gs):
+    human_turn = (gs.white_to_move and PLAYER_ONE) or (not gs.white_to_move and PLAYER_TWO)
+    worker.set_position(gs, ANALYSE and human_turn)
+    return None
 
 
 '''
-creates all graphics within current game state
+plays a packed move from the worker or the move lookup
 '''
 
 
-def draw_game_state(screen, gs):
-    draw_board(screen)
-    draw_pieces(screen, gs.board)
+def play(gs, m):
+    move = ChessEngine.Move.from_packed(m, gs.board)
+    print(move.get_chess_notation())  # prints move to console
+    gs.make_move(move)  # this actually makes the move
+    return True
 
 
 '''
-draw chessboard
+legal packed moves grouped by (from, to) square pair, promotions have one move per piece
 '''
 
 
-def draw_board(screen):
-    colors = [p.Color("lightslategray"), p.Color("darkslategray")]
+def build_move_lookup(moves):
+    lookup = {}
+    for m in moves:
+        lookup.setdefault((SQ_TO_RC[m & 63], SQ_TO_RC[m >> 6 & 63]), []).append(m)
+    return lookup
+
+
+'''
+promotion chooser: the four pieces in a column from the promotion square towards the middle of the board
+'''
+
+
+def promotion_squares(square):
+    row, col = square
+    step = 1 if row == 0 else -1
+    return [((row + step * i, col), choice) for i, choice in enumerate(ChessEngine.Move.promotion_choices)]
+
+
+def promotion_choice_at(square, clicked):
+    for chooser_square, choice in promotion_squares(square):
+        if chooser_square == clicked:
+            return choice
+    return None
+
+
+def draw_promotion(screen, square, color):
+    rects = []
+    for (r, c), choice in promotion_squares(square):
+        rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        p.draw.rect(screen, p.Color(PROMOTION_COLOR), rect)
+        screen.blit(IMAGES[color + choice], rect)
+        rects.append(rect)
+    p.display.update(rects)
+
+
+'''
+creates all graphics within current game state, only squares that changed since the last call are redrawn
+returns what is on screen now, pass it back next time (None redraws everything)
+'''
+
+
+def draw_game_state(screen, gs, board_surface, highlight, sq_selected, shown):
+    if shown is None:
+        screen.blit(board_surface, (0, 0))
+        draw_pieces(screen, gs.board)
+        if sq_selected:
+            draw_square(screen, board_surface, highlight, gs.board, *sq_selected, True)
+        p.display.flip()
+    else:
+        old_board, old_selected = shown
+        dirty = []
+        for r in range(DIMENSION):
+            if old_board[r] == gs.board[r]:
+                continue
+            for c in range(DIMENSION):
+                if old_board[r][c] != gs.board[r][c]:
+                    dirty.append((r, c))
+        if old_selected != sq_selected:
+            dirty.extend(sq for sq in (old_selected, sq_selected) if sq)
+        if not dirty:
+            return shown
+        rects = [draw_square(screen, board_surface, highlight, gs.board, r, c, (r, c) == sq_selected)
+                 for r, c in dirty]
+        p.display.update(rects)
+    return [row[:] for row in gs.board], sq_selected
+
+
+'''
+draw chessboard once onto its own surface, squares are copied from it afterwards
+'''
+
+
+def render_board():
+    surface = p.Surface((WIDTH, HEIGHT))
+    colors = [p.Color(LIGHT_COLOR), p.Color(DARK_COLOR)]
     for r in range(DIMENSION):
         for c in range(DIMENSION):
             color = colors[((r + c) % 2)]
-            p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+            p.draw.rect(surface, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+    return surface
+
+
+'''
+redraws one square: background from the board surface, the selection overlay and the piece, returns its rect
+'''
+
+
+def draw_square(screen, board_surface, highlight, board, r, c, selected):
+    rect = p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(board_surface, rect, rect)
+    if selected:
+        screen.blit(highlight, rect)
+    piece = board[r][c]
+    if piece != "--":
+        screen.blit(IMAGES[piece], rect)
+    return rect
 
 
 '''
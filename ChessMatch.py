@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""
+engine matches: two engines play each other from a list of openings (every opening twice, colours swapped),
+many games at once on a process pool, with an SPRT deciding as early as possible whether the first engine is
+stronger than the second
+an engine is this package's Search run in the game's own process, or any UCI engine run as a subprocess
+(e.g. an older checkout's ChessUci.py), so a change is measured against the code it replaces
+games are adjudicated on the board (mate, stalemate, threefold repetition, fifty moves) and written out as PGN
+"""
+
+import argparse
+import concurrent.futures
+import math
+import os
+import queue
+import random
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+import ChessEngine
+import ChessPgn
+from ChessFen import START_FEN, read_epd
+from ChessSearch import MAX_PLY, Search
+from ChessUci import uci_move, parse_uci_move
+
+DEFAULT_OPENINGS = (
+    START_FEN,
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkb1r/pppppppp/5n2/8/2P5/8/PP1PPPPP/RNBQKBNR w KQkq - 1 2",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkbnr/pppp1ppp/4p3/8/3PP3/8/PPP2PPP/RNBQKBNR b KQkq - 0 2",
+    "rnbqkbnr/pp2pppp/2p5/3p4/3PP3/8/PPP2PPP/RNBQKBNR w KQkq - 0 3",
+)
+MOVE_GRACE = 5.0  # seconds a UCI engine may overrun its move time before it loses on time
+
+
+def parse_engine(words):
+    '''
+    Engine spec dict from key=value words: name, cmd (a UCI command line, none for the built in search),
+    movetime (seconds), depth, nodes, hash (MB, built in search) and option.NAME=VALUE (UCI setoption)
+    '''
+    spec = {"options": {}}
+    for word in words:
+        key, sep, value = word.partition("=")
+        if not sep:
+            raise ValueError("engine setting %r is not key=value" % word)
+        if key.startswith("option."):
+            spec["options"][key[7:]] = value
+        elif key == "movetime":
+            spec[key] = float(value)
+        elif key in ("depth", "nodes", "hash"):
+            spec[key] = int(value)
+        elif key in ("name", "cmd"):
+            spec[key] = value
+        else:
+            raise ValueError("unknown engine setting %r" % key)
+    spec.setdefault("name", "engine")
+    return spec
+
+
+class SearchPlayer:
+    '''
+    The package's own Search, played in this process
+    '''
+    def __init__(self, spec):
+        self.searcher = Search(tt_mb=spec.get("hash", 16))
+        self.cpu = 0.0
+
+    def new_game(self):
+        self.searcher.clear()
+
+    def move(self, gs, start_fen, moves, movetime, depth, nodes):
+        '''
+        Returns (move in coordinate notation or None, nodes searched)
+        '''
+        start = time.process_time()
+        result = self.searcher.search(gs, depth or MAX_PLY, movetime, nodes)
+        self.cpu += time.process_time() - start
+        if result.best_move is None:
+            return None, result.nodes
+        return uci_move(result.best_move.packed), result.nodes
+
+    def cpu_time(self):
+        return self.cpu
+
+    def close(self):
+        pass
+
+
+class UciPlayer:
+    '''
+    A UCI engine subprocess, its output read on a thread so a hung engine can be timed out
+    '''
+    def __init__(self, spec):
+        self.process = subprocess.Popen(shlex.split(spec["cmd"]), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.reader.start()
+        self.send("uci")
+        self.wait_for("uciok", 10.0)
+        for name, value in spec["options"].items():
+            self.send("setoption name %s value %s" % (name, value))
+        if "hash" in spec:
+            self.send("setoption name Hash value %d" % spec["hash"])
+        self.wall = 0.0  # thinking time by the clock, used when the engine's CPU time can't be read
+
+    def read(self):
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)
+
+    def send(self, line):
+        self.process.stdin.write(line + "\n")
+        self.process.stdin.flush()
+
+    def wait_for(self, token, timeout):
+        '''
+        Reads lines until one starts with token, returns it (None on timeout or if the engine exits)
+        '''
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                return None
+            if line is None:
+                return None
+            if line.split(" ", 1)[0] == token:
+                return line
+
+    def new_game(self):
+        self.send("ucinewgame")
+        self.send("isready")
+        self.wait_for("readyok", 10.0)
+
+    def move(self, gs, start_fen, moves, movetime, depth, nodes):
+        self.send("position fen %s%s" % (start_fen, " moves " + " ".join(moves) if moves else ""))
+        limits = []
+        if movetime is not None:
+            limits.append("movetime %d" % max(1, int(movetime * 1000)))
+        if depth is not None:
+            limits.append("depth %d" % depth)
+        if nodes is not None:
+            limits.append("nodes %d" % nodes)
+        start = time.perf_counter()
+        self.send("go " + (" ".join(limits) or "depth 4"))
+        searched = 0
+        deadline = start + movetime * 3 + MOVE_GRACE if movetime is not None else None  # no clock on depth/nodes
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.0, deadline - time.perf_counter()) if deadline else None)
+            except queue.Empty:
+                line = None
+            if line is None:
+                self.wall += time.perf_counter() - start
+                return None, searched
+            words = line.split()
+            if words and words[0] == "info" and "nodes" in words:
+                searched = int(words[words.index("nodes") + 1])
+            elif words and words[0] == "bestmove":
+                self.wall += time.perf_counter() - start
+                return (words[1] if len(words) > 1 and words[1] != "0000" else None), searched
+
+    def cpu_time(self):
+        '''
+        User + system CPU seconds of the engine process (Linux /proc), its thinking time by the clock elsewhere
+        '''
+        try:
+            with open("/proc/%d/stat" % self.process.pid) as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError, IndexError):
+            return self.wall
+
+    def close(self):
+        try:
+            self.send("quit")
+            self.process.wait(2.0)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+def make_player(spec):
+    return UciPlayer(spec) if spec.get("cmd") else SearchPlayer(spec)
+
+
+def adjudicate(gs, max_plies, plies):
+    '''
+    (result, termination) when the game is over, None while it goes on
+    '''
+    if not gs.has_legal_move():
+        if gs.in_check:
+            return ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if gs.repetition_count() >= 3:
+        return "1/2-1/2", "threefold repetition"
+    if gs.halfmove_clock >= 100:
+        return "1/2-1/2", "fifty moves"
+    if plies >= max_plies:
+        return "1/2-1/2", "move limit"
+    return None
+
+
+def play_game(job):
+    '''
+    Worker side of one game: job is (round, opening fen, white spec, black spec, limits), limits a dict with
+    movetime, depth, nodes (defaults for engines that don't set their own) and max_plies
+    returns a dict of the moves, result, termination and each side's CPU seconds, nodes and moves
+    '''
+    number, fen, white, black, limits = job
+    gs = ChessEngine.GameState.from_fen(fen)
+    players = (make_player(white), make_player(black))
+    moves = []
+    nodes = [0, 0]
+    counts = [0, 0]
+    try:
+        for player in players:
+            player.new_game()
+        while True:
+            over = adjudicate(gs, limits.get("max_plies", 400), len(moves))
+            if over is not None:
+                result, termination = over
+                break
+            side = 0 if gs.white_to_move else 1
+            spec = (white, black)[side]
+            text, searched = players[side].move(gs, fen, moves, spec.get("movetime", limits.get("movetime")),
+                                                spec.get("depth", limits.get("depth")),
+                                                spec.get("nodes", limits.get("nodes")))
+            nodes[side] += searched
+            counts[side] += 1
+            if text is None:
+                result, termination = ("0-1" if side == 0 else "1-0"), "time forfeit"
+                break
+            try:
+                m = parse_uci_move(gs, text)
+            except ValueError:
+                result, termination = ("0-1" if side == 0 else "1-0"), "illegal move %s" % text
+                break
+            gs.make_move(ChessEngine.Move.from_packed(m, gs.board))
+            moves.append(text)
+        cpu = [player.cpu_time() for player in players]
+    finally:
+        for player in players:
+            player.close()
+    return {"round": number, "fen": fen, "white": white["name"], "black": black["name"], "moves": moves,
+            "result": result, "termination": termination, "cpu": cpu, "nodes": nodes, "counts": counts}
+
+
+def expected_score(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def score_to_elo(score):
+    score = min(max(score, 1e-6), 1.0 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    '''
+    Log likelihood ratio of elo1 against elo0 from a win/draw/loss count (normal approximation to the
+    trinomial, logistic Elo)
+    '''
+    n = wins + draws + losses
+    if not n:
+        return 0.0
+    score = (wins + draws / 2) / n
+    variance = (wins + draws / 4) / n - score * score
+    if variance <= 0:
+        return 0.0
+    s0 = expected_score(elo0)
+    s1 = expected_score(elo1)
+    return (s1 - s0) * (2 * score - s0 - s1) / (2 * variance / n)
+
+
+def sprt_bounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+class MatchStats:
+    '''
+    Wins, draws and losses of the first engine against the second, with Elo, likelihood of superiority and SPRT
+    '''
+    def __init__(self, first, second, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        self.first = first
+        self.second = second
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.lower, self.upper = sprt_bounds(alpha, beta)
+        self.wins = self.draws = self.losses = 0
+        self.cpu = {first: 0.0, second: 0.0}
+        self.nodes = {first: 0, second: 0}
+        self.moves = {first: 0, second: 0}
+        self.terminations = {}
+        self.decision = None  # "H1" (first is stronger by elo1) or "H0" (not by elo0) once the SPRT stops
+
+    def add(self, game):
+        points = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}[game["result"]]
+        if game["black"] == self.first:
+            points = 1.0 - points
+        if points == 1.0:
+            self.wins += 1
+        elif points == 0.0:
+            self.losses += 1
+        else:
+            self.draws += 1
+        for side, name in enumerate((game["white"], game["black"])):
+            self.cpu[name] += game["cpu"][side]
+            self.nodes[name] += game["nodes"][side]
+            self.moves[name] += game["counts"][side]
+        self.terminations[game["termination"]] = self.terminations.get(game["termination"], 0) + 1
+        if self.decision is None:
+            llr = self.llr()
+            if llr >= self.upper:
+                self.decision = "H1"
+            elif llr <= self.lower:
+                self.decision = "H0"
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    def llr(self):
+        return sprt_llr(self.wins, self.draws, self.losses, self.elo0, self.elo1)
+
+    def elo(self):
+        '''
+        (Elo difference, 95% error margin) of the first engine
+        '''
+        n = self.games
+        if not n:
+            return 0.0, 0.0
+        score = (self.wins + self.draws / 2) / n
+        deviation = math.sqrt(max(0.0, (self.wins + self.draws / 4) / n - score * score) / n)
+        return score_to_elo(score), (score_to_elo(score + 1.96 * deviation) -
+                                     score_to_elo(score - 1.96 * deviation)) / 2
+
+    def los(self):
+        '''
+        Likelihood of superiority: chance the first engine is really the stronger one
+        '''
+        decisive = self.wins + self.losses
+        if not decisive:
+            return 0.5
+        return 0.5 * (1.0 + math.erf((self.wins - self.losses) / math.sqrt(2.0 * decisive)))
+
+    def summary(self):
+        elo, margin = self.elo()
+        lines = ["%s vs %s: %d games, +%d =%d -%d, score %.1f%%" % (
+                     self.first, self.second, self.games, self.wins, self.draws, self.losses,
+                     100.0 * (self.wins + self.draws / 2) / max(1, self.games)),
+                 "Elo %+.1f +/- %.1f, LOS %.1f%%" % (elo, margin, 100.0 * self.los()),
+                 "SPRT elo0=%g elo1=%g: LLR %.2f (%.2f, %.2f) %s" % (
+                     self.elo0, self.elo1, self.llr(), self.lower, self.upper,
+                     {"H1": "H1 accepted", "H0": "H0 accepted", None: "no decision"}[self.decision])]
+        for name in (self.first, self.second):
+            moves = max(1, self.moves[name])
+            cpu = self.cpu[name]
+            lines.append("%s: %.1f CPU s, %.3f s/move, %.0f nodes/move, %.0f nodes/CPU s" % (
+                name, cpu, cpu / moves, self.nodes[name] / moves, self.nodes[name] / max(cpu, 1e-9)))
+        lines.append("endings: " + ", ".join("%s %d" % item for item in sorted(self.terminations.items())))
+        return "\n".join(lines)
+
+
+def game_pgn(game, event="engine match"):
+    '''
+    PGN text of a finished game dict from play_game
+    '''
+    gs = ChessEngine.GameState.from_fen(game["fen"])
+    for text in game["moves"]:
+        gs.make_move(ChessEngine.Move.from_packed(parse_uci_move(gs, text), gs.board))
+    headers = {"Event": event, "Site": "local", "Date": time.strftime("%Y.%m.%d"), "Round": game["round"],
+               "White": game["white"], "Black": game["black"], "Termination": game["termination"]}
+    return ChessPgn.game_to_pgn(gs, headers, game["result"])
+
+
+def schedule(openings, first, second, rounds, limits):
+    '''
+    Jobs for play_game: every opening played twice with the colours swapped, rounds times over
+    '''
+    number = 0
+    for _ in range(rounds):
+        for fen in openings:
+            for white, black in ((first, second), (second, first)):
+                number += 1
+                yield number, fen, white, black, limits
+
+
+def run_match(first, second, openings=DEFAULT_OPENINGS, rounds=1, limits=None, concurrency=None, pgn=None,
+              elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05, sprt=True, log=print):
+    '''
+    Plays the match, returns its MatchStats; stops early once the SPRT decides (unless sprt is False)
+    concurrency is the number of games at once (default one per core, 0 plays them one by one in this process),
+    pgn an open text file every game is written to as it finishes
+    '''
+    limits = dict(limits or {"movetime": 0.1})
+    if first["name"] == second["name"]:
+        second = dict(second, name=second["name"] + "-2")
+    stats = MatchStats(first["name"], second["name"], elo0, elo1, alpha, beta)
+    jobs = schedule(openings, first, second, rounds, limits)
+
+    def finished(game):
+        stats.add(game)
+        if pgn is not None:
+            pgn.write(game_pgn(game) + "\n")
+            pgn.flush()
+        if log:
+            log("game %d %s-%s %s (%s)  +%d =%d -%d  LLR %.2f" % (
+                game["round"], game["white"], game["black"], game["result"], game["termination"],
+                stats.wins, stats.draws, stats.losses, stats.llr()))
+        return sprt and stats.decision is not None
+
+    concurrency = (os.cpu_count() or 1) if concurrency is None else concurrency
+    if concurrency == 0:
+        for job in jobs:
+            if finished(play_game(job)):
+                break
+        return stats
+    with concurrent.futures.ProcessPoolExecutor(concurrency) as pool:
+        pending = {pool.submit(play_game, job) for job in [job for _, job in zip(range(concurrency), jobs)]}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            stop = False
+            for future in done:
+                stop = finished(future.result()) or stop
+            if stop:  # games already running still finish and count, nothing new is started
+                jobs = iter(())
+            for job in [job for _, job in zip(range(len(done)), jobs)]:
+                pending.add(pool.submit(play_game, job))
+    return stats
+
+
+def load_openings(path, shuffle_seed=None):
+    '''
+    Opening FENs from an EPD/FEN file, shuffled when a seed is given
+    '''
+    openings = [fen for fen, _ in read_epd(path)]
+    if shuffle_seed is not None:
+        random.Random(shuffle_seed).shuffle(openings)
+    return openings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="engine against engine match with SPRT")
+    parser.add_argument("--engine", nargs="+", action="append", required=True, metavar="KEY=VALUE",
+                        help="an engine: name=..., cmd=... (UCI command, leave out for the built in search), "
+                             "movetime=, depth=, nodes=, hash=, option.NAME=VALUE; give it twice")
+    parser.add_argument("--openings", default=None, help="FEN/EPD file of opening positions")
+    parser.add_argument("--seed", type=int, default=None, help="shuffle the openings with this seed")
+    parser.add_argument("--rounds", type=int, default=1, help="times through the openings (default 1)")
+    parser.add_argument("--movetime", type=float, default=0.1, help="seconds per move (default 0.1)")
+    parser.add_argument("--depth", type=int, default=None, help="depth limit per move")
+    parser.add_argument("--nodes", type=int, default=None, help="node limit per move")
+    parser.add_argument("--max-plies", type=int, default=400, help="adjudicate a draw after this many plies")
+    parser.add_argument("--concurrency", type=int, default=None, help="games at once (default one per core)")
+    parser.add_argument("--pgn", default=None, help="write the games to this PGN file")
+    parser.add_argument("--elo0", type=float, default=0.0)
+    parser.add_argument("--elo1", type=float, default=5.0)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--no-sprt", action="store_true", help="play every game even once the SPRT decides")
+    args = parser.parse_args(argv)
+
+    if len(args.engine) != 2:
+        parser.error("give --engine exactly twice")
+    try:
+        first, second = (parse_engine(words) for words in args.engine)
+    except ValueError as error:
+        parser.error(str(error))
+    openings = load_openings(args.openings, args.seed) if args.openings else list(DEFAULT_OPENINGS)
+    limits = {"movetime": args.movetime, "depth": args.depth, "nodes": args.nodes, "max_plies": args.max_plies}
+    if args.depth is not None or args.nodes is not None:
+        limits["movetime"] = None  # a fixed depth or node count alone makes games reproducible
+    pgn = open(args.pgn, "w") if args.pgn else None
+    try:
+        stats = run_match(first, second, openings, args.rounds, limits, args.concurrency, pgn, args.elo0, args.elo1,
+                          args.alpha, args.beta, not args.no_sprt)
+    finally:
+        if pgn is not None:
+            pgn.close()
+    print(stats.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
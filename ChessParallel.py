@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+lazy SMP: the same position searched by several worker processes at once, all storing into one shared
+transposition table, so each worker finds the others' results and skips ahead
+workers start at staggered depths so they don't all walk the same tree in step; the deepest finished iteration
+(the main worker's on ties) is the answer
+"""
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import queue
+import sys
+import time
+
+import ChessEngine
+from ChessSearch import MAX_PLY, Search, SearchResult, line_to_moves
+from ChessTablebase import Tablebases
+from ChessTransposition import SharedTranspositionTable
+
+BENCH_FENS = (
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+)
+
+
+class _WorkerSearch(Search):
+    '''
+    Search inside a worker process: also stops on the shared stop event and honours the shared deadline
+    '''
+    def __init__(self, tt, stop_event, deadline, tablebases):
+        super().__init__(tt, tablebases=tablebases)
+        self.stop_event = stop_event
+        self.shared_deadline = deadline  # multiprocessing.Value, 0 for none, moved by ponderhit
+
+    def check_limits(self):
+        deadline = self.shared_deadline.value
+        self.deadline = deadline or None
+        super().check_limits()
+        if self.stop_event.is_set():
+            self.stopped = True
+
+
+_worker = None  # the worker process's search, set up by _start_worker
+
+
+def _start_worker(tt_mb, tt_name, stop_event, deadline, info_queue, tablebase_dir):
+    global _worker
+    tt = SharedTranspositionTable(tt_mb, tt_name)
+    _worker = _WorkerSearch(tt, stop_event, deadline, Tablebases(tablebase_dir) if tablebase_dir else None)
+    _worker.info_queue = info_queue
+
+
+def _ready(index):
+    return index
+
+
+def _run_worker(search_id, index, fen, position_counts, max_depth, max_nodes):
+    '''
+    Worker side of one search, returns (index, depth, score, packed pv, nodes)
+    the main worker (index 0) sends each finished iteration back through the info queue
+    '''
+    gs = ChessEngine.GameState.from_fen(fen)
+    gs.position_counts = position_counts
+    info = None
+    if index == 0:
+        def info(result):
+            _worker.info_queue.put((search_id, result.depth, result.score, [move.packed for move in result.pv],
+                                    _worker.nodes))
+    # odd helpers start one ply deeper than the main worker, so half the workers are always ahead
+    result = _worker.search(gs, max_depth, None, max_nodes, info, 1 + index % 2)
+    _worker.stopped = False
+    return index, result.depth, result.score, [move.packed for move in result.pv], result.nodes
+
+
+class ParallelSearch:
+    '''
+    Lazy SMP search over a pool of worker processes, used like ChessSearch.Search
+    workers stay up between searches, call close() (or use it as a context manager) to stop them
+    '''
+    def __init__(self, workers=None, tt_mb=64, tablebases=None, book=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.tt = SharedTranspositionTable(tt_mb)
+        self.tablebases = tablebases
+        self.book = book  # ChessBook.OpeningBook, used here in the parent like Search does
+        self.stop_event = multiprocessing.Event()
+        self._deadline = multiprocessing.Value("d", 0.0, lock=False)
+        self.info_queue = multiprocessing.Queue()
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers, initializer=_start_worker,
+            initargs=(tt_mb, self.tt.name, self.stop_event, self._deadline, self.info_queue,
+                      tablebases.directory if tablebases is not None else None))
+        # start every worker now: a worker forked later from a search thread, while another thread is blocked
+        # reading stdin (the UCI loop), deadlocks on the stdin lock as it starts
+        list(self.pool.map(_ready, range(self.workers)))
+        self.search_id = 0  # tags info messages, one from an earlier search can still be in the queue
+        self.nodes = 0
+        self.stopped = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def deadline(self):
+        return self._deadline.value or None
+
+    @deadline.setter
+    def deadline(self, deadline):
+        self._deadline.value = deadline or 0.0  # a perf_counter time, shared with the workers
+
+    def stop(self):
+        '''
+        Asks a running search to return as soon as possible (safe to call from another thread)
+        '''
+        self.stopped = True
+        self.stop_event.set()
+
+    def clear(self):
+        '''
+        Empties the shared table (for a new game)
+        '''
+        self.tt.clear()
+
+    def search(self, gs, max_depth=MAX_PLY, movetime=None, max_nodes=None, info=None):
+        '''
+        Searches gs on every worker, returns a SearchResult like Search.search (nodes are all workers' together)
+        max_nodes is shared out between the workers
+        '''
+        start = time.perf_counter()
+        self.stopped = False
+        self.stop_event.clear()
+        self.deadline = start + movetime if movetime is not None else None
+        self.tt.new_search()  # keeps this process's age in step with the workers', for hashfull
+        root_moves = gs.get_valid_moves()
+        result = SearchResult(root_moves[0] if root_moves else None, 0, root_moves[:1], 0, 0, 0.0)
+        if len(root_moves) <= 1:
+            return result
+        if self.book is not None:
+            m = self.book.choose(gs)
+            if m is not None:
+                move = ChessEngine.Move.from_packed(m, gs.board)
+                return SearchResult(move, 0, [move], 0, 0, time.perf_counter() - start)
+        fen = gs.to_fen()
+        self.search_id += 1
+        worker_nodes = max_nodes // self.workers if max_nodes is not None else None
+        futures = [self.pool.submit(_run_worker, self.search_id, index, fen, gs.position_counts, max_depth, worker_nodes)
+                   for index in range(self.workers)]
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, 0.02, concurrent.futures.FIRST_COMPLETED)
+            self.drain_info(gs, info, start)
+            if done:  # the first worker to finish ends the search for everyone
+                self.stop_event.set()
+        self.drain_info(gs, info, start)
+        answers = [future.result() for future in futures]
+        self.nodes = sum(answer[4] for answer in answers)
+        _, depth, score, pv, _ = max(answers, key=lambda answer: (answer[1], -answer[0]))
+        elapsed = time.perf_counter() - start
+        line = line_to_moves(gs, pv) if pv else result.pv
+        return SearchResult(line[0] if line else result.best_move, score, line, depth, self.nodes, elapsed)
+
+    def drain_info(self, gs, info, start):
+        '''
+        Passes the main worker's finished iterations to info as SearchResults
+        '''
+        while True:
+            try:
+                search_id, depth, score, pv, nodes = self.info_queue.get_nowait()
+            except queue.Empty:
+                return
+            if info is not None and pv and search_id == self.search_id:
+                line = line_to_moves(gs, pv)
+                info(SearchResult(line[0], score, line, depth, nodes * self.workers, time.perf_counter() - start))
+
+    def close(self):
+        '''
+        Stops the workers and frees the shared table
+        '''
+        if self.pool is not None:
+            self.stop()
+            self.pool.shutdown()
+            self.pool = None
+            self.tt.close()
+
+
+def bench(worker_counts, movetime=5.0, tt_mb=64, fens=BENCH_FENS, log=print):
+    '''
+    Searches every bench position for movetime seconds with each worker count, reports nodes/s and the speedup
+    over the first count (each count gets fresh workers and an empty table)
+    '''
+    rows = []
+    base = None
+    for workers in worker_counts:
+        nodes = 0
+        elapsed = 0.0
+        depths = []
+        with ParallelSearch(workers, tt_mb) as searcher:
+            searcher.search(ChessEngine.GameState(), 1)  # start the worker processes outside the timing
+            for fen in fens:
+                searcher.clear()
+                result = searcher.search(ChessEngine.GameState.from_fen(fen), movetime=movetime)
+                nodes += result.nodes
+                elapsed += result.elapsed
+                depths.append(result.depth)
+        nps = nodes / max(elapsed, 1e-9)
+        base = base or nps
+        rows.append((workers, nps, nps / base, depths))
+        if log:
+            log("workers %2d  nps %9.0f  speedup %5.2f  depths %s" % (workers, nps, nps / base,
+                                                                      " ".join(map(str, depths))))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="lazy SMP search")
+    parser.add_argument("fen", nargs="?", default=None, help="position to search (default the start position)")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="worker processes, several counts with --bench (default one per core)")
+    parser.add_argument("--movetime", type=float, default=5.0, help="seconds per search (default 5)")
+    parser.add_argument("--depth", type=int, default=MAX_PLY)
+    parser.add_argument("--hash", type=int, default=64, help="shared table size in MB (default 64)")
+    parser.add_argument("--bench", action="store_true", help="report nodes/s scaling over the worker counts")
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        counts = args.workers or sorted({1, 2, 4, 8, os.cpu_count() or 1})
+        bench(counts, args.movetime, args.hash)
+        return 0
+    gs = ChessEngine.GameState.from_fen(args.fen) if args.fen else ChessEngine.GameState()
+    with ParallelSearch(args.workers[0] if args.workers else None, args.hash) as searcher:
+        print(searcher.search(gs, args.depth, args.movetime, info=print))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+perft: counts the leaf nodes of the move tree to check and time the move generator
+run as a script for node counts, nodes per second, divide breakdowns and the reference suite
+"""
+
+import argparse
+import sys
+import time
+
+import ChessEngine
+from ChessFen import START_FEN
+
+# reference positions and their known node counts for depth 1, 2, 3, ...
+SUITE = [
+    ("start", START_FEN,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position 4 mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+
+def perft(gs, depth, buffers=None):
+    '''
+    Number of leaf nodes depth plies below the current position
+    '''
+    if buffers is None:
+        buffers = [[] for _ in range(depth + 1)]  # one reusable move list per ply
+    moves = gs.generate_valid_moves(buffers[depth])
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1  # bulk count the last ply instead of making every move
+    nodes = 0
+    for m in moves:
+        gs.make_packed(m)
+        nodes += perft(gs, depth - 1, buffers)
+        gs.undo_packed()
+    return nodes
+
+
+def divide(gs, depth):
+    '''
+    Perft split by root move, returns a dict of move notation -> leaf nodes below that move
+    '''
+    counts = {}
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        counts[move.get_chess_notation()] = perft(gs, depth - 1)
+        gs.undo_move()
+    return counts
+
+
+def timed_perft(gs, depth):
+    '''
+    Returns (nodes, seconds, nodes per second) for a perft of the given depth
+    '''
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0
+
+
+def run_suite(max_nodes=200000, out=sys.stdout):
+    '''
+    Runs every reference position to the deepest depth whose node count fits in max_nodes
+    prints one line per position and returns True if every count matched
+    '''
+    all_passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in SUITE:
+        depth = 1
+        while depth < len(expected) and expected[depth] <= max_nodes:
+            depth += 1
+        nodes, elapsed, nps = timed_perft(ChessEngine.GameState.from_fen(fen), depth)
+        passed = nodes == expected[depth - 1]
+        all_passed = all_passed and passed
+        total_nodes += nodes
+        total_time += elapsed
+        print("%-20s depth %d  nodes %10d  expected %10d  %8.0f nps  %s"
+              % (name, depth, nodes, expected[depth - 1], nps, "ok" if passed else "FAIL"), file=out)
+    print("total nodes %d in %.2fs (%.0f nps)" % (total_nodes, total_time, total_nodes / max(total_time, 1e-9)),
+          file=out)
+    return all_passed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft node counts for the move generator")
+    parser.add_argument("depth", type=int, nargs="?", default=3, help="plies to search (default 3)")
+    parser.add_argument("--fen", default=START_FEN, help="position to search (default start position)")
+    parser.add_argument("--divide", action="store_true", help="print node counts per root move")
+    parser.add_argument("--suite", action="store_true", help="check node counts against the reference positions")
+    parser.add_argument("--max-nodes", type=int, default=200000, help="node budget per suite position")
+    parser.add_argument("--trace", action="store_true", help="print move generation call counts and timings")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.max_nodes) else 1
+    gs = ChessEngine.GameState.from_fen(args.fen)
+    tracer = gs.enable_tracing() if args.trace else None
+    if args.divide:
+        start = time.perf_counter()
+        counts = divide(gs, args.depth)
+        elapsed = time.perf_counter() - start
+        for notation in sorted(counts):
+            print("%s: %d" % (notation, counts[notation]))
+        nodes = sum(counts.values())
+    else:
+        nodes, elapsed, _ = timed_perft(gs, args.depth)
+    print("nodes %d  time %.3fs  nps %.0f" % (nodes, elapsed, nodes / elapsed if elapsed > 0 else 0.0))
+    if tracer is not None:
+        print(tracer.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+PGN: reading games one at a time from files of any size and writing GameState.move_log back out
+moves are read and written in SAN through GameState.parse_san/move_to_san
+"""
+
+import argparse
+import re
+import sys
+import time
+
+import ChessEngine
+from ChessFen import START_FEN
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+# a movetext token: result, comment start, rest of line comment, variation brackets, NAG, move number or a move
+_TOKEN = re.compile(r'1-0|0-1|1/2-1/2|\*|\{|;.*|\(|\)|\$\d+|\d+\.+|[^\s{}();$]+')
+
+
+class PgnGame:
+    '''
+    One game read from a PGN file: tag pairs, SAN moves and result
+    gs is the GameState after replaying the moves (None when not replayed), error says why replaying stopped early
+    '''
+    def __init__(self, headers, sans, result, gs=None, error=None):
+        self.headers = headers
+        self.sans = sans
+        self.result = result
+        self.gs = gs
+        self.error = error
+
+    def __repr__(self):
+        return "PgnGame(%s vs %s, %d moves, %s)" % (self.headers.get("White", "?"), self.headers.get("Black", "?"),
+                                                     len(self.sans), self.result)
+
+
+def replay(headers, sans):
+    '''
+    Plays SAN moves through make_move from the start position (or the game's FEN tag), returns (gs, error)
+    '''
+    gs = ChessEngine.GameState.from_fen(headers["FEN"]) if "FEN" in headers else ChessEngine.GameState()
+    for number, san in enumerate(sans):
+        try:
+            m = gs.parse_san(san)
+        except ValueError as error:
+            return gs, "ply %d: %s" % (number + 1, error)
+        gs.make_move(ChessEngine.Move.from_packed(m, gs.board))
+    return gs, None
+
+
+def read_games(source, replay_moves=True):
+    '''
+    Yields a PgnGame for every game in a PGN file, reading one line at a time so memory stays flat
+    source is a path or an open text file, variations, comments and NAGs are skipped
+    a game whose moves don't replay is still yielded, with error set, so one bad game doesn't stop the stream
+    '''
+    if isinstance(source, str):
+        with open(source, encoding="utf-8", errors="replace") as file:
+            yield from read_games(file, replay_moves)
+        return
+    headers = {}
+    sans = []
+    in_comment = False
+    depth = 0  # variation nesting
+    for line in source:
+        if in_comment:  # inside a {} comment that started on an earlier line
+            close = line.find("}")
+            if close < 0:
+                continue
+            line = line[close + 1:]
+            in_comment = False
+        if line.startswith("["):
+            if sans:  # tags straight after movetext with no result: the last game was cut short
+                yield _finish(headers, sans, "*", replay_moves)
+                headers, sans, depth = {}, [], 0
+            match = _TAG.match(line)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+            continue
+        if line.startswith("%"):  # escape mechanism, the line is for some other program
+            continue
+        position = 0
+        while True:
+            match = _TOKEN.search(line, position)
+            if match is None:
+                break
+            token = match.group()
+            position = match.end()
+            if token == "{":
+                close = line.find("}", position)
+                if close < 0:
+                    in_comment = True
+                    break
+                position = close + 1
+            elif token == "(":
+                depth += 1
+            elif token == ")":
+                depth = max(depth - 1, 0)
+            elif depth or token[0] in ";$" or token[0].isdigit() and token[-1] == ".":
+                continue  # variations, comments, NAGs and move numbers
+            elif token in RESULTS:
+                yield _finish(headers, sans, token, replay_moves)
+                headers, sans, depth = {}, [], 0
+            else:
+                sans.append(token)
+    if headers or sans:
+        yield _finish(headers, sans, headers.get("Result", "*"), replay_moves)
+
+
+def _finish(headers, sans, result, replay_moves):
+    if not replay_moves:
+        return PgnGame(headers, sans, result)
+    gs, error = replay(headers, sans)
+    return PgnGame(headers, sans, result, gs, error)
+
+
+def game_result(gs):
+    '''
+    "1-0", "0-1" or "1/2-1/2" when the game is over on the board, "*" otherwise
+    '''
+    if gs.has_legal_move():
+        return "*"
+    if not gs.in_check:
+        return "1/2-1/2"
+    return "0-1" if gs.white_to_move else "1-0"
+
+
+def game_sans(gs):
+    '''
+    SAN of every move in gs.move_log, works out the positions by taking the moves back and replaying them
+    '''
+    moves = list(gs.move_log)
+    for _ in moves:
+        gs.undo_move()
+    start_fen = gs.to_fen()
+    sans = []
+    for move in moves:
+        sans.append(gs.move_to_san(move.packed))
+        gs.make_move(move)
+    return start_fen, sans
+
+
+def game_to_pgn(gs, headers=None, result=None):
+    '''
+    PGN text of the game in gs.move_log, the seven tag roster is filled with "?" where headers don't say
+    '''
+    start_fen, sans = game_sans(gs)
+    if result is None:
+        result = game_result(gs)
+    tags = {tag: "?" for tag in SEVEN_TAG_ROSTER}
+    tags.update(headers or {})
+    tags["Result"] = result
+    if start_fen != START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_fen
+    lines = ['[%s "%s"]' % (tag, str(value).replace("\\", "\\\\").replace('"', '\\"')) for tag, value in tags.items()]
+    lines.append("")
+    fields = start_fen.split()
+    number = int(fields[5])
+    white = fields[1] == "w"
+    tokens = []
+    for i, san in enumerate(sans):
+        if white:
+            tokens.append("%d." % number)
+        elif i == 0:
+            tokens.append("%d..." % number)
+        tokens.append(san)
+        if not white:
+            number += 1
+        white = not white
+    tokens.append(result)
+    line = ""
+    for token in tokens:  # export format keeps lines under 80 characters
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def write_game(file, gs, headers=None, result=None):
+    '''
+    Writes the game in gs.move_log to an open text file as PGN, followed by a blank line
+    '''
+    file.write(game_to_pgn(gs, headers, result) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="read a PGN file, replaying every game")
+    parser.add_argument("file", help="PGN file, - for stdin")
+    parser.add_argument("--no-replay", action="store_true", help="only split the file into games")
+    parser.add_argument("--errors", action="store_true", help="print games that don't replay")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    games = plies = errors = 0
+    source = sys.stdin if args.file == "-" else args.file
+    for game in read_games(source, not args.no_replay):
+        games += 1
+        plies += len(game.sans)
+        if game.error:
+            errors += 1
+            if args.errors:
+                print("game %d (%s): %s" % (games, game, game.error))
+    elapsed = time.perf_counter() - start
+    print("games %d  plies %d  errors %d  time %.2fs  %.0f games/s  %.0f plies/s"
+          % (games, plies, errors, elapsed, games / max(elapsed, 1e-9), plies / max(elapsed, 1e-9)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
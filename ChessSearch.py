@@ -0,0 +1,309 @@
+"""
+engine search: negamax alpha-beta with iterative deepening, quiescence search, a transposition table and
+MVV-LVA / killer / history move ordering, all on top of GameState.staged_moves/make_packed/undo_packed
+moves are packed ints inside the search, Move objects are only built for the result
+"""
+
+import time
+
+from ChessBitboard import RANK_MASKS
+from ChessEngine import Move, PROMOTION_MASK, PROMOTION_PIECES, EN_PASSANT_FLAG
+from ChessEval import DEFAULT_EVALUATOR
+from ChessTransposition import TranspositionTable, EXACT, LOWER, UPPER
+
+PIECE_VALUES = {"P": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}  # for move ordering
+MATE = 100000  # score for mating at the root, mate in n plies scores MATE - n
+MATE_BOUND = MATE - 1000  # anything above this is a mate score
+INFINITY = MATE + 1
+MAX_PLY = 64  # hard limit on search depth including quiescence
+HISTORY_SIDE = 1 << 17  # added to a packed move to keep black's history apart from white's
+
+
+def line_to_moves(gs, line):
+    '''
+    Turns a list of packed moves played from the current position into Move objects
+    '''
+    moves = []
+    for m in line:
+        moves.append(Move.from_packed(m, gs.board))
+        gs.make_packed(m)
+    for _ in line:
+        gs.undo_packed()
+    return moves
+
+
+def score_to_tt(score, ply):
+    '''
+    Mate scores are stored as distance from the stored position, not from the root
+    '''
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def score_from_tt(score, ply):
+    '''
+    Undoes score_to_tt for a position found at the given ply
+    '''
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+class SearchResult:
+    '''
+    What a search found: best move, score (centipawns for the side to move), principal variation and stats
+    '''
+    def __init__(self, best_move, score, pv, depth, nodes, elapsed):
+        self.best_move = best_move
+        self.score = score
+        self.pv = pv
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.nps = int(nodes / elapsed) if elapsed > 0 else 0
+
+    def __repr__(self):
+        return "SearchResult(best_move=%s, score=%d, depth=%d, nodes=%d, nps=%d, pv=%s)" % (
+            self.best_move, self.score, self.depth, self.nodes, self.nps, " ".join(map(str, self.pv)))
+
+
+class Search:
+    '''
+    Searches GameStates for the best move, keeping its transposition table and history between searches
+    '''
+    def __init__(self, tt=None, tt_mb=16, evaluator=None, tablebases=None, book=None):
+        self.tt = tt if tt is not None else TranspositionTable(tt_mb)
+        self.evaluate = (evaluator or DEFAULT_EVALUATOR).evaluate  # ChessEval.Evaluator scoring the leaves
+        self.tablebases = tablebases  # ChessTablebase.Tablebases giving exact scores once few pieces are left
+        self.book = book  # ChessBook.OpeningBook, a book move is played without searching
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]  # two quiet packed moves per ply that caused cutoffs
+        self.history = {}  # packed move (+ side bit) -> how often that quiet move caused a cutoff, depth weighted
+        self.buffers = [[] for _ in range(MAX_PLY + 1)]  # move list reused at each ply, so no list per node
+        self.nodes = 0
+        self.stopped = False  # set by stop() or when the time/node budget runs out
+        self.deadline = None
+        self.max_nodes = None
+        self.start_time = 0.0
+
+    def stop(self):
+        '''
+        Asks a running search to return as soon as possible (safe to call from another thread)
+        '''
+        self.stopped = True
+
+    def clear(self):
+        '''
+        Forgets everything learned in earlier searches (for a new game)
+        '''
+        self.tt.clear()
+        self.history.clear()
+
+    def search(self, gs, max_depth=MAX_PLY, movetime=None, max_nodes=None, info=None, first_depth=1):
+        '''
+        Iterative deepening search of gs, returns a SearchResult for the deepest completed iteration
+        movetime is in seconds, info is called with each completed iteration's SearchResult
+        first_depth > 1 skips the shallow iterations (helpers in a parallel search start deeper)
+        '''
+        self.start_time = time.perf_counter()
+        self.deadline = self.start_time + movetime if movetime is not None else None
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.stopped = False
+        self.killers = [[0, 0] for _ in range(MAX_PLY + 1)]
+        self.tt.new_search()
+        root_moves = gs.get_valid_moves()
+        result = SearchResult(root_moves[0] if root_moves else None, 0, root_moves[:1], 0, 0, 0.0)
+        if len(root_moves) <= 1:  # nothing to think about
+            return result
+        if self.book is not None:
+            m = self.book.choose(gs)
+            if m is not None:
+                move = Move.from_packed(m, gs.board)
+                return SearchResult(move, 0, [move], 0, 0, time.perf_counter() - self.start_time)
+        for depth in range(min(first_depth, max_depth), min(max_depth, MAX_PLY) + 1):
+            pv = []
+            score = self.negamax(gs, depth, -INFINITY, INFINITY, 0, pv)
+            if self.stopped and result.depth:  # partial iteration, keep the last complete one
+                break
+            elapsed = time.perf_counter() - self.start_time
+            line = line_to_moves(gs, pv)
+            result = SearchResult(line[0] if line else result.best_move, score, line, depth, self.nodes, elapsed)
+            if info is not None:
+                info(result)
+            if self.stopped or abs(score) > MATE_BOUND:  # out of budget or found a forced mate
+                break
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - self.start_time
+        result.nps = int(result.nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+    def check_limits(self):
+        '''
+        Stops the search when the time or node budget is used up
+        '''
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            self.stopped = True
+        if self.max_nodes is not None and self.nodes >= self.max_nodes:
+            self.stopped = True
+
+    def order_moves(self, gs, moves, tt_move, ply):
+        '''
+        Sorts packed moves best first: hash move, captures by MVV-LVA, promotions, killers, then history
+        '''
+        killers = self.killers[ply]
+        history = self.history
+        side = 0 if gs.white_to_move else HISTORY_SIDE
+        board = gs.board
+
+        def move_score(m):
+            if m & 0x7FFF == tt_move:
+                return 1000000
+            end = m >> 6 & 63
+            victim = board[end >> 3][end & 7]
+            if victim != "--":
+                start = m & 63
+                return 100000 + 10 * PIECE_VALUES[victim[1]] - PIECE_VALUES[board[start >> 3][start & 7][1]]
+            if m >> 15 == EN_PASSANT_FLAG:
+                return 100900  # pawn takes pawn
+            if m & PROMOTION_MASK:
+                return 90000 + PIECE_VALUES[PROMOTION_PIECES[m >> 12 & 7]]
+            if m == killers[0]:
+                return 80000
+            if m == killers[1]:
+                return 79000
+            return history.get(m | side, 0)
+
+        moves.sort(key=move_score, reverse=True)
+
+    def negamax(self, gs, depth, alpha, beta, ply, pv):
+        '''
+        Alpha-beta search, returns the score for the side to move and fills pv with the best line
+        '''
+        if self.stopped:
+            return 0
+        if ply > 0 and gs.repetition_count() > 1:  # a repeated position is as good as a draw
+            return 0
+        tablebases = self.tablebases
+        if ply > 0 and tablebases is not None and \
+                (gs.occupancy["w"] | gs.occupancy["b"]).bit_count() <= tablebases.max_pieces:
+            value = tablebases.probe(gs)
+            if value is not None:  # exact, mate in value plies or mated in -value - 1
+                return MATE - ply - value if value > 0 else -MATE + ply - value - 1 if value < 0 else 0
+        key = gs.zobrist_key
+        tt_move = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_score, tt_depth, bound, tt_move = entry
+            if ply > 0 and tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if bound == EXACT or (bound == LOWER and tt_score >= beta) or (bound == UPPER and tt_score <= alpha):
+                    return tt_score
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+        # just the attackers of the king here, pins and attack maps are only worked out if moves get generated
+        king_row, king_col = gs.white_king_pos if gs.white_to_move else gs.black_king_pos
+        in_check = gs.attackers_to(king_row * 8 + king_col, "b" if gs.white_to_move else "w") != 0
+        if in_check and ply < MAX_PLY // 2:  # don't stop searching in the middle of a check
+            depth += 1
+        if depth <= 0:  # quiescence counts this node itself
+            return self.quiescence(gs, alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        history = self.history
+        side = 0 if gs.white_to_move else HISTORY_SIDE
+        # moves come hash move first, then captures, promotions, killers and quiets by history, generated as needed
+        moves = gs.staged_moves(tt_move, self.killers[ply], lambda m: history.get(m | side, 0))
+        board = gs.board
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        child_pv = []
+        for m in moves:
+            end = m >> 6 & 63
+            # no capture, promotion or en passant
+            quiet = board[end >> 3][end & 7] == "--" and not m & PROMOTION_MASK and m >> 15 != EN_PASSANT_FLAG
+            gs.make_packed(m)
+            child_pv.clear()
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1, child_pv)
+            gs.undo_packed()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                best_move = m
+                if score > alpha:
+                    alpha = score
+                    pv[:] = [m] + child_pv
+                    if alpha >= beta:
+                        if quiet:  # quiet move cutoff
+                            killers = self.killers[ply]
+                            if killers[0] != m:
+                                killers[1] = killers[0]
+                                killers[0] = m
+                            history[m | side] = history.get(m | side, 0) + depth * depth
+                        break
+        if best_move == 0:  # no legal moves
+            return -MATE + ply if in_check else 0  # checkmate or stalemate
+        if best_score >= beta:
+            bound = LOWER
+        elif best_score > original_alpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+        self.tt.store(key, depth, score_to_tt(best_score, ply), bound, best_move & 0x7FFF)
+        return best_score
+
+    def quiescence(self, gs, alpha, beta, ply):
+        '''
+        Searches captures (and queen promotions, or every evasion when in check) until the position is quiet
+        '''
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.check_limits()
+        if self.stopped:
+            return 0
+        if ply >= MAX_PLY:
+            return self.evaluate(gs)
+        if not gs.has_legal_move():  # stops at the first legal move, and leaves gs ready for add_stage_moves
+            return -MATE + ply if gs.in_check else 0
+        moves = self.buffers[ply]
+        moves.clear()
+        if gs.in_check:
+            gs.add_stage_moves(moves)  # every evasion
+        else:
+            stand_pat = self.evaluate(gs)  # the side to move can usually do at least as well as doing nothing
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            # only generate captures (en passant included) and queen promotions
+            occupied = gs.occupancy["w"] | gs.occupancy["b"]
+            gs.add_stage_moves(moves, gs.occupancy["b" if gs.white_to_move else "w"])
+            captures = len(moves)
+            gs.add_stage_moves(moves, RANK_MASKS[0 if gs.white_to_move else 7] & ~occupied)
+            moves[captures:] = [m for m in moves[captures:] if m >> 12 & 7 == 1]
+        self.order_moves(gs, moves, 0, ply)
+        for m in moves:
+            gs.make_packed(m)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undo_packed()
+            if self.stopped:
+                return 0
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+def find_best_move(gs, max_depth=MAX_PLY, movetime=None, max_nodes=None):
+    '''
+    One off search with a fresh table, returns the best Move (or None if there are no legal moves)
+    '''
+    return Search().search(gs, max_depth, movetime, max_nodes).best_move
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+game server: many GameStates hosted at once behind one asyncio event loop
+clients send one JSON object per line over TCP or a unix socket (or call GameServer.request in process)
+moves are checked and played in the loop, engine moves are searched on a process pool so the loop never waits
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import sys
+import time
+
+import ChessBatch
+import ChessEngine
+from ChessFen import START_FEN
+from ChessUci import uci_move, parse_uci_move
+
+ENGINE_DEPTH = 3  # search depth when an engine request doesn't give one
+# the most one engine request may ask for, whatever the client sends, so no request can hold a worker for long
+MAX_DEPTH = 8
+MAX_MOVETIME = 2.0  # seconds
+MAX_NODES = 500000
+
+
+class Session:
+    '''
+    One hosted game, moves are played with make_packed so the undo stack is all the history it keeps
+    '''
+    def __init__(self, game_id, fen=START_FEN):
+        self.id = game_id
+        self.start_fen = fen
+        self.gs = ChessEngine.GameState.from_fen(fen)
+        self.gs.compact()
+        self.busy = False  # an engine move is being searched, other moves have to wait
+
+    def status(self):
+        '''
+        "playing", "checkmate", "stalemate" or "draw" (fifty moves or threefold repetition)
+        '''
+        gs = self.gs
+        if not gs.has_legal_move():
+            return "checkmate" if gs.in_check else "stalemate"
+        if gs.halfmove_clock >= 100 or gs.repetition_count() >= 3:
+            return "draw"
+        return "playing"
+
+    def state(self):
+        return {"ok": True, "game": self.id, "fen": self.gs.to_fen(), "status": self.status()}
+
+
+class GameServer:
+    '''
+    Sessions by id and the request handlers, workers is the engine pool size (0 searches on a thread instead)
+    max_depth, max_movetime and max_nodes cap every engine search
+    '''
+    def __init__(self, workers=None, max_games=100000, max_depth=MAX_DEPTH, max_movetime=MAX_MOVETIME,
+                 max_nodes=MAX_NODES):
+        self.sessions = {}
+        self.next_id = 1
+        self.max_games = max_games
+        self.max_depth = max_depth
+        self.max_movetime = max_movetime
+        self.max_nodes = max_nodes
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.pool = None  # started with the first engine request
+        self.handlers = {"new": self.new_game, "move": self.move, "moves": self.moves, "undo": self.undo,
+                         "state": self.state, "engine": self.engine, "close": self.close_game, "stats": self.stats}
+
+    async def request(self, message):
+        '''
+        Answers one request dict with a response dict, errors come back as {"ok": false, "error": ...}
+        '''
+        if not isinstance(message, dict):
+            return {"ok": False, "error": "request must be a JSON object"}
+        try:
+            handler = self.handlers[message["op"]]
+            response = handler(message)
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+        except KeyError as error:
+            return {"ok": False, "error": "missing or unknown %s" % error}
+        except (ValueError, TypeError) as error:  # TypeError: a field of the wrong type, e.g. an unhashable game
+            return {"ok": False, "error": str(error)}
+
+    def session(self, message):
+        session = self.sessions.get(message["game"])
+        if session is None:
+            raise ValueError("no game %r" % message["game"])
+        return session
+
+    def new_game(self, message):
+        if len(self.sessions) >= self.max_games:
+            raise ValueError("server full")
+        session = Session(self.next_id, message.get("fen", START_FEN))
+        self.sessions[session.id] = session
+        self.next_id += 1
+        return session.state()
+
+    def move(self, message):
+        session = self.session(message)
+        if session.busy:
+            raise ValueError("engine is moving in game %d" % session.id)
+        session.gs.make_packed(parse_uci_move(session.gs, message["move"]))
+        return session.state()
+
+    def moves(self, message):
+        gs = self.session(message).gs
+        return {"ok": True, "moves": [uci_move(m) for m in gs.generate_valid_moves([])]}
+
+    def undo(self, message):
+        session = self.session(message)
+        if session.busy or session.gs.ply == 0:
+            raise ValueError("nothing to undo in game %d" % session.id)
+        session.gs.undo_packed()
+        return session.state()
+
+    def state(self, message):
+        return self.session(message).state()
+
+    async def engine(self, message):
+        '''
+        Searches the game on the pool and plays the move found, options are depth, movetime and max_nodes
+        each is held to the server's limits, which also apply when the client leaves them out
+        '''
+        session = self.session(message)
+        if session.busy:
+            raise ValueError("engine is already moving in game %d" % session.id)
+        options = {"depth": max(1, min(int(message.get("depth", ENGINE_DEPTH)), self.max_depth)),
+                   "movetime": max(0.0, min(float(message.get("movetime", self.max_movetime)), self.max_movetime)),
+                   "max_nodes": max(1, min(int(message.get("max_nodes", self.max_nodes)), self.max_nodes))}
+        # the worker gets the start position and the moves, so it sees repetitions too
+        item = (session.start_fen, tuple(uci_move(m) for m in session.gs.moves_played()))
+        session.busy = True
+        try:
+            if self.pool is None and self.workers:
+                self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+            loop = asyncio.get_running_loop()
+            (_, result), = await loop.run_in_executor(self.pool, ChessBatch.run_chunk, "search", options,
+                                                      [(0, item)])
+        finally:
+            session.busy = False
+        if session.id not in self.sessions:
+            raise ValueError("game %d was closed" % session.id)
+        if isinstance(result, Exception) or result["best_move"] is None:
+            raise ValueError("no move to play in game %d" % session.id)
+        session.gs.make_packed(parse_uci_move(session.gs, result["best_move"]))
+        response = session.state()
+        response.update(move=result["best_move"], score=result["score"], depth=result["depth"])
+        return response
+
+    def close_game(self, message):
+        self.sessions.pop(message["game"], None)
+        return {"ok": True}
+
+    def stats(self, message):
+        return {"ok": True, "games": len(self.sessions), "plies": sum(s.gs.ply for s in self.sessions.values())}
+
+    async def handle_connection(self, reader, writer):
+        '''
+        One client connection: a JSON request per line in, a JSON response per line out
+        '''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    response = {"ok": False, "error": "bad JSON"}
+                else:
+                    response = await self.request(message)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=7777, path=None):
+        '''
+        Listens on a TCP port, or on a unix socket when path is given, until cancelled
+        '''
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+class LocalClient:
+    '''
+    In process transport: requests go straight to a GameServer, after giving the other clients a turn
+    '''
+    def __init__(self, server):
+        self.server = server
+
+    async def request(self, message):
+        await asyncio.sleep(0)
+        return await self.server.request(message)
+
+    async def close(self):
+        pass
+
+
+class SocketClient:
+    '''
+    JSON lines client for a GameServer listening on a socket
+    '''
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=7777, path=None):
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, message):
+        self.writer.write(json.dumps(message).encode() + b"\n")
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def play_random_game(client, plies, engine_every, rng, latencies):
+    '''
+    Load generator client: plays random legal moves (and every engine_every-th ply an engine move)
+    '''
+    game = (await client.request({"op": "new"}))["game"]
+    played = 0
+    for ply in range(plies):
+        moves = (await client.request({"op": "moves", "game": game}))["moves"]
+        if not moves:
+            break
+        if engine_every and ply % engine_every == engine_every - 1:
+            message = {"op": "engine", "game": game, "depth": 1}
+        else:
+            message = {"op": "move", "game": game, "move": rng.choice(moves)}
+        start = time.perf_counter()
+        response = await client.request(message)
+        latencies.append(time.perf_counter() - start)
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        played += 1
+        if response["status"] != "playing":
+            break
+    await client.request({"op": "close", "game": game})
+    return played
+
+
+async def load_test(games, plies=40, engine_every=0, workers=None, transport="local", seed=1):
+    '''
+    Plays games concurrent random games against a fresh server, returns (moves, seconds, p50, p99 latency)
+    transport is "local" (in process) or "tcp" (one connection per game over localhost)
+    '''
+    server = GameServer(workers)
+    rng = random.Random(seed)
+    latencies = []
+    listener = None
+    try:
+        if transport == "tcp":
+            listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            clients = [await SocketClient.connect(port=port) for _ in range(games)]
+        else:
+            clients = [LocalClient(server) for _ in range(games)]
+        start = time.perf_counter()
+        played = await asyncio.gather(*(play_random_game(client, plies, engine_every, rng, latencies)
+                                        for client in clients))
+        elapsed = time.perf_counter() - start
+        for client in clients:
+            await client.close()
+    finally:
+        if listener is not None:
+            listener.close()
+            await listener.wait_closed()
+        server.close()
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] if latencies else 0.0
+    return sum(played), elapsed, p50, p99
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio game server and its load generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the server")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=7777)
+    serve.add_argument("--unix", default=None, help="listen on this unix socket path instead")
+    serve.add_argument("--workers", type=int, default=None, help="engine processes (default one per core)")
+    serve.add_argument("--max-depth", type=int, default=MAX_DEPTH, help="deepest engine search (default %(default)s)")
+    serve.add_argument("--max-movetime", type=float, default=MAX_MOVETIME,
+                       help="longest engine search in seconds (default %(default)s)")
+    serve.add_argument("--max-nodes", type=int, default=MAX_NODES,
+                       help="most nodes an engine search may visit (default %(default)s)")
+    bench = commands.add_parser("bench", help="measure moves/s and latency as concurrent games grow")
+    bench.add_argument("--games", type=int, nargs="+", default=[1, 10, 100, 1000])
+    bench.add_argument("--plies", type=int, default=40, help="plies per game (default 40)")
+    bench.add_argument("--engine-every", type=int, default=0, help="make every nth ply an engine move")
+    bench.add_argument("--workers", type=int, default=None, help="engine processes (default one per core)")
+    bench.add_argument("--transport", choices=("local", "tcp"), default="local")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = GameServer(args.workers, max_depth=args.max_depth, max_movetime=args.max_movetime,
+                            max_nodes=args.max_nodes)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+        return 0
+    print("%8s %8s %9s %10s %9s %9s" % ("games", "moves", "seconds", "moves/s", "p50 ms", "p99 ms"))
+    for games in args.games:
+        moves, elapsed, p50, p99 = asyncio.run(load_test(games, args.plies, args.engine_every, args.workers,
+                                                         args.transport))
+        print("%8d %8d %9.2f %10.0f %9.2f %9.2f" % (games, moves, elapsed, moves / max(elapsed, 1e-9),
+                                                    p50 * 1000, p99 * 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+endgame tablebases: distance to mate for every position of a small material set, one byte per position
+tables are files probed through mmap, only the byte for the probed position is ever read
+(ChessTablebaseGen builds them)
+"""
+
+import mmap
+import os
+
+from ChessBitboard import PAWN_ATTACKS, squares
+
+TABLE_MAGIC = b"CTB1"
+HEADER_BYTES = 16  # magic + material name, padded
+TABLE_SUFFIX = ".ctb"
+PIECE_ORDER = "KQRBNP"  # order of pieces in a material name and in the index
+PIECE_WORTH = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+MAX_PLIES = 126  # longest distance to mate a table byte can hold
+
+# a table byte, from the side to move's point of view:
+# 0 draw, n > 0 wins and mates in n plies, -(n + 1) loses and is mated in n plies (so -1 is checkmated)
+
+
+def decode_value(value):
+    '''
+    Returns (wdl, plies) for a table byte: wdl 1 win, 0 draw, -1 loss for the side to move
+    '''
+    if value > 0:
+        return 1, value
+    if value < 0:
+        return -1, -value - 1
+    return 0, 0
+
+
+def split_material(material):
+    '''
+    "KQK" -> ("KQ", "K"), white's pieces first, each side starts with its king
+    '''
+    black = material.index("K", 1)
+    return material[:black], material[black:]
+
+
+def side_material(bitboards, color):
+    '''
+    Material name of one side of a position, "KRP" style
+    '''
+    return "".join(kind * bitboards[color + kind].bit_count() for kind in PIECE_ORDER)
+
+
+def stronger_first(white, black):
+    '''
+    True if a table is stored with these sides as given (the stronger side plays white in every table)
+    '''
+    return (sum(PIECE_WORTH[kind] for kind in white), len(white), white) >= \
+        (sum(PIECE_WORTH[kind] for kind in black), len(black), black)
+
+
+def trivial_draw(white, black):
+    '''
+    True for material that can never mate: bare kings, or a single knight or bishop against a bare king
+    '''
+    pieces = white[1:] + black[1:]
+    return len(pieces) <= 1 and pieces in ("", "N", "B")
+
+
+class Layout:
+    '''
+    Index arithmetic of one table: pieces in index order, the squares the first white king may use and the size
+    the white king is kept on files a-d (and ranks 5-8 without pawns) by mirroring, which cuts the table 2 or 4 times
+    '''
+    def __init__(self, material):
+        self.material = material
+        white, black = split_material(material)
+        self.pieces = tuple("w" + kind for kind in white) + tuple("b" + kind for kind in black)
+        self.pawns = "P" in material
+        rows = range(8) if self.pawns else range(4)
+        self.king_squares = tuple(r * 8 + c for r in rows for c in range(4))
+        self.king_index = {sq: i for i, sq in enumerate(self.king_squares)}
+        self.others = len(self.pieces) - 1
+        self.size = 2 * len(self.king_squares) * 64 ** self.others
+
+    def index(self, white_to_move, piece_squares):
+        '''
+        Index of a position given the square of every piece in self.pieces order (before mirroring)
+        '''
+        king = piece_squares[0]
+        flip = 7 if king & 7 > 3 else 0  # mirror files
+        if not self.pawns and king >> 3 > 3:
+            flip |= 56  # mirror ranks
+        index = (0 if white_to_move else 1) * len(self.king_squares) + self.king_index[king ^ flip]
+        for sq in piece_squares[1:]:
+            index = index * 64 + (sq ^ flip)
+        return index
+
+    def decode(self, index):
+        '''
+        Returns (white_to_move, piece squares) of an index
+        '''
+        piece_squares = []
+        for _ in range(self.others):
+            piece_squares.append(index % 64)
+            index //= 64
+        piece_squares.append(self.king_squares[index % len(self.king_squares)])
+        piece_squares.reverse()
+        return index // len(self.king_squares) == 0, piece_squares
+
+
+def position_key(gs):
+    '''
+    (material, index) of a GameState's position in the table that holds it, or (None, 0) if it's a trivial draw
+    '''
+    b = gs.bitboards
+    white = side_material(b, "w")
+    black = side_material(b, "b")
+    if trivial_draw(white, black):
+        return None, 0
+    if stronger_first(white, black):
+        colors, white_to_move, flip = ("w", "b"), gs.white_to_move, 0
+    else:  # stored the other way round: swap colors and mirror the ranks
+        white, black = black, white
+        colors, white_to_move, flip = ("b", "w"), not gs.white_to_move, 56
+    layout = _layout(white + black)
+    piece_squares = []
+    for color, material in zip(colors, (white, black)):
+        for kind in PIECE_ORDER:
+            if kind in material:
+                piece_squares.extend(sq ^ flip for sq in squares(b[color + kind]))
+    return layout.material, layout.index(white_to_move, piece_squares)
+
+
+_LAYOUTS = {}
+
+
+def _layout(material):
+    layout = _LAYOUTS.get(material)
+    if layout is None:
+        layout = _LAYOUTS[material] = Layout(material)
+    return layout
+
+
+class Tablebases:
+    '''
+    The tables found in a directory, each opened and mmapped the first time it's needed
+    '''
+    def __init__(self, directory="tablebases"):
+        self.directory = directory
+        self.tables = {}  # material -> mmap, or None when there is no file for it
+        self.max_pieces = 0  # most pieces in any table in the directory, fewer pieces is worth probing
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(TABLE_SUFFIX):
+                    self.max_pieces = max(self.max_pieces, len(name) - len(TABLE_SUFFIX))
+
+    def path(self, material):
+        return os.path.join(self.directory, material + TABLE_SUFFIX)
+
+    def table(self, material):
+        '''
+        The mmapped table for a material name, or None
+        '''
+        if material in self.tables:
+            return self.tables[material]
+        table = None
+        path = self.path(material)
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if table[:len(TABLE_MAGIC)] != TABLE_MAGIC or \
+                    table[len(TABLE_MAGIC):HEADER_BYTES].rstrip(b"\0").decode() != material:
+                table.close()
+                raise ValueError("%s is not a table for %s" % (path, material))
+        self.tables[material] = table
+        return table
+
+    def probe(self, gs):
+        '''
+        Table byte for the position in gs (see decode_value), None if no table covers it
+        positions with castling rights or a possible en passant capture are never in a table
+        '''
+        if gs.castling or (gs.occupancy["w"] | gs.occupancy["b"]).bit_count() > max(self.max_pieces, 3):
+            return None
+        if gs.en_passant_possible:
+            color, enemy = ("w", "b") if gs.white_to_move else ("b", "w")
+            r, c = gs.en_passant_possible
+            if PAWN_ATTACKS[enemy][r * 8 + c] & gs.bitboards[color + "P"]:
+                return None
+        material, index = position_key(gs)
+        if material is None:
+            return 0
+        table = self.table(material)
+        if table is None:
+            return None
+        value = table[HEADER_BYTES + index]
+        return value - 256 if value > 127 else value
+
+    def probe_wdl(self, gs):
+        '''
+        (wdl, plies to mate) for the side to move (see decode_value), None if no table covers the position
+        '''
+        value = self.probe(gs)
+        return None if value is None else decode_value(value)
+
+    def best_move(self, gs):
+        '''
+        Packed move that wins fastest, loses slowest or keeps the draw, None if the position isn't in a table
+        '''
+        if self.probe(gs) is None:
+            return None
+        best = None
+        best_rank = None
+        for m in list(gs.generate_valid_moves([])):
+            gs.make_packed(m)
+            value = self.probe(gs)
+            gs.undo_packed()
+            if value is None:
+                continue
+            wdl, plies = decode_value(value)  # from the opponent's side
+            # rank: opponent mated soonest first, then draws, then losing as slowly as possible
+            rank = (2, -plies) if wdl < 0 else (1, 0) if wdl == 0 else (0, plies)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = m, rank
+        return best
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables.clear()
+
+
+DEFAULT_DIRECTORY = os.environ.get("CHESS_TABLEBASES", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                     "tablebases"))
+_default = None
+
+
+def default_tablebases():
+    '''
+    Shared Tablebases for DEFAULT_DIRECTORY (the CHESS_TABLEBASES environment variable or ./tablebases)
+    '''
+    global _default
+    if _default is None:
+        _default = Tablebases(DEFAULT_DIRECTORY)
+    return _default
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+building endgame tablebases (see ChessTablebase) by retrograde analysis
+legal moves come from GameState, the positions of a table are split into ranges that worker processes expand
+into their successors, then the parent works backwards from the mates: a position is won if some move reaches a
+lost position and lost once every move reaches a won one
+"""
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+from array import array
+
+import ChessEngine
+from ChessBitboard import KING_ATTACKS, SQ_TO_RC
+from ChessTablebase import TABLE_MAGIC, HEADER_BYTES, PIECE_ORDER, MAX_PLIES, Layout, Tablebases, split_material, \
+    stronger_first, trivial_draw
+
+# what the workers find out about a position
+INVALID, NORMAL, MATED, STALEMATE = 0, 1, 2, 3
+
+
+def normalize(material):
+    '''
+    Table name for a material string like "KQK" or "KQvK": pieces in PIECE_ORDER, stronger side first
+    '''
+    material = material.upper().replace("V", "")
+    if material.count("K") != 2 or not material.startswith("K") or set(material) - set(PIECE_ORDER):
+        raise ValueError("bad material %r, expected something like KQK or KRPvKR" % material)
+    white, black = (side[0] + "".join(sorted(side[1:], key=PIECE_ORDER.index)) for side in split_material(material))
+    return white + black if stronger_first(white, black) else black + white
+
+
+def dependencies(material):
+    '''
+    Tables a capture or promotion leads to from this one (trivial draws need no table)
+    '''
+    white, black = split_material(material)
+    found = set()
+    for side, other in ((white, black), (black, white)):
+        for i, kind in enumerate(side):
+            if kind == "K":
+                continue
+            options = [side[:i] + side[i + 1:]]  # captured
+            if kind == "P":  # promoted
+                options += [side[:i] + promoted + side[i + 1:] for promoted in "QRBN"]
+            for changed in options:
+                pair = (changed, other) if side is white else (other, changed)
+                if not trivial_draw(*pair):
+                    found.add(normalize(pair[0] + pair[1]))
+    return sorted(found)
+
+
+class _Worker:
+    '''
+    One GameState per process, cleared once and then reused for every position of a range
+    '''
+    def __init__(self, material, directory):
+        self.layout = Layout(material)
+        self.tablebases = Tablebases(directory)  # the smaller tables captures and promotions lead to
+        self.gs = ChessEngine.GameState()
+        for r in range(8):
+            for c in range(8):
+                self.gs.set_square(r, c, "--")
+        self.gs.castling = 0
+        self.moves = []
+
+    def expand(self, index):
+        '''
+        Returns (status, children, win, open_moves, worst) for the position at index
+        children are the indexes reached in this table, the rest is about moves that leave it:
+        win is the fastest mate in plies + 1 they give (0 for none), open_moves how many of them don't lose,
+        worst the longest the opponent needs to mate after one that is
+        '''
+        layout = self.layout
+        white_to_move, piece_squares = layout.decode(index)
+        pieces = layout.pieces
+        if len(set(piece_squares)) < len(piece_squares):
+            return INVALID, (), 0, 0, 0
+        for piece, sq in zip(pieces, piece_squares):
+            if piece[1] == "P" and sq >> 3 in (0, 7):
+                return INVALID, (), 0, 0, 0
+        white_king = piece_squares[0]
+        black_king = piece_squares[pieces.index("bK")]
+        if KING_ATTACKS[white_king] >> black_king & 1:
+            return INVALID, (), 0, 0, 0
+        gs = self.gs
+        for piece, sq in zip(pieces, piece_squares):
+            gs.set_square(*SQ_TO_RC[sq], piece)
+        gs.white_king_pos = SQ_TO_RC[white_king]
+        gs.black_king_pos = SQ_TO_RC[black_king]
+        gs.white_to_move = white_to_move
+        try:
+            # the side that just moved can't be left in check
+            if gs.attackers_to(black_king if white_to_move else white_king, "w" if white_to_move else "b"):
+                return INVALID, (), 0, 0, 0
+            moves = gs.generate_valid_moves(self.moves)
+            if not moves:
+                return (MATED if gs.in_check else STALEMATE), (), 0, 0, 0
+            location = {sq: i for i, sq in enumerate(piece_squares)}
+            children = []
+            win = open_moves = worst = 0
+            for m in moves:
+                start = m & 63
+                end = m >> 6 & 63
+                if end not in location and not m & ChessEngine.PROMOTION_MASK:  # same material, index directly
+                    after = list(piece_squares)
+                    after[location[start]] = end
+                    children.append(layout.index(not white_to_move, after))
+                    continue
+                gs.make_packed(m)
+                value = self.tablebases.probe(gs)
+                gs.undo_packed()
+                if value is None:
+                    raise ValueError("no table for a position after %s" % gs.move_to_san(m))
+                if value < 0:  # the opponent gets mated
+                    plies = -value - 1
+                    win = plies + 2 if not win or plies + 2 < win else win
+                    open_moves += 1
+                elif value > 0:
+                    worst = max(worst, value)
+                else:
+                    open_moves += 1
+            return NORMAL, children, win, open_moves, worst
+        finally:
+            for sq in piece_squares:
+                gs.set_square(*SQ_TO_RC[sq], "--")
+
+
+_workers = {}
+
+
+def expand_range(material, directory, start, stop):
+    '''
+    Worker side: expands the positions start..stop-1 of a table, returns flat arrays (as bytes) for the parent
+    '''
+    worker = _workers.get(material)
+    if worker is None:
+        worker = _workers[material] = _Worker(material, directory)
+    status = bytearray(stop - start)
+    win = array("H", bytes(2 * (stop - start)))
+    open_moves = array("H", bytes(2 * (stop - start)))
+    worst = array("H", bytes(2 * (stop - start)))
+    counts = array("H", bytes(2 * (stop - start)))
+    children = array("l")
+    for i in range(stop - start):
+        status[i], found, win[i], open_moves[i], worst[i] = worker.expand(start + i)
+        counts[i] = len(found)
+        children.extend(found)
+    return start, bytes(status), win.tobytes(), open_moves.tobytes(), worst.tobytes(), counts.tobytes(), \
+        children.tobytes()
+
+
+def solve(material, directory, workers=None, log=None):
+    '''
+    Builds the table for one material and writes it to directory, returns the number of won positions
+    the tables it depends on must exist already (generate takes care of that)
+    '''
+    layout = Layout(material)
+    size = layout.size
+    status = bytearray(size)
+    win = array("H", bytes(2 * size))
+    remaining = array("H", bytes(2 * size))  # moves not yet known to lose, 0 means lost
+    worst = array("H", bytes(2 * size))
+    counts = array("H", bytes(2 * size))
+    children = {}  # range start -> successors of its positions, put together below
+    step = max(1024, size // (8 * max(workers or 1, 1)))
+    ranges = [(start, min(start + step, size)) for start in range(0, size, step)]
+    started = time.perf_counter()
+    if workers == 0:
+        results = (expand_range(material, directory, start, stop) for start, stop in ranges)
+        pool = None
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(workers)
+        results = pool.map(expand_range, *zip(*[(material, directory, start, stop) for start, stop in ranges]))
+    try:
+        for start, part_status, part_win, part_open, part_worst, part_counts, part_children in results:
+            stop = start + len(part_status)
+            status[start:stop] = part_status
+            win[start:stop] = array("H", part_win)
+            remaining[start:stop] = array("H", part_open)
+            worst[start:stop] = array("H", part_worst)
+            counts[start:stop] = array("H", part_counts)
+            children[start] = array("l", part_children)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if log:
+        log("%s: %d positions expanded in %.1fs" % (material, size, time.perf_counter() - started))
+
+    # predecessors of every position, in one flat array: parents[first[i]:first[i + 1]]
+    first = array("q", bytes(8 * (size + 1)))
+    for start, _ in ranges:
+        for child in children[start]:
+            first[child + 1] += 1
+    for i in range(size):
+        first[i + 1] += first[i]
+    fill = array("q", first)
+    parents = array("l", [0]) * first[size]
+    for start, stop in ranges:
+        part = children[start]
+        k = 0
+        for parent in range(start, stop):
+            n = counts[parent]
+            remaining[parent] += n
+            for child in part[k:k + n]:
+                parents[fill[child]] = parent
+                fill[child] += 1
+            k += n
+        del children[start]
+    del fill, children
+
+    # positions are settled in order of distance to mate, odd distances are wins and even ones losses
+    values = array("b", bytes(size))
+    settled = bytearray(size)
+    buckets = [[] for _ in range(MAX_PLIES + 2)]
+    for i in range(size):
+        if status[i] == MATED:
+            buckets[0].append(i)
+        elif status[i] == NORMAL:
+            if win[i]:
+                buckets[win[i] - 1].append(i)
+            if remaining[i] == 0:  # every move leaves the table into a lost position
+                buckets[worst[i] + 1].append(i)
+    won = 0
+    for plies in range(MAX_PLIES + 1):
+        losing = plies % 2 == 0
+        for i in buckets[plies]:
+            if settled[i]:
+                continue
+            settled[i] = 1
+            if losing:
+                values[i] = -plies - 1
+                for parent in parents[first[i]:first[i + 1]]:
+                    if not settled[parent]:
+                        buckets[plies + 1].append(parent)
+            else:
+                values[i] = plies
+                won += 1
+                for parent in parents[first[i]:first[i + 1]]:
+                    if not settled[parent]:
+                        remaining[parent] -= 1
+                        if remaining[parent] == 0:
+                            buckets[max(plies, worst[parent]) + 1].append(parent)
+        buckets[plies] = None
+    if buckets[MAX_PLIES + 1]:
+        raise ValueError("%s has mates longer than %d plies" % (material, MAX_PLIES))
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, material + ".ctb")
+    with open(path + ".tmp", "wb") as file:
+        file.write((TABLE_MAGIC + material.encode()).ljust(HEADER_BYTES, b"\0"))
+        file.write(values.tobytes())
+    os.replace(path + ".tmp", path)  # a half written table is never picked up
+    if log:
+        log("%s: %d won, longest mate %d plies, %.1fs" % (material, won, max(values), time.perf_counter() - started))
+    return won
+
+
+def generate(materials, directory="tablebases", workers=None, force=False, log=print):
+    '''
+    Builds the tables for some materials ("KQK", "KRvK", ...) and every table they depend on, smallest first
+    existing tables are kept unless force, workers=0 runs in this process, None uses every core
+    positions are assumed to have no castling rights or en passant capture, 4 man tables take a while and 5 man
+    tables are only practical with many cores and a lot of memory
+    '''
+    order = []
+
+    def visit(material):
+        if material in order:
+            return
+        for needed in dependencies(material):
+            visit(needed)
+        order.append(material)
+
+    for material in materials:
+        visit(normalize(material))
+    for material in order:
+        if force and material in [normalize(m) for m in materials] or \
+                not os.path.exists(os.path.join(directory, material + ".ctb")):
+            solve(material, directory, workers, log)
+    return order
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build endgame tablebases")
+    parser.add_argument("materials", nargs="+", help="material sets like KQK KRK KPK KBNK")
+    parser.add_argument("--dir", default="tablebases", help="output directory (default ./tablebases)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default one per core)")
+    parser.add_argument("--force", action="store_true", help="rebuild the named tables even if they exist")
+    args = parser.parse_args(argv)
+    generate(args.materials, args.dir, args.workers, args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+batched boards as NumPy arrays: N positions as an (N, 12) array of uint64 bitboards in PIECES order, plus side,
+castling, en passant and clock columns, so whole batches are evaluated and featurized with array operations
+planes() unpacks them into an (N, 12, 8, 8) tensor, to_states() turns them back into GameStates
+attacks are worked out setwise, one shift (or one ray fill) per direction for every position at once
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+import ChessEngine
+from ChessBitboard import DIRECTIONS, ORTHOGONAL, DIAGONAL, SQ_TO_RC, squares
+from ChessEngine import PIECES, WHITE_SHORT, WHITE_LONG, BLACK_SHORT, BLACK_LONG
+from ChessEval import MAX_PHASE, MOBILITY_WEIGHTS, PSQT, unpack_score
+from ChessFen import parse_square
+
+PLANES = {piece: index for index, piece in enumerate(PIECES)}  # piece code -> plane
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+MOBILITY_KINDS = tuple(MOBILITY_WEIGHTS)  # "N", "B", "R", "Q", the columns of mobility_features
+BLOCK = 8192  # positions unpacked at a time by the square by square kernels, bounds their scratch memory
+
+# PSQT unpacked into (12 * 64, 2) middlegame/endgame weights for one matrix product per block, exact in float32
+_WEIGHTS = np.array([unpack_score(PSQT[piece][sq])[:2] for piece in PIECES for sq in range(64)], dtype=np.float32)
+_PHASE = np.array([unpack_score(PSQT[piece][0])[2] for piece in PIECES], dtype=np.int64)
+
+# FEN board field -> 64 characters, one per square, '.' for empty
+_EXPAND = {ord(str(n)): "." * n for n in range(1, 9)}
+_EXPAND[ord("/")] = None
+_CHAR_PLANE = np.full(256, -1, dtype=np.int8)  # FEN piece letter -> plane
+for _piece, _index in PLANES.items():
+    _CHAR_PLANE[ord(_piece[1] if _piece[0] == "w" else _piece[1].lower())] = _index
+_CASTLE_BITS = {"K": WHITE_SHORT, "Q": WHITE_LONG, "k": BLACK_SHORT, "q": BLACK_LONG, "-": 0}
+_CASTLING = {"".join(right for right in "KQkq" if bits & _CASTLE_BITS[right]) or "-": bits
+             for bits in range(16)}  # FEN castling field in the usual KQkq order -> bits
+
+
+def _file_mask(dc):
+    '''
+    Squares a shift dc files sideways can land on without having wrapped round the board edge
+    '''
+    mask = 0
+    for sq in range(64):
+        if 0 <= (sq & 7) - dc < 8:
+            mask |= 1 << sq
+    return np.uint64(mask)
+
+
+def _shifter(dr, dc):
+    '''
+    Function moving every set bit of a uint64 array dr rows and dc columns (bits that leave the board are lost)
+    '''
+    offset = dr * 8 + dc
+    amount = np.uint64(abs(offset))
+    mask = _file_mask(dc)
+    if offset > 0:
+        return lambda bb: (bb << amount) & mask
+    return lambda bb: (bb >> amount) & mask
+
+
+_RAY_SHIFTS = tuple(_shifter(dr, dc) for dr, dc in DIRECTIONS)
+_KNIGHT_SHIFTS = tuple(_shifter(dr, dc) for dr, dc in KNIGHT_STEPS)
+_PAWN_SHIFTS = {"w": (_shifter(-1, -1), _shifter(-1, 1)), "b": (_shifter(1, -1), _shifter(1, 1))}
+
+
+def _popcount_swar(bb):
+    bb = bb - ((bb >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bb = (bb & np.uint64(0x3333333333333333)) + ((bb >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    bb = (bb + (bb >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((bb * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def popcount(bb):
+    '''
+    Set bits of every uint64 in an array, as int64 (np.bitwise_count on NumPy 2, a SWAR count before that)
+    '''
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bb).astype(np.int64)
+    return _popcount_swar(bb)
+
+
+def _ray_fill(shift, sliders, empty):
+    '''
+    Squares sliders attack along one direction, up to and including the first blocker
+    a square is reached from at most one slider per direction (the nearer one blocks the rest)
+    '''
+    flood = sliders
+    step = sliders
+    for _ in range(6):
+        step = shift(step) & empty
+        if not step.any():
+            break
+        flood = flood | step
+    return shift(flood)
+
+
+class BoardBatch:
+    '''
+    N positions as arrays: bitboards (N, 12) uint64 in PIECES order, white_to_move (N,) bool,
+    castling (N,) uint8 in GameState.castling bits, en_passant (N,) int8 square or -1, halfmove_clock and
+    fullmove_number (N,) int32
+    '''
+    def __init__(self, bitboards, white_to_move, castling, en_passant, halfmove_clock, fullmove_number):
+        self.bitboards = bitboards
+        self.white_to_move = white_to_move
+        self.castling = castling
+        self.en_passant = en_passant
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+    @classmethod
+    def from_fens(cls, fens):
+        '''
+        Batch from FEN strings, the boards are decoded all together (no GameStates are made)
+        '''
+        n = len(fens)
+        cells = []
+        white_to_move = np.empty(n, dtype=bool)
+        castling = np.empty(n, dtype=np.uint8)
+        en_passant = np.empty(n, dtype=np.int8)
+        halfmove_clock = np.zeros(n, dtype=np.int32)
+        fullmove_number = np.ones(n, dtype=np.int32)
+        for i, fen in enumerate(fens):
+            fields = fen.split()
+            placement = fields[0].translate(_EXPAND)
+            if len(placement) != 64:
+                raise ValueError("bad FEN board %r" % fields[0])
+            cells.append(placement)
+            white_to_move[i] = fields[1] == "w"
+            rights = _CASTLING.get(fields[2])
+            castling[i] = rights if rights is not None else sum(_CASTLE_BITS[right] for right in fields[2])
+            if fields[3] == "-":
+                en_passant[i] = -1
+            else:
+                r, c = parse_square(fields[3])
+                en_passant[i] = r * 8 + c
+            if len(fields) > 5:
+                halfmove_clock[i] = int(fields[4])
+                fullmove_number[i] = int(fields[5])
+        codes = np.frombuffer("".join(cells).encode("ascii"), dtype=np.uint8).reshape(n, 64)
+        planes = _CHAR_PLANE[codes]  # (N, 64) plane of the piece on each square, -1 for empty
+        bitboards = np.empty((n, 12), dtype=np.uint64)
+        for start in range(0, n, BLOCK):
+            block = planes[start:start + BLOCK]
+            onehot = block[:, None, :] == np.arange(12, dtype=np.int8)[None, :, None]
+            bitboards[start:start + BLOCK] = np.packbits(onehot, axis=-1, bitorder="little").view("<u8")[..., 0]
+        return cls(bitboards, white_to_move, castling, en_passant, halfmove_clock, fullmove_number)
+
+    @classmethod
+    def from_states(cls, states):
+        '''
+        Batch from GameStates, straight from their bitboards
+        '''
+        n = len(states)
+        bitboards = np.fromiter((gs.bitboards[piece] for gs in states for piece in PIECES), dtype=np.uint64,
+                                count=12 * n).reshape(n, 12)
+        en_passant = np.fromiter((gs.en_passant_possible[0] * 8 + gs.en_passant_possible[1]
+                                  if gs.en_passant_possible else -1 for gs in states), dtype=np.int8, count=n)
+        return cls(bitboards,
+                   np.fromiter((gs.white_to_move for gs in states), dtype=bool, count=n),
+                   np.fromiter((gs.castling for gs in states), dtype=np.uint8, count=n),
+                   en_passant,
+                   np.fromiter((gs.halfmove_clock for gs in states), dtype=np.int32, count=n),
+                   np.fromiter((gs.fullmove_number for gs in states), dtype=np.int32, count=n))
+
+    def to_states(self):
+        '''
+        A fresh GameState for every position (each starts its own history, like GameState.from_fen)
+        '''
+        states = []
+        for i in range(len(self)):
+            gs = ChessEngine.GameState()
+            board = [["--"] * 8 for _ in range(8)]
+            for piece, bb in zip(PIECES, self.bitboards[i].tolist()):
+                for sq in squares(bb):
+                    board[sq >> 3][sq & 7] = piece
+            gs.board = board
+            gs.white_to_move = bool(self.white_to_move[i])
+            gs.load_bitboards()
+            gs.castling = int(self.castling[i])
+            en_passant = int(self.en_passant[i])
+            gs.en_passant_possible = SQ_TO_RC[en_passant] if en_passant >= 0 else ()
+            gs.halfmove_clock = int(self.halfmove_clock[i])
+            gs.fullmove_number = int(self.fullmove_number[i])
+            gs.load_zobrist()
+            states.append(gs)
+        return states
+
+    def to_fens(self):
+        return [gs.to_fen() for gs in self.to_states()]
+
+    def __len__(self):
+        return len(self.bitboards)
+
+    def __getitem__(self, index):
+        '''
+        Sub-batch from a slice, index array or mask (views where NumPy gives views)
+        '''
+        if isinstance(index, int):
+            index = slice(index, index + 1 or None)
+        return BoardBatch(self.bitboards[index], self.white_to_move[index], self.castling[index],
+                          self.en_passant[index], self.halfmove_clock[index], self.fullmove_number[index])
+
+    @staticmethod
+    def concatenate(batches):
+        return BoardBatch(*(np.concatenate([getattr(batch, name) for batch in batches])
+                            for name in ("bitboards", "white_to_move", "castling", "en_passant", "halfmove_clock",
+                                         "fullmove_number")))
+
+    def planes(self, dtype=np.uint8):
+        '''
+        (N, 12, 8, 8) tensor, planes in PIECES order, [row][col] as in GameState.board (row 0 is rank 8)
+        '''
+        bits = np.unpackbits(self.bitboards.astype("<u8").view(np.uint8).reshape(len(self), 12, 8), axis=-1,
+                             bitorder="little")
+        return bits.reshape(len(self), 12, 8, 8).astype(dtype, copy=False)
+
+    def packed_planes(self):
+        '''
+        (N, 12, 8) uint8: one byte per row of each plane, bit c set for column c (planes() without unpacking)
+        '''
+        return self.bitboards.astype("<u8").view(np.uint8).reshape(len(self), 12, 8)
+
+    def occupancy(self):
+        '''
+        (white, black) piece masks, (N,) uint64 each
+        '''
+        bb = self.bitboards
+        return np.bitwise_or.reduce(bb[:, :6], axis=1), np.bitwise_or.reduce(bb[:, 6:], axis=1)
+
+    def piece_counts(self):
+        '''
+        (N, 12) int64 number of each piece
+        '''
+        return popcount(self.bitboards)
+
+
+def material_psqt(batch):
+    '''
+    (mg, eg, phase) (N,) int64 arrays: material plus piece-square score from white's side and the phase weight,
+    what GameState.psqt holds for each position
+    '''
+    n = len(batch)
+    scores = np.empty((n, 2), dtype=np.float32)
+    for start in range(0, n, BLOCK):
+        bits = batch[start:start + BLOCK].planes(np.float32)
+        scores[start:start + BLOCK] = bits.reshape(len(bits), 12 * 64) @ _WEIGHTS
+    scores = scores.astype(np.int64)
+    return scores[:, 0], scores[:, 1], batch.piece_counts() @ _PHASE
+
+
+def taper(batch, mg, eg, phase):
+    '''
+    Side to move scores from white's mg/eg arrays, rounded exactly like Evaluator.evaluate
+    '''
+    phase = np.minimum(phase, MAX_PHASE)
+    score = mg * phase + eg * (MAX_PHASE - phase)
+    return np.where(batch.white_to_move, score, -score) // MAX_PHASE
+
+
+def evaluate(batch, mobility=False):
+    '''
+    (N,) int64 centipawns for the side to move from material and piece-square tables, equal to
+    ChessEval.Evaluator(pawn_terms=()).evaluate for each position, with mobility=True to
+    Evaluator(terms=(ChessEval.mobility,), pawn_terms=())
+    '''
+    mg, eg, phase = material_psqt(batch)
+    if mobility:
+        mobility_mg, mobility_eg = mobility_score(mobility_features(batch))
+        mg = mg + mobility_mg
+        eg = eg + mobility_eg
+    return taper(batch, mg, eg, phase)
+
+
+def _attack_sets(batch, color):
+    '''
+    Yields (kind, squares) attack sets for one side: every pawn capture direction, knight and king step and slider
+    ray separately, so a square is in at most one set per attacking piece and sets can be counted up exactly
+    '''
+    offset = 0 if color == "w" else 6
+    bb = batch.bitboards
+    white, black = batch.occupancy()
+    empty = ~(white | black)
+    for shift in _PAWN_SHIFTS[color]:
+        yield "P", shift(bb[:, offset])
+    for shift in _KNIGHT_SHIFTS:
+        yield "N", shift(bb[:, offset + 1])
+    for shift in _RAY_SHIFTS:
+        yield "K", shift(bb[:, offset + 5])
+    queens = bb[:, offset + 4]
+    for kind, directions, plane in (("B", DIAGONAL, 2), ("R", ORTHOGONAL, 3)):
+        sliders = bb[:, offset + plane]
+        for d in directions:
+            yield kind, _ray_fill(_RAY_SHIFTS[d], sliders, empty)
+            yield "Q", _ray_fill(_RAY_SHIFTS[d], queens, empty)
+
+
+def attack_maps(batch):
+    '''
+    (N, 2) uint64: every square white (column 0) and black (column 1) attacks
+    '''
+    maps = np.zeros((len(batch), 2), dtype=np.uint64)
+    for side, color in enumerate("wb"):
+        for _, attacked in _attack_sets(batch, color):
+            maps[:, side] |= attacked
+    return maps
+
+
+def attack_counts(batch):
+    '''
+    (N, 2, 64) uint8: how many white (0) and black (1) pieces attack each square
+    '''
+    n = len(batch)
+    counts = np.zeros((n, 2, 64), dtype=np.uint8)
+    for side, color in enumerate("wb"):
+        for _, attacked in _attack_sets(batch, color):
+            counts[:, side] += np.unpackbits(attacked.astype("<u8").view(np.uint8).reshape(n, 8), axis=-1,
+                                             bitorder="little")
+    return counts
+
+
+def mobility_features(batch):
+    '''
+    (N, 2, 4) int64: squares reached by each side's knights, bishops, rooks and queens (MOBILITY_KINDS order),
+    summed over the pieces of a kind and counted like ChessEval.mobility: not held by its own side and not attacked
+    by an enemy pawn
+    '''
+    n = len(batch)
+    features = np.zeros((n, 2, len(MOBILITY_KINDS)), dtype=np.int64)
+    white, black = batch.occupancy()
+    for side, (color, enemy) in enumerate((("w", "b"), ("b", "w"))):
+        pawns = batch.bitboards[:, PLANES[enemy + "P"]]
+        free = ~(white if color == "w" else black)
+        for shift in _PAWN_SHIFTS[enemy]:
+            free &= ~shift(pawns)
+        for kind, attacked in _attack_sets(batch, color):
+            if kind in MOBILITY_WEIGHTS:
+                features[:, side, MOBILITY_KINDS.index(kind)] += popcount(attacked & free)
+    return features
+
+
+def mobility_score(features):
+    '''
+    (mg, eg) (N,) int64 from mobility_features with ChessEval.MOBILITY_WEIGHTS, from white's side
+    '''
+    weights = np.array([MOBILITY_WEIGHTS[kind] for kind in MOBILITY_KINDS], dtype=np.int64)  # (4, 2)
+    net = features[:, 0] - features[:, 1]
+    score = net @ weights
+    return score[:, 0], score[:, 1]
+
+
+def sample_fens(count, seed=1, max_plies=80):
+    '''
+    Positions from random games, for benchmarks and checks
+    '''
+    rng = random.Random(seed)
+    fens = []
+    while len(fens) < count:
+        gs = ChessEngine.GameState()
+        for _ in range(rng.randrange(max_plies)):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+        fens.append(gs.to_fen())
+    return fens
+
+
+def check(fens):
+    '''
+    Compares every kernel with ChessEngine/ChessEval on each position, returns the FENs that disagree
+    '''
+    import ChessEval
+    batch = BoardBatch.from_fens(fens)
+    plain = ChessEval.Evaluator(pawn_terms=())
+    with_mobility = ChessEval.Evaluator(terms=(ChessEval.mobility,), pawn_terms=())
+    scores = evaluate(batch)
+    mobility_scores = evaluate(batch, mobility=True)
+    maps = attack_maps(batch)
+    counts = attack_counts(batch)
+    bad = []
+    for i, gs in enumerate(batch.to_states()):
+        attacked = [sum(1 << sq for sq in range(64) if gs.attackers_to(sq, color, gs.occupancy["w"] |
+                                                                        gs.occupancy["b"]))
+                    for color in "wb"]
+        if gs.to_fen() != fens[i] or BoardBatch.from_states([gs]).bitboards.tolist() != [batch.bitboards[i].tolist()] \
+                or scores[i] != plain.evaluate(gs) or mobility_scores[i] != with_mobility.evaluate(gs) \
+                or maps[i].tolist() != attacked or (counts[i] > 0).tolist() != \
+                [[bool(attacked[side] >> sq & 1) for sq in range(64)] for side in range(2)]:
+            bad.append(fens[i])
+    return bad
+
+
+def bench(count=200000, distinct=2000, log=print):
+    '''
+    Positions/s of each stage over count positions (distinct random positions repeated)
+    '''
+    fens = sample_fens(distinct)
+    fens = (fens * (count // distinct + 1))[:count]
+    rates = {}
+    start = time.perf_counter()
+    batch = BoardBatch.from_fens(fens)
+    rates["from_fens"] = count / (time.perf_counter() - start)
+    for name, kernel in (("planes", BoardBatch.planes), ("evaluate", evaluate), ("attack_maps", attack_maps),
+                         ("attack_counts", attack_counts), ("mobility_features", mobility_features)):
+        start = time.perf_counter()
+        kernel(batch)
+        rates[name] = count / (time.perf_counter() - start)
+    if log:
+        for name, rate in rates.items():
+            log("%-18s %12.0f positions/s" % (name, rate))
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="batched NumPy board tensors and kernels")
+    parser.add_argument("--count", type=int, default=200000, help="positions in the benchmark batch")
+    parser.add_argument("--check", type=int, default=0, metavar="N",
+                        help="compare the kernels with the engine's own code on N random positions instead")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        bad = check(sample_fens(args.check, seed=2))
+        for fen in bad:
+            print("mismatch", fen)
+        print("%d of %d positions agree" % (args.check - len(bad), args.check))
+        return 1 if bad else 0
+    bench(args.count)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
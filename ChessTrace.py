@@ -0,0 +1,118 @@
+"""
+opt-in tracing for GameState: per method call counts, timings and sizes (moves generated, checks, pins)
+tracing swaps wrapped methods onto one GameState instance, so untraced GameStates run the plain methods untouched
+"""
+
+import json
+import time
+
+
+def _moves_size(result, args):
+    return (("moves", len(result)),)
+
+
+def _pins_and_checks_size(result, args):
+    in_check, pins, checks = result
+    return ("checks", len(checks)), ("pins", len(pins))
+
+
+def _attacked_size(result, args):
+    return (("squares", result.bit_count()),)
+
+
+# GameState method -> function returning (counter, amount) pairs from its result (None to only count and time)
+TRACED_METHODS = {
+    "generate_valid_moves": _moves_size,
+    "prepare_moves": None,
+    "has_legal_move": None,
+    "check_for_pins_and_checks": _pins_and_checks_size,
+    "attacked_squares": _attacked_size,
+    "make_packed": None,
+    "undo_packed": None,
+}
+
+
+class Tracer:
+    '''
+    Collects counters for traced calls: {method: {"calls": n, "seconds": t, <size>: total, ...}}
+    '''
+    def __init__(self, timing=True):
+        self.timing = timing  # timing costs two clock reads per call, counts alone are cheaper
+        self.counters = {}
+
+    def wrap(self, name, func, size=None):
+        '''
+        Returns func wrapped so every call is recorded under name
+        '''
+        counter = self.counters.setdefault(name, {"calls": 0, "seconds": 0.0})
+        clock = time.perf_counter
+        timing = self.timing
+
+        def traced(*args):
+            if timing:
+                start = clock()
+                result = func(*args)
+                counter["seconds"] += clock() - start
+            else:
+                result = func(*args)
+            counter["calls"] += 1
+            if size is not None:
+                for key, amount in size(result, args):
+                    counter[key] = counter.get(key, 0) + amount
+            return result
+
+        traced.__wrapped__ = func
+        return traced
+
+    def attach(self, gs):
+        '''
+        Starts tracing a GameState
+        '''
+        for name, size in TRACED_METHODS.items():
+            setattr(gs, name, self.wrap(name, getattr(type(gs), name).__get__(gs), size))
+        return self
+
+    @staticmethod
+    def detach(gs):
+        '''
+        Stops tracing a GameState, it goes back to the plain class methods
+        '''
+        for name in TRACED_METHODS:
+            gs.__dict__.pop(name, None)
+
+    def reset(self):
+        '''
+        Zeroes every counter (the wrapped methods keep recording into the same dicts)
+        '''
+        for counter in self.counters.values():
+            for key in counter:
+                counter[key] = 0.0 if key == "seconds" else 0
+
+    def as_dict(self):
+        '''
+        Copy of the counters with the mean time per call added
+        '''
+        out = {}
+        for name, counter in self.counters.items():
+            entry = dict(counter)
+            entry["us_per_call"] = counter["seconds"] * 1e6 / counter["calls"] if counter["calls"] else 0.0
+            out[name] = entry
+        return out
+
+    def to_json(self):
+        '''
+        The counters as a JSON string, for shipping to a log or metrics system
+        '''
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def report(self):
+        '''
+        The counters as a readable table
+        '''
+        lines = ["%-28s %10s %10s %10s  %s" % ("method", "calls", "seconds", "us/call", "sizes")]
+        for name, entry in sorted(self.as_dict().items()):
+            sizes = ", ".join("%s=%d" % (k, v) for k, v in sorted(entry.items())
+                              if k not in ("calls", "seconds", "us_per_call"))
+            lines.append("%-28s %10d %10.4f %10.2f  %s" % (name, entry["calls"], entry["seconds"],
+                                                          entry["us_per_call"], sizes))
+        return "\n".join(lines)
@@ -0,0 +1,189 @@
+"""
+transposition table: fixed size cache of search results keyed by GameState.zobrist_key
+the best move is kept as the low 15 bits of a packed move (start, end and promotion, the flag is left out),
+GameState.staged_moves finds the legal move it stands for
+entries live in two preallocated flat arrays (keys and packed data) so memory use never grows after creation
+a key is stored XORed with its data word, so an entry half written by another process sharing the table
+(SharedTranspositionTable) fails the key check and reads as a miss, no locks needed
+"""
+
+from array import array
+from multiprocessing import shared_memory
+
+# bound types, stored in 2 bits (0 means an empty slot)
+EXACT = 1  # score is the exact value of the position
+LOWER = 2  # search failed high, real score is at least this
+UPPER = 3  # search failed low, real score is at most this
+
+ENTRY_BYTES = 16  # one 64 bit key and one 64 bit packed data word
+BUCKET_SIZE = 2  # slot 0 keeps the deepest result, slot 1 is always replaced
+
+# data word layout: score (32 bits, two's complement) | depth (8) | bound (2) | move (16) | age (6)
+_DEPTH_SHIFT = 32
+_BOUND_SHIFT = 40
+_MOVE_SHIFT = 42
+_AGE_SHIFT = 58
+
+
+def pack(score, depth, bound, move, age):
+    '''
+    Packs one entry into a 64 bit data word (move is a packed move & 0x7FFF or 0 for none, it fits in 16 bits)
+    '''
+    return (score & 0xFFFFFFFF) | depth << _DEPTH_SHIFT | bound << _BOUND_SHIFT | move << _MOVE_SHIFT | \
+        age << _AGE_SHIFT
+
+
+def unpack(data):
+    '''
+    Returns (score, depth, bound, move) from a packed data word
+    '''
+    score = data & 0xFFFFFFFF
+    if score & 0x80000000:
+        score -= 1 << 32
+    return score, data >> _DEPTH_SHIFT & 0xFF, data >> _BOUND_SHIFT & 0x3, data >> _MOVE_SHIFT & 0xFFFF
+
+
+class TranspositionTable:
+    '''
+    Two slot buckets (depth preferred + always replace) in flat arrays sized from a memory budget in MB
+    '''
+    def __init__(self, size_mb=16):
+        self.size_mb = size_mb
+        self.buckets = 1
+        while self.buckets * 2 * BUCKET_SIZE * ENTRY_BYTES <= size_mb * 1024 * 1024:  # largest power of 2 that fits
+            self.buckets *= 2
+        self.mask = self.buckets - 1
+        self.keys, self.data = self.allocate(self.buckets * BUCKET_SIZE)  # key ^ data, data of each slot
+        self.age = 0  # bumped every search so old entries are replaced first
+        self.hits = 0
+        self.misses = 0
+        self.collisions = 0  # probes that found the bucket filled by other positions
+        self.stores = 0
+        self.overwrites = 0  # stores that threw away another position's entry
+
+    def allocate(self, slots):
+        '''
+        Zeroed key and data arrays for a number of slots
+        '''
+        return array("Q", bytes(8 * slots)), array("Q", bytes(8 * slots))
+
+    def new_search(self):
+        '''
+        Marks everything already stored as older than what the next search stores
+        '''
+        self.age = (self.age + 1) & 0x3F
+
+    def clear(self):
+        '''
+        Empties the table and resets the counters
+        '''
+        self.keys, self.data = self.allocate(self.buckets * BUCKET_SIZE)
+        self.age = 0
+        self.hits = self.misses = self.collisions = self.stores = self.overwrites = 0
+
+    def probe(self, key):
+        '''
+        Returns (score, depth, bound, move) stored for key, or None
+        '''
+        i = (key & self.mask) * BUCKET_SIZE
+        keys = self.keys
+        data = self.data
+        first = data[i]  # each word read once, another process may be rewriting the slot
+        if first and keys[i] ^ first == key:
+            self.hits += 1
+            return unpack(first)
+        second = data[i + 1]
+        if second and keys[i + 1] ^ second == key:
+            self.hits += 1
+            return unpack(second)
+        self.misses += 1
+        if first or second:
+            self.collisions += 1
+        return None
+
+    def store(self, key, depth, score, bound, move=0):
+        '''
+        Saves a search result, keeping the deeper of two results for the first slot of the bucket
+        '''
+        i = (key & self.mask) * BUCKET_SIZE
+        keys = self.keys
+        data = self.data
+        self.stores += 1
+        if keys[i] ^ data[i] == key:  # same position as the deep slot, refresh it
+            if not move:
+                move = data[i] >> _MOVE_SHIFT & 0xFFFF  # keep the old best move rather than forgetting it
+        elif not data[i] or depth >= (data[i] >> _DEPTH_SHIFT & 0xFF) or (data[i] >> _AGE_SHIFT) != self.age:
+            if data[i]:  # demote the old deep entry to the always replace slot instead of losing it
+                if data[i + 1]:
+                    self.overwrites += 1
+                keys[i + 1] = keys[i]  # still XORed with the data moved along with it
+                data[i + 1] = data[i]
+        else:  # shallower than the deep slot: always replace the second slot
+            i += 1
+            if keys[i] ^ data[i] == key:
+                if not move:
+                    move = data[i] >> _MOVE_SHIFT & 0xFFFF
+            elif data[i]:
+                self.overwrites += 1
+        word = pack(score, depth, bound, move, self.age)
+        data[i] = word
+        keys[i] = key ^ word
+
+    def hashfull(self):
+        '''
+        Permille of the first 1000 slots written during the current search (UCI "hashfull")
+        '''
+        sample = min(1000, len(self.data))
+        used = sum(1 for i in range(sample) if self.data[i] and self.data[i] >> _AGE_SHIFT == self.age)
+        return used * 1000 // sample
+
+    def stats(self):
+        '''
+        Counters as a dict, for sizing the table
+        '''
+        probes = self.hits + self.misses
+        return {"size_mb": self.size_mb, "entries": len(self.data), "hits": self.hits, "misses": self.misses,
+                "collisions": self.collisions, "stores": self.stores, "overwrites": self.overwrites,
+                "hit_rate": self.hits / probes if probes else 0.0, "hashfull": self.hashfull()}
+
+
+class SharedTranspositionTable(TranspositionTable):
+    '''
+    A TranspositionTable whose slots live in multiprocessing.shared_memory so worker processes can search into
+    one table: create it in the parent, then attach in each child process with SharedTranspositionTable(size_mb, name)
+    clear() empties it for every process, the creator unlinks the memory on close(), counters and age are per process
+    '''
+    def __init__(self, size_mb=16, name=None):
+        self.owner = name is None
+        self.name = name
+        self.memory = None
+        super().__init__(size_mb)
+
+    def allocate(self, slots):
+        '''
+        Key and data views over the shared memory, created (zeroed) or attached to by name
+        '''
+        if self.memory is None:
+            if self.owner:
+                self.memory = shared_memory.SharedMemory(create=True, size=2 * 8 * slots)
+                self.memory.buf[:] = bytes(2 * 8 * slots)
+            else:
+                self.memory = shared_memory.SharedMemory(self.name)
+            self.name = self.memory.name
+            return self.memory.buf[:8 * slots].cast("Q"), self.memory.buf[8 * slots:].cast("Q")
+        self.memory.buf[:] = bytes(len(self.memory.buf))  # clear(): same memory, emptied
+        return self.keys, self.data
+
+    def close(self):
+        '''
+        Detaches from the shared memory (and frees it, in the process that created it)
+        '''
+        if self.memory is None:
+            return
+        self.keys.release()
+        self.data.release()
+        self.keys = self.data = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+        self.memory = None
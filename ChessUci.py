@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+UCI front end: reads commands from stdin and answers on stdout so GUIs and match runners can drive the engine
+searches run on a background thread, the command loop keeps reading so stop, ponderhit and isready are handled
+while a search is going on
+"""
+
+import sys
+import threading
+import time
+
+import ChessEngine
+import ChessSearch
+from ChessBitboard import SQ_TO_RC
+from ChessBook import OpeningBook
+from ChessParallel import ParallelSearch
+from ChessEngine import PROMOTION_PIECES
+from ChessFen import START_FEN, square_name
+from ChessTablebase import Tablebases
+from ChessTransposition import TranspositionTable
+
+ENGINE_NAME = "ChessEngine"
+ENGINE_AUTHOR = "ChessEngine authors"
+MOVE_OVERHEAD = 0.05  # seconds kept back from every move for the GUI and pipes
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining time is spread over when the GUI doesn't say
+_GO_NUMBERS = ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes")
+
+
+def uci_move(m):
+    '''
+    Long algebraic notation of a packed move ("e2e4", "e7e8q"), castling is the king's two square move
+    '''
+    return square_name(*SQ_TO_RC[m & 63]) + square_name(*SQ_TO_RC[m >> 6 & 63]) + \
+        PROMOTION_PIECES[m >> 12 & 7].lower()
+
+
+def parse_uci_move(gs, text):
+    '''
+    The legal packed move written as text in long algebraic notation, raises ValueError if there is none
+    '''
+    for m in gs.generate_valid_moves([]):
+        if uci_move(m) == text:
+            return m
+    raise ValueError("illegal move %r" % text)
+
+
+def uci_score(score):
+    '''
+    "cp 35" or "mate 3" / "mate -2" (in moves, not plies) for a search score
+    '''
+    if score > ChessSearch.MATE_BOUND:
+        return "mate %d" % ((ChessSearch.MATE - score + 1) // 2)
+    if score < -ChessSearch.MATE_BOUND:
+        return "mate %d" % -((ChessSearch.MATE + score) // 2)
+    return "cp %d" % score
+
+
+def time_budget(time_left, increment=0.0, moves_to_go=None):
+    '''
+    Seconds to spend on a move given the clock (all in seconds)
+    '''
+    budget = time_left / (moves_to_go or DEFAULT_MOVES_TO_GO) + increment * 0.75
+    return max(min(budget, time_left / 2) - MOVE_OVERHEAD, 0.01)
+
+
+class UciEngine:
+    '''
+    One UCI session: the current position, options and the search thread
+    '''
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()  # info lines come from the search thread
+        self.gs = ChessEngine.GameState()
+        self.hash_mb = 16
+        self.threads = 1
+        self.own_book = False
+        self.book = None
+        self.tablebases = None
+        self.searcher = None
+        self.new_searcher()
+        self.thread = None
+        self.infinite = False  # go infinite or go ponder: bestmove waits for stop/ponderhit
+        self.pondering = False
+        self.ponder_budget = None  # seconds to search once ponderhit arrives
+        self.released = threading.Event()  # set by stop/ponderhit
+        self.commands = {"uci": self.uci, "isready": self.isready, "setoption": self.setoption,
+                         "ucinewgame": self.ucinewgame, "position": self.position, "go": self.go,
+                         "stop": self.stop, "ponderhit": self.ponderhit, "quit": self.quit, "d": self.display}
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def run(self, source=sys.stdin):
+        '''
+        Handles commands until quit or end of input
+        '''
+        for line in source:
+            if not self.handle(line):
+                break
+        self.stop_search()
+
+    def handle(self, line):
+        '''
+        Handles one command line, returns False after quit (unknown commands are ignored, as UCI asks)
+        '''
+        words = line.split()
+        if not words or words[0] not in self.commands:
+            return True
+        try:
+            return self.commands[words[0]](words[1:]) is not False
+        except (ValueError, OSError) as error:  # OSError: a BookFile or TablebasePath that can't be opened
+            self.send("info string error: %s" % error)
+            return True
+
+    def uci(self, words):
+        self.send("id name %s" % ENGINE_NAME)
+        self.send("id author %s" % ENGINE_AUTHOR)
+        self.send("option name Hash type spin default 16 min 1 max 4096")
+        self.send("option name Threads type spin default 1 min 1 max 256")
+        self.send("option name Ponder type check default false")
+        self.send("option name OwnBook type check default false")
+        self.send("option name BookFile type string default <empty>")
+        self.send("option name TablebasePath type string default <empty>")
+        self.send("uciok")
+
+    def isready(self, words):
+        self.send("readyok")
+
+    def setoption(self, words):
+        text = " ".join(words)
+        if not text.startswith("name "):
+            raise ValueError("setoption needs a name")
+        name, _, value = text[5:].partition(" value ")
+        name = name.strip().lower()
+        value = value.strip()
+        self.stop_search()
+        if name == "hash":
+            self.hash_mb = max(1, int(value))
+            self.new_searcher()
+        elif name == "threads":
+            self.threads = max(1, int(value))
+            self.new_searcher()
+        elif name == "ownbook":
+            self.own_book = value.lower() == "true"
+        elif name == "bookfile":
+            if self.book is not None:
+                self.book.close()
+                self.book = None  # stays None if the new file can't be opened
+            self.book = OpeningBook(value) if value and value != "<empty>" else None
+        elif name == "tablebasepath":
+            self.tablebases = Tablebases(value) if value and value != "<empty>" else None
+            self.new_searcher()  # parallel workers open the tables themselves when they start
+        self.searcher.book = self.book if self.own_book else None
+
+    def new_searcher(self):
+        '''
+        Replaces the searcher after Hash, Threads or TablebasePath changed (more than one thread is lazy SMP)
+        '''
+        if isinstance(self.searcher, ParallelSearch):
+            self.searcher.close()
+        if self.threads > 1:
+            self.searcher = ParallelSearch(self.threads, self.hash_mb, self.tablebases)
+        else:
+            self.searcher = ChessSearch.Search(TranspositionTable(self.hash_mb), tablebases=self.tablebases)
+        self.searcher.book = self.book if self.own_book else None
+
+    def ucinewgame(self, words):
+        self.stop_search()
+        self.searcher.clear()
+        self.gs = ChessEngine.GameState()
+
+    def position(self, words):
+        self.stop_search()
+        if words[:1] == ["startpos"]:
+            fen, rest = START_FEN, words[1:]
+        elif words[:1] == ["fen"]:
+            end = words.index("moves") if "moves" in words else len(words)
+            fen, rest = " ".join(words[1:end]), words[end:]
+        else:
+            raise ValueError("position needs startpos or fen")
+        gs = ChessEngine.GameState.from_fen(fen)
+        if rest[:1] == ["moves"]:
+            for text in rest[1:]:
+                gs.make_packed(parse_uci_move(gs, text))
+        self.gs = gs
+
+    def go(self, words):
+        self.stop_search()
+        limits = {}
+        i = 0
+        while i < len(words):  # anything not understood (searchmoves and its moves, say) is skipped
+            if words[i] in ("infinite", "ponder"):
+                limits[words[i]] = True
+            elif words[i] in _GO_NUMBERS and i + 1 < len(words):
+                i += 1
+                limits[words[i - 1]] = int(words[i])
+            i += 1
+        depth = limits.get("depth", ChessSearch.MAX_PLY)
+        movetime = limits["movetime"] / 1000.0 if "movetime" in limits else None
+        side = "w" if self.gs.white_to_move else "b"
+        if movetime is None and side + "time" in limits:
+            movetime = time_budget(limits[side + "time"] / 1000.0, limits.get(side + "inc", 0) / 1000.0,
+                                   limits.get("movestogo"))
+        self.infinite = limits.get("infinite", False)
+        self.pondering = limits.get("ponder", False)
+        if self.pondering:  # search without a limit until ponderhit starts the clock
+            self.ponder_budget, movetime = movetime, None
+        self.released.clear()
+        # the search gets its own copy of the position so new commands never touch a board being searched
+        gs = ChessEngine.GameState.from_fen(self.gs.to_fen())
+        gs.position_counts = dict(self.gs.position_counts)
+        self.thread = threading.Thread(target=self.search, args=(gs, depth, movetime, limits.get("nodes")),
+                                       daemon=True)
+        self.thread.start()
+
+    def search(self, gs, depth, movetime, nodes):
+        '''
+        Search thread: runs the search, waits for stop/ponderhit if the GUI asked for that, then sends bestmove
+        '''
+        result = self.searcher.search(gs, depth, movetime, nodes, self.info)
+        if self.infinite or self.pondering:  # UCI: no bestmove until the GUI says so
+            self.released.wait()
+        if result.best_move is None:
+            self.send("bestmove 0000")
+            return
+        line = "bestmove " + uci_move(result.best_move.packed)
+        if len(result.pv) > 1:
+            line += " ponder " + uci_move(result.pv[1].packed)
+        self.send(line)
+
+    def info(self, result):
+        elapsed = max(result.elapsed, 1e-9)
+        self.send("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s"
+                  % (result.depth, uci_score(result.score), result.nodes, int(result.nodes / elapsed),
+                     int(elapsed * 1000), self.searcher.tt.hashfull(),
+                     " ".join(uci_move(move.packed) for move in result.pv)))
+
+    def stop(self, words):
+        self.stop_search()
+
+    def ponderhit(self, words):
+        '''
+        The opponent played the expected move: the ponder search goes on, now against the clock
+        '''
+        if self.pondering:
+            self.pondering = False
+            if self.ponder_budget is not None:
+                self.searcher.deadline = time.perf_counter() + self.ponder_budget
+            self.released.set()
+
+    def stop_search(self):
+        '''
+        Stops a running search and waits for its bestmove to go out
+        '''
+        if self.thread is None:
+            return
+        self.infinite = self.pondering = False
+        self.released.set()
+        while self.thread.is_alive():
+            self.searcher.stop()  # again each time round, a search that was only just starting clears the flag
+            self.thread.join(0.01)
+        self.thread = None
+
+    def quit(self, words):
+        self.stop_search()
+        if isinstance(self.searcher, ParallelSearch):
+            self.searcher.close()
+        return False
+
+    def display(self, words):
+        self.send("info string %s" % self.gs.to_fen())
+
+
+def main():
+    UciEngine().run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
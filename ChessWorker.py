@@ -0,0 +1,117 @@
+"""
+engine worker for the GUI: a separate process holding its own GameState and Search, driven over two
+multiprocessing queues, so move generation, engine moves and analysis never hold up the window's render loop
+messages are tuples, every reply carries the id of the position it was worked out for so stale ones can be
+dropped; a new request interrupts whatever search is running
+"""
+
+import multiprocessing
+import queue
+
+import ChessEngine
+from ChessFen import START_FEN
+from ChessSearch import MAX_PLY, Search
+
+
+class _InterruptibleSearch(Search):
+    '''
+    Search that gives up as soon as another request is waiting
+    '''
+    def __init__(self, requests, tt_mb):
+        super().__init__(tt_mb=tt_mb)
+        self.requests = requests
+
+    def check_limits(self):
+        super().check_limits()
+        if not self.requests.empty():
+            self.stopped = True
+
+
+def _run(requests, replies, tt_mb):
+    '''
+    Worker process main loop
+    requests: ("position", id, fen, packed moves, analyse), ("go", id, movetime), ("stop",), ("quit",)
+    replies: ("moves", id, packed legal moves, in check), ("bestmove", id, packed move or None),
+    ("info", id, depth, score for the side to move, packed pv)
+    '''
+    searcher = _InterruptibleSearch(requests, tt_mb)
+    gs = None
+    position_id = 0
+    analysing = False
+
+    def info(result):
+        replies.put(("info", position_id, result.depth, result.score, [move.packed for move in result.pv]))
+
+    while True:
+        if analysing and requests.empty():  # think about the position until told something else
+            searcher.search(gs, MAX_PLY, info=info)
+            analysing = searcher.stopped  # a search that ran to the end has nothing more to say
+            continue
+        message = requests.get()
+        kind = message[0]
+        if kind == "quit":
+            return
+        if kind == "position":
+            _, position_id, fen, moves, analysing = message
+            gs = ChessEngine.GameState.from_fen(fen)
+            for m in moves:
+                gs.make_packed(m)
+            moves = gs.generate_valid_moves([])  # also sets gs.in_check, the GUI's own GameState never does
+            replies.put(("moves", position_id, moves, gs.in_check))
+        elif kind == "go" and gs is not None:
+            _, position_id, movetime = message
+            result = searcher.search(gs, movetime=movetime, info=info)
+            replies.put(("bestmove", position_id,
+                         result.best_move.packed if result.best_move is not None else None))
+        elif kind == "stop":
+            analysing = False
+
+
+class EngineWorker:
+    '''
+    GUI side of the worker process, every method returns at once, replies are collected with poll()
+    '''
+    def __init__(self, tt_mb=32):
+        self.requests = multiprocessing.Queue()
+        self.replies = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_run, args=(self.requests, self.replies, tt_mb), daemon=True)
+        self.process.start()
+        self.position_id = 0
+
+    def set_position(self, gs, analyse=False, start_fen=START_FEN):
+        '''
+        Sends the game in gs (its start position and move_log, so repetitions count), returns the id its replies
+        carry; the legal moves come back as a "moves" reply, with analyse the worker then analyses until the next
+        request
+        '''
+        self.position_id += 1
+        self.requests.put(("position", self.position_id, start_fen, [move.packed for move in gs.move_log], analyse))
+        return self.position_id
+
+    def go(self, movetime):
+        '''
+        Asks for an engine move in the last position sent, answered by a "bestmove" reply
+        '''
+        self.requests.put(("go", self.position_id, movetime))
+
+    def stop(self):
+        self.requests.put(("stop",))
+
+    def poll(self):
+        '''
+        Replies that have arrived for the current position, older ones are dropped
+        '''
+        replies = []
+        while True:
+            try:
+                reply = self.replies.get_nowait()
+            except queue.Empty:
+                return replies
+            if reply[1] == self.position_id:
+                replies.append(reply)
+
+    def close(self):
+        self.requests.put(("quit",))
+        self.process.join(2.0)
+        if self.process.is_alive():
+            self.process.terminate()
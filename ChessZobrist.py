@@ -0,0 +1,55 @@
+"""
+zobrist keys: one random 64 bit number per (piece, square), castling rights, en passant file and side to move
+a position's key is the XOR of the numbers for everything in it, so GameState can update it move by move
+"""
+
+import random
+
+from ChessBitboard import PAWN_ATTACKS
+
+_rng = random.Random(20201018)  # fixed seed so keys are the same every run (anything stored by key stays valid)
+
+PIECE_KEYS = {piece: tuple(_rng.getrandbits(64) for _ in range(64))
+              for piece in ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")}
+SIDE_KEY = _rng.getrandbits(64)  # XORed in when black is to move
+_CASTLE_BASE = tuple(_rng.getrandbits(64) for _ in range(4))  # ws, wl, bs, bl
+# one key per combination of castling rights, indexed by castle_index
+CASTLE_KEYS = tuple((_CASTLE_BASE[0] if i & 1 else 0) ^ (_CASTLE_BASE[1] if i & 2 else 0) ^
+                    (_CASTLE_BASE[2] if i & 4 else 0) ^ (_CASTLE_BASE[3] if i & 8 else 0) for i in range(16))
+# by column of the en passant square, only hashed while a pawn could take there, like polyglot keys
+EN_PASSANT_KEYS = tuple(_rng.getrandbits(64) for _ in range(8))
+
+
+def castle_index(rights):
+    '''
+    Packs a CastleRights into a number from 0 to 15 (ws, wl, bs, bl bits)
+    '''
+    return rights.ws | rights.wl << 1 | rights.bs << 2 | rights.bl << 3
+
+
+def en_passant_key(gs):
+    '''
+    The en passant part of a GameState's key, 0 unless a pawn of the side to move attacks the en passant square
+    a double push nobody can take leaves the key as it was, so the position still repeats
+    '''
+    if not gs.en_passant_possible:
+        return 0
+    color, enemy = ("w", "b") if gs.white_to_move else ("b", "w")
+    r, c = gs.en_passant_possible
+    return EN_PASSANT_KEYS[c] if PAWN_ATTACKS[enemy][r * 8 + c] & gs.bitboards[color + "P"] else 0
+
+
+def compute_key(gs):
+    '''
+    Builds the key of a GameState from scratch (GameState keeps its own copy up to date incrementally)
+    '''
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            if piece != "--":
+                key ^= PIECE_KEYS[piece][r * 8 + c]
+    if not gs.white_to_move:
+        key ^= SIDE_KEY
+    key ^= CASTLE_KEYS[gs.castling]
+    return key ^ en_passant_key(gs)
@@ -0,0 +1,77 @@
+"""
+game archive tests: games written, replayed and found again through the position index
+"""
+
+import random
+
+import pytest
+
+import ChessArchive
+import ChessEngine
+import ChessPerft
+from ChessArchive import ArchiveWriter, GameArchive, build_index, import_pgn
+from ChessFen import START_FEN
+
+
+def _random_game(rng, fen=START_FEN, plies=60):
+    gs = ChessEngine.GameState.from_fen(fen)
+    moves = []
+    for _ in range(rng.randrange(1, plies)):
+        legal = gs.generate_valid_moves([])
+        if not legal:
+            break
+        m = rng.choice(legal)
+        gs.make_packed(m)
+        moves.append(m)
+    return fen, moves, gs
+
+
+def test_write_replay_index(tmp_path):
+    path = str(tmp_path / "games.cga")
+    rng = random.Random(24)
+    games = [_random_game(rng) for _ in range(20)] + [_random_game(rng, ChessPerft.SUITE[1][1])]
+    with ArchiveWriter(path) as writer:
+        for number, (fen, moves, gs) in enumerate(games[:15]):
+            assert writer.add(moves, "1-0", {"Round": number}, fen) == number
+    assert build_index(path) == sum(len(moves) + 1 for _, moves, _ in games[:15])
+    with ArchiveWriter(path) as writer:  # appended later, indexed by the next build
+        for fen, moves, gs in games[15:]:
+            writer.add(moves, fen=fen)
+    with GameArchive(path) as archive:
+        assert len(archive) == 21 and archive.indexed_games == 15
+        assert archive.find(games[16][2]) == []  # appended games are only found once the index is rebuilt
+    build_index(path)
+    with GameArchive(path) as archive:
+        for number, (fen, moves, gs) in enumerate(games):
+            assert archive.moves(number) == moves  # castling and en passant flags come back
+            assert archive.state(number).to_fen() == gs.to_fen()
+            assert (number, len(moves)) in archive.find(gs)
+        assert archive.headers(3) == {"Round": "3", "Result": "1-0"}
+        assert archive.headers(20)["FEN"] == ChessPerft.SUITE[1][1]
+        assert archive.count(ChessEngine.GameState()) == 20  # every game from the start position
+        assert archive.find(ChessEngine.GameState(), limit=3) == [(0, 0), (1, 0), (2, 0)]
+        assert archive.count(12345) == 0
+        with pytest.raises(IndexError):
+            archive.record(21)
+
+
+def test_import_pgn(tmp_path):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text('[White "a"]\n[Result "1-0"]\n\n1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0\n\n'
+                   '[Result "*"]\n\n1. d4 d5 2. Ke3 *\n')
+    path = str(tmp_path / "games.cga")
+    assert import_pgn([str(pgn)], path) == 2
+    with GameArchive(path) as archive:
+        assert archive.state(0).to_fen() == "r1bqkb1r/pppp1Qpp/2n2n2/4p3/2B1P3/8/PPPP1PPP/RNB1K1NR b KQkq - 0 4"
+        assert len(archive.moves(1)) == 2  # kept up to the last good move
+        assert "4. Qxf7# 1-0" in archive.pgn(0)
+    with open(path, "wb") as file:
+        file.write(b"nope")
+    with pytest.raises(ValueError):
+        GameArchive(path)
+
+
+def test_move_encoding():
+    gs = ChessEngine.GameState.from_fen(ChessPerft.SUITE[1][1])
+    for m in gs.generate_valid_moves([]):
+        assert ChessArchive.decode_move(gs.board, ChessArchive.encode_move(m)) == m
@@ -0,0 +1,57 @@
+"""
+batch analysis tests: in process and pooled runs give the same results, in order or not
+"""
+
+import pytest
+
+import ChessBatch
+import ChessPerft
+
+POSITIONS = [fen for _, fen, _ in ChessPerft.SUITE] + [["e2e4", "e7e5"], ["d2d4"], ["e2e5"]]
+
+
+def _expected(position):
+    try:
+        gs = ChessBatch.decode(ChessBatch.encode(position))
+    except ValueError:
+        return None
+    return ChessPerft.perft(gs, 2)
+
+
+EXPECTED = [_expected(position) for position in POSITIONS]
+
+
+def test_expected():
+    assert EXPECTED[:len(ChessPerft.SUITE)] == [counts[1] for _, _, counts in ChessPerft.SUITE]
+    assert EXPECTED[-1] is None
+
+
+def _check(results):
+    assert len(results) == len(POSITIONS)
+    for result, expected in zip(results, EXPECTED):
+        if expected is None:  # e2e5 isn't a legal move
+            assert isinstance(result, ValueError)
+        else:
+            assert result == expected
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_ordered(workers):
+    with ChessBatch.BatchAnalyzer(workers, chunk_size=2) as analyzer:
+        results = list(analyzer.run(POSITIONS, "perft", depth=2))
+    assert [index for index, _ in results] == list(range(len(POSITIONS)))
+    _check([result for _, result in results])
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_unordered(workers):
+    with ChessBatch.BatchAnalyzer(workers, chunk_size=1) as analyzer:
+        results = sorted(analyzer.run(iter(POSITIONS), "perft", ordered=False, depth=2), key=lambda item: item[0])
+    assert [index for index, _ in results] == list(range(len(POSITIONS)))
+    _check([result for _, result in results])
+
+
+def test_moves_and_unknown_task():
+    assert sorted(ChessBatch.analyse([["e2e4"]], "moves", workers=0)[0])[:2] == ["a7a5", "a7a6"]
+    with pytest.raises(ValueError):
+        ChessBatch.analyse(POSITIONS, "divide", workers=0)
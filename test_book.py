@@ -0,0 +1,56 @@
+"""
+opening book tests: Polyglot keys against the published reference values, and a small book built and looked up
+"""
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+from ChessBook import OpeningBook, build_book, decode_move, encode_move, polyglot_key
+
+
+def _play(gs, moves):
+    for notation in moves:
+        gs.make_move(next(move for move in gs.get_valid_moves() if move.get_chess_notation() == notation))
+    return gs
+
+
+# reference keys from the Polyglot book format description
+@pytest.mark.parametrize("moves, key", [
+    ((), 0x463b96181691fc9c),
+    (("e2e4",), 0x823c9b50fd114196),
+    (("e2e4", "d7d5"), 0x0756b94461c50fb0),
+    (("e2e4", "d7d5", "e4e5"), 0x662fafb965db29d4),
+    (("e2e4", "d7d5", "e4e5", "f7f5"), 0x22a48b5a8e47ff78),
+    (("e2e4", "d7d5", "e4e5", "f7f5", "e1e2"), 0x652a607ca3f242c1),
+    (("e2e4", "d7d5", "e4e5", "f7f5", "e1e2", "e8f7"), 0x00fdd303c946bdd9),
+    (("a2a4", "b7b5", "h2h4", "b5b4", "c2c4"), 0x3c8123ea7b067637),
+    (("a2a4", "b7b5", "h2h4", "b5b4", "c2c4", "b4c3", "a1a3"), 0x5c3f9b829b279560),
+])
+def test_polyglot_key(moves, key):
+    assert polyglot_key(_play(ChessEngine.GameState(), moves)) == key
+
+
+def test_move_encoding():
+    gs = ChessEngine.GameState.from_fen(ChessPerft.SUITE[1][1])
+    gs.prepare_moves()
+    for m in gs.generate_valid_moves([]):
+        assert decode_move(gs, encode_move(m)) == m
+    castle = gs.parse_san("O-O")
+    assert encode_move(castle) == 7 | 4 << 6  # e1 takes h1
+
+
+def test_build_and_lookup(tmp_path):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text('[Result "1-0"]\n\n1. e4 e5 2. Nf3 1-0\n\n[Result "0-1"]\n\n1. e4 c5 0-1\n\n'
+                   '[Result "1/2-1/2"]\n\n1. d4 d5 1/2-1/2\n\n[Result "*"]\n\n1. c4 *\n')
+    path = str(tmp_path / "book.bin")
+    assert build_book([str(pgn)], path) == 5  # e4, d4, c5, d5, Nf3: e5 scored nothing, the unfinished game is left out
+    with OpeningBook(path) as book:
+        gs = ChessEngine.GameState()
+        assert len(book.moves(gs)) == 2
+        assert gs.move_to_san(book.best(gs)) == "e4"
+        _play(gs, ["e2e4"])
+        assert [gs.move_to_san(m) for m, _ in book.moves(gs)] == ["c5"]
+        _play(gs, ["c7c5", "g1f3"])
+        assert book.best(gs) is None
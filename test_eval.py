@@ -0,0 +1,58 @@
+"""
+evaluation tests: the incrementally kept piece-square score against one computed from scratch, and colour symmetry
+"""
+
+import random
+
+import pytest
+
+import ChessEngine
+import ChessEval
+import ChessPerft
+from ChessEval import compute_psqt, pack_score, unpack_score
+
+
+def test_random_walks():
+    rng = random.Random(15)
+    for _ in range(20):
+        gs = ChessEngine.GameState()
+        start = gs.psqt
+        plies = 0
+        for _ in range(rng.randrange(40, 120)):
+            moves = gs.generate_valid_moves([])
+            if not moves:
+                break
+            gs.make_packed(rng.choice(moves))
+            plies += 1
+            assert gs.psqt == compute_psqt(gs.board)
+        for _ in range(plies):
+            gs.undo_packed()
+            assert gs.psqt == compute_psqt(gs.board)
+        assert gs.psqt == start
+
+
+@pytest.mark.parametrize("mg, eg, phase", [(0, 0, 0), (-5, 7, 3), (1025, -936, 24), (-30000, -30000, 40)])
+def test_packed_lanes(mg, eg, phase):
+    assert unpack_score(pack_score(mg, eg, phase)) == (mg, eg, phase)
+    assert unpack_score(pack_score(mg, eg, phase) + pack_score(-1, 1, 1)) == (mg - 1, eg + 1, phase + 1)
+
+
+def _mirror(fen):
+    fields = fen.split()
+    board = "/".join(reversed(fields[0].split("/"))).swapcase()
+    rights = "".join(sorted(fields[2].swapcase(), key="KQkq".index)) if fields[2] != "-" else "-"
+    en_passant = fields[3][0] + str(9 - int(fields[3][1])) if fields[3] != "-" else "-"
+    return " ".join([board, "b" if fields[1] == "w" else "w", rights, en_passant] + fields[4:])
+
+
+@pytest.mark.parametrize("fen", [fen for _, fen, _ in ChessPerft.SUITE])
+def test_colour_symmetry(fen):
+    gs = ChessEngine.GameState.from_fen(fen)
+    mirrored = ChessEngine.GameState.from_fen(_mirror(fen))
+    assert ChessEval.evaluate(gs) == ChessEval.evaluate(mirrored)
+    with_mobility = ChessEval.Evaluator(terms=(ChessEval.mobility, ChessEval.king_safety))
+    assert with_mobility.evaluate(gs) == with_mobility.evaluate(mirrored)
+
+
+def test_start_position_is_level():
+    assert ChessEval.evaluate(ChessEngine.GameState()) == 0
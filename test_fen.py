@@ -0,0 +1,79 @@
+"""
+FEN and EPD tests: round trips through GameState and the EPD reader and writer
+"""
+
+import io
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+from ChessFen import START_FEN, parse_fen, parse_epd, format_epd, read_epd, write_epd
+
+
+@pytest.mark.parametrize("fen", [START_FEN] + [fen for _, fen, _ in ChessPerft.SUITE] + [
+    "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3",
+    "4k3/8/8/8/8/8/8/4K2R w K - 12 40",
+])
+def test_fen_round_trip(fen):
+    assert ChessEngine.GameState.from_fen(fen).to_fen() == fen
+
+
+def test_default_state_is_start_fen():
+    assert ChessEngine.GameState().to_fen() == START_FEN
+    assert ChessEngine.GameState.from_fen(START_FEN).zobrist_key == ChessEngine.GameState().zobrist_key
+
+
+@pytest.mark.parametrize("fen, fixed", [
+    ("4k3/8/8/8/8/8/8/4K3 w K - 0 1", "4k3/8/8/8/8/8/8/4K3 w - - 0 1"),  # no rook to castle with
+    ("r3k2r/8/8/8/8/8/8/R4K1R w KQkq - 0 1", "r3k2r/8/8/8/8/8/8/R4K1R w kq - 0 1"),
+    ("r3k1r1/8/8/8/8/8/8/R3K2R w KQkq - 0 1", "r3k1r1/8/8/8/8/8/8/R3K2R w KQq - 0 1"),
+])
+def test_unusable_castling_dropped(fen, fixed):
+    assert ChessEngine.GameState.from_fen(fen).to_fen() == fixed
+
+
+def test_clocks_optional():
+    assert ChessEngine.GameState.from_fen("8/8/8/8/8/8/8/K6k b - -").to_fen() == "8/8/8/8/8/8/8/K6k b - - 0 1"
+
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",  # 7 ranks
+    "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNX w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQxq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq e9 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0",
+    "8/8/8/8/8/8/8/4K3 w - - 0 1",  # no black king
+    "4k3/8/8/8/8/8/8/3KK3 w - - 0 1",
+    "4k3/8/8/8/8/3p4/4P3/4K3 w - d3 0 1",  # en passant square not empty
+    "4k3/8/8/8/3p4/8/4P3/4K3 w - d3 0 1",  # wrong rank for white to move
+    "4k3/8/8/8/3P4/8/8/4K3 w - d3 0 1",
+    "4k3/8/8/8/4P3/8/8/4K3 b - d3 0 1",  # no white pawn in front
+])
+def test_bad_fen(fen):
+    with pytest.raises(ValueError):
+        parse_fen(fen)
+
+
+def test_epd():
+    fen, operations = parse_epd('1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - bm Qd1+; id "BK.01";')
+    assert fen == "1k1r4/pp1b1R2/3q2pp/4p3/2B5/4Q3/PPP2B2/2K5 b - - 0 1"
+    assert operations == {"bm": ["Qd1+"], "id": ["BK.01"]}
+    assert parse_epd(START_FEN) == (START_FEN, {})
+    assert parse_epd("8/8/8/8/8/8/8/K6k w - - hmvc 7; fmvn 30;")[0] == "8/8/8/8/8/8/8/K6k w - - 7 30"
+
+
+def test_epd_file_round_trip():
+    records = [(START_FEN, {"id": "start position", "c0": ["a", "b"]}),
+               (ChessPerft.SUITE[1][1], {"bm": "Qxf6"})]
+    file = io.StringIO()
+    write_epd(file, records)
+    file.seek(0)
+    read = list(read_epd(io.StringIO("# comment\n\n" + file.getvalue())))
+    assert read == [(START_FEN, {"id": ["start position"], "c0": ["a", "b"]}),
+                    (ChessPerft.SUITE[1][1], {"bm": ["Qxf6"]})]
+    assert format_epd(START_FEN) == "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq -"
+    with pytest.raises(ValueError, match="line 2"):
+        list(read_epd(io.StringIO(START_FEN + "\nnot a position\n")))
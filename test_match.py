@@ -0,0 +1,72 @@
+"""
+match runner tests: SPRT and Elo arithmetic, adjudication and a short game between two built in searches
+"""
+
+import pytest
+
+import ChessEngine
+import ChessMatch
+from ChessMatch import MatchStats, sprt_llr
+from ChessUci import parse_uci_move
+
+
+def _game(white, black, result):
+    return {"white": white, "black": black, "result": result, "termination": "checkmate", "cpu": [0.5, 0.5],
+            "nodes": [100, 100], "counts": [10, 10]}
+
+
+def test_sprt_llr():
+    assert sprt_llr(0, 0, 0, 0, 5) == 0.0
+    assert sprt_llr(10, 0, 0, 0, 5) == 0.0  # no variance yet, nothing to go on
+    assert sprt_llr(60, 20, 40, 0, 5) > 0 > sprt_llr(40, 20, 60, 0, 5)
+    assert sprt_llr(60, 20, 40, 0, 5) == pytest.approx(-sprt_llr(60, 20, 40, 5, 0))
+    assert sprt_llr(600, 200, 400, 0, 5) > sprt_llr(60, 20, 40, 0, 5)  # more games, more evidence
+
+
+def test_match_stats():
+    stats = MatchStats("new", "old")
+    for _ in range(3):
+        stats.add(_game("new", "old", "1-0"))
+        stats.add(_game("old", "new", "0-1"))
+        stats.add(_game("old", "new", "1/2-1/2"))
+        stats.add(_game("new", "old", "0-1"))
+    assert (stats.wins, stats.draws, stats.losses, stats.games) == (6, 3, 3, 12)
+    elo, margin = stats.elo()
+    assert elo == pytest.approx(ChessMatch.score_to_elo(7.5 / 12)) and margin > 0
+    assert 0.5 < stats.los() < 1.0
+    assert stats.cpu["new"] == pytest.approx(6.0) and stats.moves["old"] == 120
+    assert stats.terminations == {"checkmate": 12}
+    assert "+6 =3 -3" in stats.summary()
+
+
+def test_sprt_decides():
+    stats = MatchStats("new", "old", elo0=0, elo1=50)
+    while stats.decision is None:
+        stats.add(_game("new", "old", "1-0"))
+        stats.add(_game("old", "new", "1/2-1/2"))
+        assert stats.games < 400
+    assert stats.decision == "H1"
+    stats.add(_game("new", "old", "0-1"))
+    assert stats.decision == "H1"  # the first decision stands
+
+
+def test_adjudicate():
+    gs = ChessEngine.GameState()
+    assert ChessMatch.adjudicate(gs, 400, 0) is None
+    for _ in range(2):
+        for text in ("g1f3", "g8f6", "f3g1", "f6g8"):
+            gs.make_packed(parse_uci_move(gs, text))
+    assert ChessMatch.adjudicate(gs, 400, 8) == ("1/2-1/2", "threefold repetition")
+    assert ChessMatch.adjudicate(ChessEngine.GameState(), 10, 10) == ("1/2-1/2", "move limit")
+    mated = ChessEngine.GameState.from_fen("rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3")
+    assert ChessMatch.adjudicate(mated, 400, 0) == ("0-1", "checkmate")
+
+
+def test_play_game():
+    white = ChessMatch.parse_engine(["name=a", "depth=1", "hash=1"])
+    black = ChessMatch.parse_engine(["name=b", "depth=1", "hash=1"])
+    game = ChessMatch.play_game((1, ChessMatch.DEFAULT_OPENINGS[1], white, black, {"max_plies": 12}))
+    assert game["termination"] == "move limit" and len(game["moves"]) == 12
+    assert '[White "a"]' in ChessMatch.game_pgn(game)
+    with pytest.raises(ValueError):
+        ChessMatch.parse_engine(["depth"])
@@ -0,0 +1,37 @@
+"""
+perft regression tests: node counts of the reference suite against their published values, run with python -m pytest
+"""
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+
+PERFT_NODES = 100000  # deepest depth of each suite position that stays under this many nodes
+
+
+@pytest.mark.parametrize("name, fen, counts", ChessPerft.SUITE, ids=[name for name, _, _ in ChessPerft.SUITE])
+def test_perft(name, fen, counts):
+    gs = ChessEngine.GameState.from_fen(fen)
+    for depth, expected in enumerate(counts, 1):
+        if expected > PERFT_NODES:
+            break
+        assert ChessPerft.perft(gs, depth) == expected, "depth %d" % depth
+    assert gs.to_fen() == fen  # make/undo left the position as it was
+
+
+def test_divide_adds_up():
+    gs = ChessEngine.GameState.from_fen(ChessPerft.SUITE[1][1])
+    split = ChessPerft.divide(gs, 2)
+    assert len(split) == 48
+    assert sum(split.values()) == 2039
+
+
+@pytest.mark.parametrize("fen, counts", [
+    ("4k3/8/8/8/8/8/8/4K3 w K - 0 1", [5, 25]),  # the castling right has no rook, so no e1g1
+    ("4k3/8/8/8/3p4/8/4P3/4K3 w - - 0 1", [6, 38]),  # e2e4 dxe3 en passant is the only ep capture
+])
+def test_perft_small(fen, counts):
+    gs = ChessEngine.GameState.from_fen(fen)
+    for depth, expected in enumerate(counts, 1):
+        assert ChessPerft.perft(gs, depth) == expected, "depth %d" % depth
@@ -0,0 +1,78 @@
+"""
+SAN and PGN tests: known moves both ways, every legal move round tripped, PGN written and read back
+"""
+
+import io
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+import ChessPgn
+from ChessFen import START_FEN
+
+
+def _notation(gs, m):
+    return ChessEngine.Move.from_packed(m, gs.board).get_chess_notation()
+
+
+@pytest.mark.parametrize("fen, san, move", [
+    (START_FEN, "Nf3", "g1f3"),
+    (START_FEN, "e4", "e2e4"),
+    (ChessPerft.SUITE[1][1], "O-O", "e1g1"),
+    (ChessPerft.SUITE[1][1], "O-O-O", "e1c1"),
+    (ChessPerft.SUITE[1][1], "Qxf6", "f3f6"),
+    (ChessPerft.SUITE[1][1], "Bxa6", "e2a6"),
+    ("r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1", "b8=Q+", "b7b8q"),
+    ("r3k3/1P6/8/8/8/8/8/4K3 w - - 0 1", "bxa8=N", "b7a8n"),
+    ("rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2", "Qh4#", "d8h4"),
+    ("8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1", "exd3", "e4d3"),
+    ("4k3/8/8/8/8/8/4K3/R6R w - - 0 1", "Rad1", "a1d1"),
+    ("4k3/8/8/8/8/8/4K3/R6R w - - 0 1", "Rhd1", "h1d1"),
+    ("4k3/8/8/R7/8/8/8/R3K3 w - - 0 1", "R5a3", "a5a3"),
+])
+def test_san(fen, san, move):
+    gs = ChessEngine.GameState.from_fen(fen)
+    m = gs.parse_san(san)
+    assert _notation(gs, m) == move
+    assert gs.move_to_san(m) == san
+
+
+@pytest.mark.parametrize("fen", [fen for _, fen, _ in ChessPerft.SUITE])
+def test_san_every_move(fen):
+    gs = ChessEngine.GameState.from_fen(fen)
+    for m in gs.generate_valid_moves([]):
+        assert gs.parse_san(gs.move_to_san(m)) == m
+
+
+@pytest.mark.parametrize("san", ["Nf4", "Ke3", "O-O", "e5", "xyz", "Ra3"])
+def test_bad_san(san):
+    with pytest.raises(ValueError):
+        ChessEngine.GameState.from_fen("4k3/8/8/R7/8/8/8/R3K3 w - - 0 1").parse_san(san)
+
+
+def test_pgn_round_trip():
+    gs = ChessEngine.GameState()
+    for san in ("e4", "e5", "Nf3", "Nc6", "Bb5", "a6", "Bxc6", "dxc6", "O-O", "f6"):
+        gs.make_move(ChessEngine.Move.from_packed(gs.parse_san(san), gs.board))
+    text = ChessPgn.game_to_pgn(gs, {"White": "a", "Black": "b"})
+    assert '[White "a"]' in text and '[Result "*"]' in text
+    assert "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Bxc6 dxc6 5. O-O f6 *" in text
+    games = list(ChessPgn.read_games(io.StringIO(text + "\n" + text)))
+    assert len(games) == 2
+    assert games[0].sans == ["e4", "e5", "Nf3", "Nc6", "Bb5", "a6", "Bxc6", "dxc6", "O-O", "f6"]
+    assert games[0].error is None and games[0].gs.to_fen() == gs.to_fen()
+    assert games[1].headers["Black"] == "b"
+
+
+def test_pgn_reader_skips_comments_and_variations():
+    text = '[Event "x"]\n\n1. e4 {best by test} (1. d4 d5) e5 $1 2. Qh5?! ; jumps out early\nNc6 1-0\n'
+    game, = ChessPgn.read_games(io.StringIO(text))
+    assert game.sans == ["e4", "e5", "Qh5?!", "Nc6"]  # annotations stay on the SAN, parse_san ignores them
+    assert game.result == "1-0"
+    assert game.error is None
+
+
+def test_pgn_bad_move_still_yielded():
+    game, = ChessPgn.read_games(io.StringIO("1. e4 e5 2. Ke3 *\n"))
+    assert game.error is not None and game.gs.to_fen().startswith("rnbqkbnr/pppp1ppp/8/4p3/4P3")
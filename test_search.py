@@ -0,0 +1,30 @@
+"""
+Search tests: node accounting and basic results
+"""
+
+import ChessEngine
+from ChessSearch import Search
+
+
+def test_horizon_nodes_counted_once():
+    # the root plus one quiescence node for each of the 20 replies, none of which allows a capture
+    assert Search().search(ChessEngine.GameState(), max_depth=1).nodes == 21
+
+
+def test_finds_mate_in_one():
+    result = Search().search(ChessEngine.GameState.from_fen("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1"), max_depth=3)
+    assert result.best_move.get_chess_notation() == "b1b8"
+    assert result.score > 0
+
+
+def test_horizon_skips_move_generation(monkeypatch):
+    calls = []
+    staged_moves = ChessEngine.GameState.staged_moves
+
+    def counted(gs, *args):
+        calls.append(1)
+        return staged_moves(gs, *args)
+
+    monkeypatch.setattr(ChessEngine.GameState, "staged_moves", counted)
+    Search().search(ChessEngine.GameState(), max_depth=1)
+    assert len(calls) == 1  # the root only, the horizon nodes go straight to quiescence
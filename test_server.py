@@ -0,0 +1,69 @@
+"""
+game server tests: requests answered by GameServer.request, errors included
+"""
+
+import asyncio
+
+from ChessServer import GameServer
+
+
+def _run(requests, workers=0, **options):
+    server = GameServer(workers, **options)
+
+    async def session():
+        return [await server.request(message) for message in requests]
+
+    try:
+        return asyncio.run(session())
+    finally:
+        server.close()
+
+
+def test_game():
+    responses = _run([{"op": "new"}, {"op": "move", "game": 1, "move": "f2f3"},
+                      {"op": "move", "game": 1, "move": "e7e5"}, {"op": "move", "game": 1, "move": "g2g4"},
+                      {"op": "moves", "game": 1},
+                      {"op": "move", "game": 1, "move": "d8h4"}, {"op": "undo", "game": 1}, {"op": "stats"}])
+    assert all(response["ok"] for response in responses)
+    assert responses[0]["game"] == 1 and responses[0]["status"] == "playing"
+    assert "d8h4" in responses[4]["moves"]
+    assert responses[5]["status"] == "checkmate"
+    assert responses[6]["fen"] == "rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq g3 0 2"
+    assert responses[7] == {"ok": True, "games": 1, "plies": 3}
+
+
+def test_engine():
+    _, engine = _run([{"op": "new", "fen": "7k/8/6K1/8/8/8/8/1Q6 w - - 0 1"},
+                      {"op": "engine", "game": 1, "depth": 2}])
+    assert engine["ok"] and engine["move"] == "b1b8" and engine["status"] == "checkmate"
+
+
+def test_errors():
+    responses = _run([{"op": "new"}, {"op": "fly"}, {"game": 1}, {"op": "move", "game": 2, "move": "e2e4"},
+                      {"op": "move", "game": 1, "move": "e2e5"}, {"op": "move", "game": 1},
+                      {"op": "undo", "game": 1}, {"op": "new", "fen": "not a fen"}, {"op": "new"}], max_games=1)
+    assert responses[0]["ok"]
+    for response in responses[1:]:
+        assert response["ok"] is False and response["error"]
+    assert responses[-1]["error"] == "server full"
+
+
+def test_close():
+    responses = _run([{"op": "new"}, {"op": "close", "game": 1}, {"op": "state", "game": 1}, {"op": "stats"}])
+    assert responses[2]["ok"] is False
+    assert responses[3]["games"] == 0
+
+
+def test_wrongly_typed_requests():
+    responses = _run([[1, 2], "state", None, {"op": "new"}, {"op": "state", "game": [1]},
+                      {"op": "move", "game": {}, "move": "e2e4"}, {"op": ["new"]}, {"op": "state", "game": 1}])
+    for i in (0, 1, 2, 4, 5, 6):
+        assert responses[i]["ok"] is False and responses[i]["error"]
+    assert responses[-1]["ok"]
+
+
+def test_engine_limits():
+    responses = _run([{"op": "new"}, {"op": "engine", "game": 1, "depth": 50, "movetime": 1e9, "max_nodes": 10 ** 12},
+                      {"op": "engine", "game": 1, "depth": "deep"}], max_depth=2)
+    assert responses[1]["ok"] and responses[1]["depth"] == 2
+    assert responses[2]["ok"] is False
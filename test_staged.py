@@ -0,0 +1,67 @@
+"""
+staged move generation tests: staged_moves and has_legal_move against generate_valid_moves
+"""
+
+import random
+
+import pytest
+
+import ChessEngine
+import ChessPerft
+
+FENS = [fen for _, fen, _ in ChessPerft.SUITE] + [
+    "rnbqkbnr/pppp1ppp/8/4p3/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2",  # mate in one to play
+    "rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3",  # checkmated
+    "7k/5Q2/6K1/8/8/8/8/8 b - - 0 1",  # stalemated
+    "4k3/8/8/8/8/8/4r3/R3K2R w KQ - 0 1",  # in check, castling not allowed
+    "8/8/8/2k5/3Pp3/8/8/4K3 b - d3 0 1",  # en passant
+]
+
+
+def _random_fens(count, seed=13):
+    rng = random.Random(seed)
+    fens = []
+    for _ in range(count):
+        gs = ChessEngine.GameState()
+        for _ in range(rng.randrange(80)):
+            moves = gs.generate_valid_moves([])
+            if not moves:
+                break
+            gs.make_packed(rng.choice(moves))
+        fens.append(gs.to_fen())
+    return fens
+
+
+@pytest.mark.parametrize("fen", FENS + _random_fens(40))
+def test_same_moves(fen):
+    gs = ChessEngine.GameState.from_fen(fen)
+    legal = gs.generate_valid_moves([])
+    in_check = gs.in_check
+    staged = list(gs.staged_moves())
+    assert sorted(staged) == sorted(legal)  # every legal move, each exactly once
+    assert gs.in_check == in_check
+    assert gs.has_legal_move() == bool(legal)
+    assert gs.to_fen() == fen
+
+
+@pytest.mark.parametrize("fen", FENS[:4])
+def test_moves_made_between_items(fen):
+    gs = ChessEngine.GameState.from_fen(fen)
+    seen = []
+    for m in gs.staged_moves():  # as the search uses it: every move made and searched before the next comes
+        seen.append(m)
+        gs.make_packed(m)
+        gs.generate_valid_moves([])
+        gs.undo_packed()
+    assert sorted(seen) == sorted(gs.generate_valid_moves([]))
+
+
+def test_order():
+    gs = ChessEngine.GameState.from_fen(ChessPerft.SUITE[1][1])
+    legal = gs.generate_valid_moves([])
+    quiet = next(m for m in legal if gs.board[(m >> 6 & 63) >> 3][m >> 6 & 7] == "--" and not m >> 15)
+    staged = list(gs.staged_moves(hash_move=quiet & 0x7FFF))
+    assert staged[0] == quiet  # hash move first, then captures
+    captures = [m for m in legal if gs.board[(m >> 6 & 63) >> 3][m >> 6 & 7] != "--"]
+    assert sorted(staged[1:1 + len(captures)]) == sorted(captures)
+    assert sorted(gs.staged_moves(hash_move=0x7FFF)) == sorted(legal)  # an illegal hash move adds nothing
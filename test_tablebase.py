@@ -0,0 +1,37 @@
+"""
+endgame table tests: freshly generated KQK and KRK tables against their known longest mates, and some probes
+"""
+
+from array import array
+
+import pytest
+
+import ChessEngine
+import ChessTablebase
+import ChessTablebaseGen
+
+
+@pytest.fixture(scope="module")
+def tablebase_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("tablebases")
+    ChessTablebaseGen.generate(["KQK", "KRK"], str(directory), workers=0, log=None)
+    return str(directory)
+
+
+@pytest.mark.parametrize("material, longest", [("KQK", 19), ("KRK", 31)])
+def test_longest_mate(tablebase_dir, material, longest):
+    with open("%s/%s%s" % (tablebase_dir, material, ChessTablebase.TABLE_SUFFIX), "rb") as file:
+        values = array("b", file.read()[ChessTablebase.HEADER_BYTES:])
+    assert max(values) == longest
+
+
+def test_probe(tablebase_dir):
+    tablebases = ChessTablebase.Tablebases(tablebase_dir)
+    try:
+        assert tablebases.probe_wdl(ChessEngine.GameState.from_fen("7k/8/6K1/8/8/8/8/1Q6 w - - 0 1")) == (1, 1)
+        assert tablebases.probe_wdl(ChessEngine.GameState.from_fen("7k/5Q2/6K1/8/8/8/8/8 b - - 0 1")) == (0, 0)
+        wdl, plies = tablebases.probe_wdl(ChessEngine.GameState.from_fen("8/8/8/3k4/8/8/8/R3K3 b - - 0 1"))
+        assert wdl == -1 and plies > 0
+        assert tablebases.probe_wdl(ChessEngine.GameState()) is None  # no table for that many pieces
+    finally:
+        tablebases.close()
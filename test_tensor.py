@@ -0,0 +1,26 @@
+"""
+board tensor tests: every batched kernel against ChessEngine/ChessEval on random positions
+"""
+
+import pytest
+
+import ChessPerft
+from ChessFen import START_FEN
+
+ChessTensor = pytest.importorskip("ChessTensor")  # needs numpy
+
+
+def test_kernels_agree():
+    fens = ChessTensor.sample_fens(300) + [fen for _, fen, _ in ChessPerft.SUITE]
+    assert ChessTensor.check(fens) == []
+
+
+def test_batch_round_trip():
+    fens = [START_FEN] + [fen for _, fen, _ in ChessPerft.SUITE]
+    batch = ChessTensor.BoardBatch.from_fens(fens)
+    assert len(batch) == len(fens)
+    assert batch.to_fens() == fens
+    assert batch.planes().shape == (len(fens), 12, 8, 8)
+    assert batch.piece_counts()[0].tolist() == [8, 2, 2, 2, 1, 1] * 2
+    both = ChessTensor.BoardBatch.concatenate([batch, batch[:2]])
+    assert both.to_fens() == fens + fens[:2]
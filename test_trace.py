@@ -0,0 +1,40 @@
+"""
+tracing tests: counters recorded by Tracer while perft runs, and the plain methods back after detaching
+"""
+
+import json
+
+import ChessEngine
+import ChessPerft
+from ChessTrace import Tracer
+
+
+def test_perft_counters():
+    gs = ChessEngine.GameState()
+    tracer = gs.enable_tracing()
+    assert ChessPerft.perft(gs, 2) == 400
+    counters = tracer.as_dict()
+    assert counters["generate_valid_moves"]["calls"] == 21  # the root and each of its 20 children
+    assert counters["generate_valid_moves"]["moves"] == 420
+    assert counters["make_packed"]["calls"] == counters["undo_packed"]["calls"] == 20
+    assert counters["check_for_pins_and_checks"]["checks"] == 0
+    # one enemy attack map per position: 22 squares for either side at the start, more after any first move
+    assert counters["attacked_squares"]["calls"] == 21
+    assert counters["attacked_squares"]["squares"] > 22 * 21
+    assert json.loads(tracer.to_json())["make_packed"]["calls"] == 20
+    assert "generate_valid_moves" in tracer.report()
+
+
+def test_reset_and_detach():
+    gs = ChessEngine.GameState()
+    tracer = Tracer(timing=False)
+    gs.enable_tracing(tracer)
+    ChessPerft.perft(gs, 1)
+    assert tracer.counters["generate_valid_moves"]["calls"] == 1
+    assert tracer.counters["generate_valid_moves"]["seconds"] == 0.0
+    tracer.reset()
+    assert tracer.counters["generate_valid_moves"]["calls"] == 0
+    gs.disable_tracing()
+    assert "generate_valid_moves" not in vars(gs)
+    ChessPerft.perft(gs, 1)
+    assert tracer.counters["generate_valid_moves"]["calls"] == 0
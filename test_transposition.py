@@ -0,0 +1,79 @@
+"""
+transposition table tests: packing, probing, the depth preferred / always replace bucket and the shared table
+"""
+
+from ChessTransposition import SharedTranspositionTable, TranspositionTable, BUCKET_SIZE, EXACT, LOWER, UPPER, \
+    pack, unpack
+
+
+def test_pack_round_trip():
+    for score in (0, 1, -1, 99999, -99999):
+        assert unpack(pack(score, 12, LOWER, 0x7FFF, 63)) == (score, 12, LOWER, 0x7FFF)
+
+
+def test_store_and_probe():
+    tt = TranspositionTable(1)
+    assert tt.probe(12345) is None
+    tt.store(12345, 4, -250, UPPER, 77)
+    assert tt.probe(12345) == (-250, 4, UPPER, 77)
+    tt.store(12345, 5, 30, EXACT)  # no move given: the old best move is kept
+    assert tt.probe(12345) == (30, 5, EXACT, 77)
+    assert tt.stats()["hits"] == 2
+
+
+def test_replacement():
+    tt = TranspositionTable(1)
+    key = 7
+    same_bucket = [key + n * tt.buckets for n in range(1, 4)]  # different positions, same bucket
+    tt.store(key, 8, 100, EXACT, 1)
+    tt.store(same_bucket[0], 3, 200, EXACT, 2)  # shallower: goes to the always replace slot
+    assert tt.probe(key) == (100, 8, EXACT, 1)
+    assert tt.probe(same_bucket[0]) == (200, 3, EXACT, 2)
+    tt.store(same_bucket[1], 2, 300, EXACT, 3)  # replaces the shallow one, the deep entry stays
+    assert tt.probe(same_bucket[0]) is None
+    assert tt.probe(key) == (100, 8, EXACT, 1)
+    tt.store(same_bucket[2], 9, 400, EXACT, 4)  # deeper: takes the first slot, the old deep entry moves down
+    assert tt.probe(same_bucket[2]) == (400, 9, EXACT, 4)
+    assert tt.probe(key) == (100, 8, EXACT, 1)
+    assert tt.probe(same_bucket[1]) is None
+    tt.new_search()
+    tt.store(same_bucket[1], 1, 500, LOWER, 5)  # entries from an older search give way whatever their depth
+    assert tt.probe(same_bucket[1]) == (500, 1, LOWER, 5)
+    assert tt.probe(same_bucket[2]) == (400, 9, EXACT, 4)
+    assert tt.probe(key) is None
+
+
+def test_clear():
+    tt = TranspositionTable(1)
+    tt.store(99, 3, 10, EXACT, 1)
+    tt.clear()
+    assert tt.probe(99) is None
+    assert tt.stats()["stores"] == 0
+
+
+def test_torn_entry_is_a_miss():
+    tt = TranspositionTable(1)
+    key = 0x123456789ABCDEF
+    tt.store(key, 6, 42, EXACT, 9)
+    i = (key & tt.mask) * BUCKET_SIZE
+    tt.data[i] ^= 1 << 20  # data rewritten without its key, as another process half way through a store leaves it
+    assert tt.probe(key) is None
+    tt.store(key, 6, 42, EXACT, 9)
+    assert tt.probe(key) == (42, 6, EXACT, 9)
+
+
+def test_shared_table():
+    tt = SharedTranspositionTable(1)
+    try:
+        other = SharedTranspositionTable(1, tt.name)  # as a worker process attaches
+        try:
+            tt.store(99, 5, -7, UPPER, 3)
+            assert other.probe(99) == (-7, 5, UPPER, 3)
+            other.store(100, 2, 1, LOWER)
+            assert tt.probe(100) == (1, 2, LOWER, 0)
+            other.clear()
+            assert tt.probe(99) is None
+        finally:
+            other.close()
+    finally:
+        tt.close()
@@ -0,0 +1,90 @@
+"""
+UCI front end tests: commands fed to UciEngine.handle, answers read back from its output
+"""
+
+import io
+import time
+
+import ChessUci
+from ChessUci import UciEngine
+
+
+def _engine():
+    return UciEngine(io.StringIO())
+
+
+def _lines(engine):
+    return engine.output.getvalue().splitlines()
+
+
+def test_handshake():
+    engine = _engine()
+    engine.handle("uci")
+    engine.handle("isready")
+    lines = _lines(engine)
+    assert lines[0].startswith("id name") and lines[-2:] == ["uciok", "readyok"]
+    assert engine.handle("quit") is False
+    assert engine.handle("nonsense 1 2 3") is True  # unknown commands are ignored
+
+
+def test_position():
+    engine = _engine()
+    engine.handle("position startpos moves e2e4 e7e5 g1f3")
+    engine.handle("d")
+    assert _lines(engine)[-1] == "info string rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2"
+    engine.handle("position fen 4k3/8/8/8/8/8/8/4K2R w K - 0 1 moves e1g1")
+    assert engine.gs.to_fen() == "4k3/8/8/8/8/8/8/5RK1 b - - 1 1"
+    engine.handle("position startpos moves e2e5")  # illegal: an error, the old position stays
+    assert _lines(engine)[-1].startswith("info string error")
+    assert engine.gs.to_fen() == "4k3/8/8/8/8/8/8/5RK1 b - - 1 1"
+
+
+def test_go_depth():
+    engine = _engine()
+    engine.handle("position fen 7k/8/6K1/8/8/8/8/1Q6 w - - 0 1")
+    engine.handle("go depth 3")
+    engine.stop_search()  # waits for the bestmove
+    lines = _lines(engine)
+    assert any(line.startswith("info depth 1 ") for line in lines)
+    assert lines[-1].split()[:2] == ["bestmove", "b1b8"]
+
+
+def test_go_infinite_waits_for_stop():
+    engine = _engine()
+    engine.handle("position startpos")
+    engine.handle("go infinite")
+    time.sleep(0.3)
+    assert not any(line.startswith("bestmove") for line in _lines(engine))
+    engine.handle("stop")
+    bestmoves = [line for line in _lines(engine) if line.startswith("bestmove")]
+    assert len(bestmoves) == 1 and bestmoves[0] != "bestmove 0000"
+
+
+def test_go_with_clock():
+    engine = _engine()
+    engine.handle("position startpos")
+    start = time.perf_counter()
+    engine.handle("go wtime 2000 btime 2000")
+    engine.thread.join(5)
+    assert time.perf_counter() - start < ChessUci.time_budget(2.0) + 1.0
+    assert _lines(engine)[-1].startswith("bestmove")
+
+
+def test_no_legal_move():
+    engine = _engine()
+    engine.handle("position fen rnb1kbnr/pppp1ppp/8/4p3/6Pq/5P2/PPPPP2P/RNBQKBNR w KQkq - 1 3")
+    engine.handle("go depth 2")
+    engine.stop_search()
+    assert _lines(engine)[-1] == "bestmove 0000"
+
+
+def test_unopenable_files(tmp_path):
+    engine = _engine()
+    engine.handle("setoption name BookFile value %s" % (tmp_path / "missing.bin"))
+    (tmp_path / "short.bin").write_bytes(b"not a book")
+    engine.handle("setoption name BookFile value %s" % (tmp_path / "short.bin"))
+    lines = _lines(engine)
+    assert len(lines) == 2 and all(line.startswith("info string error") for line in lines)
+    assert engine.book is None
+    engine.handle("isready")
+    assert _lines(engine)[-1] == "readyok"
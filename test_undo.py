@@ -0,0 +1,50 @@
+"""
+undo stack tests: long games past the preallocated capacity, taken back move by move
+"""
+
+import random
+
+import ChessEngine
+import ChessPerft
+from ChessEngine import UNDO_CAPACITY
+
+
+def test_past_capacity():
+    gs = ChessEngine.GameState()
+    rng = random.Random(12)
+    fens = [gs.to_fen()]
+    played = []
+    knights = ("g1f3", "g8f6", "f3g1", "f6g8")
+    while len(played) < UNDO_CAPACITY + 100:  # knights back and forth, then random moves
+        moves = gs.generate_valid_moves([])
+        if not moves:
+            break
+        if len(played) < UNDO_CAPACITY:
+            notation = knights[len(played) % 4]
+            m = next(m for m in moves if ChessEngine.Move.from_packed(m, gs.board).get_chess_notation() == notation)
+        else:
+            m = rng.choice(moves)
+        gs.make_packed(m)
+        played.append(m)
+        fens.append(gs.to_fen())
+    assert gs.ply == len(played) > UNDO_CAPACITY
+    assert len(gs.undo_states) >= gs.ply
+    assert gs.moves_played() == played
+    while gs.ply:
+        fens.pop()
+        gs.undo_packed()
+        assert gs.to_fen() == fens[-1]
+    assert gs.moves_played() == []
+    assert gs.repetition_count() == 1
+
+
+def test_undo_restores_state():
+    gs = ChessEngine.GameState.from_fen(ChessPerft.SUITE[1][1])  # castling, en passant and promotions all around
+    for m in gs.generate_valid_moves([]):
+        before = (gs.to_fen(), gs.zobrist_key, gs.castling, dict(gs.position_counts))
+        gs.make_packed(m)
+        for reply in gs.generate_valid_moves([]):
+            gs.make_packed(reply)
+            gs.undo_packed()
+        gs.undo_packed()
+        assert (gs.to_fen(), gs.zobrist_key, gs.castling, gs.position_counts) == before
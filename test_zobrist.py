@@ -0,0 +1,87 @@
+"""
+zobrist key tests: the key kept up by make_move/undo_move against one computed from scratch
+"""
+
+import random
+
+import ChessEngine
+from ChessZobrist import compute_key
+
+
+def _play(gs, notation):
+    for move in gs.get_valid_moves():
+        if move.get_chess_notation() == notation:
+            gs.make_move(move)
+            return
+    raise AssertionError("no move %s" % notation)
+
+
+def test_random_walks():
+    rng = random.Random(3)
+    for _ in range(20):
+        gs = ChessEngine.GameState()
+        start = gs.zobrist_key
+        plies = 0
+        for _ in range(rng.randrange(40, 120)):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+            plies += 1
+            assert gs.zobrist_key == compute_key(gs)
+        for _ in range(plies):
+            gs.undo_move()
+            assert gs.zobrist_key == compute_key(gs)
+        assert gs.zobrist_key == start
+        assert gs.repetition_count() == 1
+
+
+def test_transposition_same_key():
+    first = ChessEngine.GameState()
+    for notation in ("g1f3", "g8f6", "b1c3"):
+        _play(first, notation)
+    second = ChessEngine.GameState()
+    for notation in ("b1c3", "g8f6", "g1f3"):
+        _play(second, notation)
+    assert first.zobrist_key == second.zobrist_key
+
+
+def test_repetition_count():
+    gs = ChessEngine.GameState()
+    for _ in range(2):
+        for notation in ("g1f3", "g8f6", "f3g1", "f6g8"):
+            _play(gs, notation)
+    assert gs.repetition_count() == 3
+    gs.undo_move()
+    assert gs.repetition_count() == 2  # after f3g1, reached once in each round
+
+
+def test_en_passant_only_hashed_when_capturable():
+    first = ChessEngine.GameState()
+    for notation in ("e2e4", "g8f6", "g1f3"):
+        _play(first, notation)
+    second = ChessEngine.GameState()
+    for notation in ("g1f3", "g8f6", "e2e4"):  # e3 is the en passant square, no black pawn can take there
+        _play(second, notation)
+    assert first.zobrist_key == second.zobrist_key
+    capturable = ChessEngine.GameState.from_fen("4k3/8/8/8/3pP3/8/8/4K3 b - e3 0 1")
+    assert capturable.zobrist_key != ChessEngine.GameState.from_fen("4k3/8/8/8/3pP3/8/8/4K3 b - - 0 1").zobrist_key
+
+
+def test_repetition_after_double_push():
+    gs = ChessEngine.GameState()
+    for notation in ("e2e4", "b8c6", "g1f3", "c6b8", "f3g1"):
+        _play(gs, notation)
+    assert gs.repetition_count() == 2  # the position after e2e4, its en passant square could never be used
+
+
+def test_en_passant_random_walks():
+    rng = random.Random(5)
+    for _ in range(20):  # pawns facing each other on the fourth and fifth ranks, double pushes with a taker
+        gs = ChessEngine.GameState.from_fen("4k3/pppppppp/8/1P1P1P1P/p1p1p1p1/8/PPPPPPPP/4K3 w - - 0 1")
+        for _ in range(30):
+            moves = gs.get_valid_moves()
+            if not moves:
+                break
+            gs.make_move(rng.choice(moves))
+            assert gs.zobrist_key == compute_key(gs)